@@ -0,0 +1,341 @@
+"""
+cities_index.py — artefatti precompressi di /api/cities/index.
+
+Per ogni scope e formato l'indice viene serializzato una volta e compresso in
+gzip e, se il pacchetto `brotli` è installato, anche in brotli. La versione è
+l'hash del contenuto: ETag forte per variante di encoding ("<hash>", "<hash>-gz",
+"<hash>-br"), 304 con If-None-Match su una qualsiasi variante della versione e
+cache immutabile per gli URL con `?version=<hash>`. Gli artefatti si ricostruiscono dopo i
+caricamenti città, insieme all'indice di ricerca, e servire una richiesta costa
+solo la copia dei byte.
+
+Formati:
+- `json`: array di oggetti con i campi di CityIndexItem.
+- `columnar`: oggetto JSON ad array paralleli. region, province e locality_type
+  sono indici nella tabella `strings` (-1 = null); lat/lon sono interi a virgola
+  fissa (× `coord_scale`, ~1 m) codificati a differenze: il primo valore è
+  assoluto, i successivi sono lo scarto dal precedente.
+- `binary`: stessi array in little-endian, ogni sezione allineata a 4 byte per
+  leggerla con le TypedArray del browser senza copie:
+  header `<4sIII` (magic "MCI1", count, n_strings, coord_scale); lunghezze
+  uint16 e byte UTF-8 della tabella stringhe; lunghezze uint16 e byte UTF-8 dei
+  nomi; region, province, locality_type uint16 (0xFFFF = null); lat, lon int32.
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import importlib
+import importlib.util
+import json
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from database import City, SessionLocal
+
+INDEX_FIELDS = ("name", "region", "province", "lat", "lon", "locality_type")
+STRING_FIELDS = ("region", "province", "locality_type")
+FORMATS = ("json", "columnar", "binary")
+MEDIA_TYPES = {"json": "application/json", "columnar": "application/json", "binary": "application/octet-stream"}
+COORD_SCALE = 100_000
+BINARY_MAGIC = b"MCI1"
+BINARY_HEADER = struct.Struct("<4sIII")
+BINARY_NULL = 0xFFFF
+GZIP_LEVEL = 9
+# Qualità 11 costa circa 10 volte il tempo di compressione per pochi punti percentuali
+BROTLI_QUALITY = 9
+IMMUTABLE_MAX_AGE_SECONDS = 365 * 24 * 3600
+# Byte diversi per encoding: ogni variante ha il suo ETag forte (RFC 9110 §8.8.3)
+ETAG_SUFFIXES = {None: "", "gzip": "-gz", "br": "-br"}
+
+_artifacts: dict[tuple[str, str], "IndexArtifact"] = {}
+_build_lock = threading.Lock()
+_stats = {"builds": 0, "build_ms": None, "not_modified": 0, "served": {"br": 0, "gzip": 0, "identity": 0}}
+
+
+def brotli_available() -> bool:
+    return importlib.util.find_spec("brotli") is not None
+
+
+_brotli = importlib.import_module("brotli") if brotli_available() else None
+
+
+@dataclass(frozen=True)
+class IndexArtifact:
+    """Indice serializzato di uno scope, nelle varianti di encoding disponibili."""
+
+    version: str
+    count: int
+    identity: bytes
+    gzip: bytes
+    brotli: Optional[bytes]
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        """ETag della variante servita con questo Content-Encoding (None = identity)."""
+        return f'"{self.version}{ETAG_SUFFIXES[encoding]}"'
+
+    def body_for(self, accept_encoding: str) -> tuple[bytes, Optional[str]]:
+        """(corpo, Content-Encoding) migliore tra quelli accettati dal client."""
+        accepted = _accepted_encodings(accept_encoding)
+        if self.brotli is not None and "br" in accepted:
+            return self.brotli, "br"
+        if "gzip" in accepted:
+            return self.gzip, "gzip"
+        return self.identity, None
+
+
+def _accepted_encodings(header: str) -> set[str]:
+    accepted = set()
+    for part in header.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding)
+    if "*" in accepted:
+        accepted |= {"br", "gzip"}
+    return accepted
+
+
+def etag_matches(if_none_match: Optional[str], version: str) -> bool:
+    """
+    Confronto debole di If-None-Match (RFC 9110): ammette liste, "*" e prefisso W/.
+    Vale qualsiasi variante di encoding della versione: il contenuto decodificato è lo stesso.
+    """
+    if not if_none_match:
+        return False
+    variants = {f'"{version}{suffix}"' for suffix in ETAG_SUFFIXES.values()}
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") in variants:
+            return True
+    return False
+
+
+def _string_table(items: list[dict]) -> tuple[list[str], dict[str, np.ndarray]]:
+    """Valori distinti di region/province/locality_type e, per campo, l'indice di ogni riga (-1 = null)."""
+    strings: dict[str, int] = {}
+    columns = {}
+    for field in STRING_FIELDS:
+        columns[field] = np.asarray(
+            [-1 if item[field] is None else strings.setdefault(item[field], len(strings)) for item in items],
+            dtype=np.int64,
+        )
+    return list(strings), columns
+
+
+def _fixed_point_deltas(values: list[float]) -> np.ndarray:
+    fixed = np.round(np.asarray(values, dtype=float) * COORD_SCALE).astype(np.int64)
+    return np.diff(fixed, prepend=0)
+
+
+def _encode_json(items: list[dict]) -> bytes:
+    return json.dumps(items, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _encode_columnar(items: list[dict]) -> bytes:
+    strings, columns = _string_table(items)
+    payload = {
+        "format": "columnar",
+        "count": len(items),
+        "coord_scale": COORD_SCALE,
+        "strings": strings,
+        "name": [item["name"] for item in items],
+        **{field: columns[field].tolist() for field in STRING_FIELDS},
+        "lat": _fixed_point_deltas([item["lat"] for item in items]).tolist(),
+        "lon": _fixed_point_deltas([item["lon"] for item in items]).tolist(),
+    }
+    return _encode_json(payload)
+
+
+def _pad4(chunk: bytes) -> bytes:
+    return chunk + b"\0" * (-len(chunk) % 4)
+
+
+def _encode_texts(texts: list[str]) -> list[bytes]:
+    encoded = [text.encode("utf-8") for text in texts]
+    return [_pad4(np.asarray([len(chunk) for chunk in encoded], dtype="<u2").tobytes()), _pad4(b"".join(encoded))]
+
+
+def _encode_binary(items: list[dict]) -> bytes:
+    strings, columns = _string_table(items)
+    sections = [BINARY_HEADER.pack(BINARY_MAGIC, len(items), len(strings), COORD_SCALE)]
+    sections += _encode_texts(strings)
+    sections += _encode_texts([item["name"] for item in items])
+    for field in STRING_FIELDS:
+        ids = np.where(columns[field] < 0, BINARY_NULL, columns[field])
+        sections.append(_pad4(ids.astype("<u2").tobytes()))
+    for field in ("lat", "lon"):
+        sections.append(_fixed_point_deltas([item[field] for item in items]).astype("<i4").tobytes())
+    return b"".join(sections)
+
+
+_ENCODERS = {"json": _encode_json, "columnar": _encode_columnar, "binary": _encode_binary}
+
+
+def build_artifact(items: list[dict], fmt: str = "json") -> IndexArtifact:
+    identity = _ENCODERS[fmt](items)
+    compressed_br = _brotli.compress(identity, quality=BROTLI_QUALITY) if _brotli is not None else None
+    return IndexArtifact(
+        version=hashlib.sha256(identity).hexdigest()[:20],
+        count=len(items),
+        identity=identity,
+        # mtime=0: stessi byte a parità di contenuto, su ogni worker
+        gzip=gzip.compress(identity, compresslevel=GZIP_LEVEL, mtime=0),
+        brotli=compressed_br,
+    )
+
+
+def decode_columnar(payload: dict) -> list[dict]:
+    """Decodifica di riferimento del formato columnar (stessa logica attesa dai client)."""
+    strings = payload["strings"]
+    scale = payload["coord_scale"]
+    lat = (np.cumsum(payload["lat"], dtype=np.int64) / scale).tolist()
+    lon = (np.cumsum(payload["lon"], dtype=np.int64) / scale).tolist()
+    columns = {field: list(payload[field]) for field in STRING_FIELDS}
+    return [
+        {
+            "name": name,
+            **{field: strings[columns[field][row]] if columns[field][row] >= 0 else None for field in STRING_FIELDS},
+            "lat": lat[row],
+            "lon": lon[row],
+        }
+        for row, name in enumerate(payload["name"])
+    ]
+
+
+def binary_to_columnar(blob: bytes) -> dict:
+    """Legge le sezioni del formato binary nella stessa struttura del formato columnar."""
+    magic, count, n_strings, scale = BINARY_HEADER.unpack_from(blob)
+    if magic != BINARY_MAGIC:
+        raise ValueError("Indice città binario non riconosciuto")
+    offset = BINARY_HEADER.size
+
+    def take(dtype: str, n: int) -> np.ndarray:
+        nonlocal offset
+        values = np.frombuffer(blob, dtype=dtype, count=n, offset=offset)
+        offset += values.nbytes + (-values.nbytes % 4)
+        return values
+
+    def take_texts(n: int) -> list[str]:
+        nonlocal offset
+        lengths = take("<u2", n).tolist()
+        texts = []
+        for length in lengths:
+            texts.append(blob[offset:offset + length].decode("utf-8"))
+            offset += length
+        offset += -offset % 4
+        return texts
+
+    payload = {"format": "columnar", "count": count, "coord_scale": scale}
+    payload["strings"] = take_texts(n_strings)
+    payload["name"] = take_texts(count)
+    for field in STRING_FIELDS:
+        ids = take("<u2", count).astype(np.int64)
+        payload[field] = np.where(ids == BINARY_NULL, -1, ids).tolist()
+    payload["lat"] = take("<i4", count)
+    payload["lon"] = take("<i4", count)
+    return payload
+
+
+def decode_binary(blob: bytes) -> list[dict]:
+    """Decodifica di riferimento del formato binary."""
+    return decode_columnar(binary_to_columnar(blob))
+
+
+def _build_all(db: Session) -> dict[tuple[str, str], IndexArtifact]:
+    rows = (
+        db.query(City.name, City.region, City.province, City.lat, City.lon, City.locality_type)
+        .order_by(City.locality_type, City.name_lower)
+        .all()
+    )
+    items = [{field: getattr(row, field) for field in INDEX_FIELDS} for row in rows]
+    scopes = {
+        "comuni": [item for item in items if item["locality_type"] == "comune"],
+        "localita": [item for item in items if item["locality_type"] == "localita"],
+        "all": items,
+    }
+    return {
+        (scope, fmt): build_artifact(scope_items, fmt)
+        for scope, scope_items in scopes.items()
+        for fmt in FORMATS
+    }
+
+
+def _install(artifacts: dict[tuple[str, str], IndexArtifact], started: float):
+    global _artifacts
+    _artifacts = artifacts
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    _stats.update(builds=_stats["builds"] + 1, build_ms=elapsed_ms)
+    print(
+        f"[INDEX] Indice città precompresso: {artifacts['all', 'json'].count} voci, "
+        f"versione {artifacts['all', 'json'].version} in {elapsed_ms} ms"
+    )
+
+
+def rebuild() -> dict[tuple[str, str], IndexArtifact]:
+    """Ricostruisce dal database gli artefatti di tutti gli scope e li sostituisce a quelli attivi."""
+    started = time.perf_counter()
+    with _build_lock, SessionLocal() as db:
+        artifacts = _build_all(db)
+        _install(artifacts, started)
+    return artifacts
+
+
+def get_artifact(scope: str, db: Session, fmt: str = "json") -> IndexArtifact:
+    """Artefatto di scope e formato; se non ancora costruito lo costruisce con la sessione della richiesta."""
+    artifact = _artifacts.get((scope, fmt))
+    if artifact is None:
+        started = time.perf_counter()
+        with _build_lock:
+            if (scope, fmt) not in _artifacts:
+                _install(_build_all(db), started)
+            artifact = _artifacts[scope, fmt]
+    return artifact
+
+
+def record_response(encoding: Optional[str], *, not_modified: bool = False):
+    if not_modified:
+        _stats["not_modified"] += 1
+    else:
+        _stats["served"][encoding or "identity"] += 1
+
+
+def is_ready() -> bool:
+    return bool(_artifacts)
+
+
+def clear():
+    global _artifacts
+    _artifacts = {}
+
+
+def get_stats() -> dict:
+    return {
+        **_stats,
+        "served": dict(_stats["served"]),
+        "brotli": _brotli is not None,
+        "artifacts": {
+            f"{scope}/{fmt}": {
+                "version": artifact.version,
+                "count": artifact.count,
+                "bytes": {
+                    "identity": len(artifact.identity),
+                    "gzip": len(artifact.gzip),
+                    "br": len(artifact.brotli) if artifact.brotli is not None else None,
+                },
+            }
+            for (scope, fmt), artifact in _artifacts.items()
+        },
+    }
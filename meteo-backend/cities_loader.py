@@ -17,8 +17,12 @@ import io
 from pathlib import Path
 
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from database import engine, init_db, City
+from sqlalchemy import func, insert
+from database import engine, init_db, City, CityAlternateName
+import cities_index
+import city_locator
+import city_search
+import geo_grid
 
 CSV_PATH = Path(__file__).parent / "data" / "comuni_italiani.csv"
 
@@ -42,6 +46,16 @@ def _find_col(header: list, aliases: list) -> str | None:
     return None
 
 
+def _refresh_memory_indexes():
+    """Ricostruisce indice di ricerca, indice spaziale e indice precompresso del processo dopo un caricamento."""
+    try:
+        city_search.rebuild()
+        city_locator.rebuild()
+        cities_index.rebuild()
+    except Exception as e:
+        print(f"[WARN] Ricostruzione indici città fallita: {e}")
+
+
 def load_cities(truncate: bool = False) -> int:
     """
     Legge il CSV e inserisce/aggiorna i comuni nel database.
@@ -59,6 +73,7 @@ def load_cities(truncate: bool = False) -> int:
 
     with Session(engine) as session:
         if truncate:
+            session.query(CityAlternateName).delete()
             session.query(City).delete()
             session.commit()
             print("[DEL]  Tabella cities svuotata")
@@ -105,7 +120,9 @@ def load_cities(truncate: bool = False) -> int:
                     lat           = lat,
                     lon           = lon,
                     population    = int(row[col_pop]) if col_pop and row.get(col_pop, "").isdigit() else None,
-                    locality_type = "comune"
+                    locality_type = "comune",
+                    grid_cell     = geo_grid.cell_id(lat, lon),
+                    name_search   = city_search.normalize_name(name),
                 )
                 batch.append(city)
                 count += 1
@@ -121,6 +138,8 @@ def load_cities(truncate: bool = False) -> int:
                 session.commit()
 
     print(f"\n[OK] Caricati {count} comuni italiani nel database")
+    if count:
+        _refresh_memory_indexes()
     return count
 
 
@@ -222,6 +241,9 @@ ADMIN1_TO_REGION = {
     "19": "Valle d'Aosta", "20": "Veneto",
 }
 
+# Nomi alternativi GeoNames conservati al massimo per città (alcune ne hanno centinaia)
+ALTERNATE_NAMES_PER_CITY = 20
+
 # Feature codes di tipo "populated place" da includere
 POPULATED_FEATURES = {"PPL", "PPLA", "PPLA2", "PPLA3", "PPLA4", "PPLC",
                        "PPLF", "PPLL", "PPLQ", "PPLR", "PPLS", "PPLX"}
@@ -329,7 +351,9 @@ def load_geonames() -> int:
                 lat           = lat,
                 lon           = lon,
                 population    = population,
-                locality_type = "localita"
+                locality_type = "localita",
+                grid_cell     = geo_grid.cell_id(lat, lon),
+                name_search   = city_search.normalize_name(name),
             ))
             count += 1
 
@@ -341,9 +365,85 @@ def load_geonames() -> int:
             print(f"  ... inserite {min(i+500, count)} località", end="\r")
 
     print(f"\n[OK] Caricate {count} località GeoNames (esclusi {skipped_dupes} duplicati con comuni ISTAT)")
+    if count:
+        load_alternate_names()
+        _refresh_memory_indexes()
     return count
 
 
+def load_alternate_names() -> int:
+    """
+    Associa alle città i nomi alternativi GeoNames (colonna alternatenames di IT.txt),
+    normalizzati per la ricerca. Le righe GeoNames si abbinano alle città con lo
+    stesso nome entro 0.05° (come la deduplica di load_geonames): così anche i
+    comuni ISTAT ricevono i nomi alternativi della località corrispondente.
+    Ritorna il numero di nomi inseriti.
+    """
+    txt_path = GEONAMES_DIR / "IT.txt"
+    if not txt_path.exists():
+        print("[INFO] IT.txt assente, nomi alternativi GeoNames non caricati")
+        return 0
+
+    init_db()
+
+    with Session(engine) as session:
+        existing = session.query(CityAlternateName).count()
+        if existing > 0:
+            print(f"[INFO] {existing} nomi alternativi già presenti nel DB. Saltando.")
+            return existing
+        cities_by_name = {}
+        for c in session.query(City.id, City.name, City.name_lower, City.lat, City.lon).all():
+            cities_by_name.setdefault(c.name_lower, []).append(c)
+
+    rows = []
+    seen = set()
+    with open(txt_path, encoding="utf-8") as f:
+        for line in f:
+            cols = line.strip().split("\t")
+            if len(cols) < 15 or not cols[3]:
+                continue
+            if cols[6] != "P" or cols[7] not in POPULATED_FEATURES:
+                continue
+            try:
+                lat = float(cols[4])
+                lon = float(cols[5])
+            except ValueError:
+                continue
+
+            city = next(
+                (
+                    c for c in cities_by_name.get(cols[1].strip().lower(), ())
+                    if abs(lat - c.lat) < 0.05 and abs(lon - c.lon) < 0.05
+                ),
+                None,
+            )
+            if city is None:
+                continue
+
+            own_search = city_search.normalize_name(city.name)
+            added = 0
+            for alternate in cols[3].split(","):
+                alternate_search = city_search.normalize_name(alternate)
+                # Scarta sigle, scritture non latine (vuote dopo la normalizzazione) e varianti identiche
+                if len(alternate_search) < 3 or alternate_search == own_search:
+                    continue
+                if (city.id, alternate_search) in seen:
+                    continue
+                seen.add((city.id, alternate_search))
+                rows.append({"city_id": city.id, "name": alternate.strip(), "name_search": alternate_search})
+                added += 1
+                if added >= ALTERNATE_NAMES_PER_CITY:
+                    break
+
+    with Session(engine) as session:
+        for i in range(0, len(rows), 5000):
+            session.execute(insert(CityAlternateName), rows[i:i + 5000])
+            session.commit()
+
+    print(f"[OK] Caricati {len(rows)} nomi alternativi GeoNames")
+    return len(rows)
+
+
 if __name__ == "__main__":
     if "--download" in sys.argv:
         download_and_load()
@@ -0,0 +1,164 @@
+"""
+city_locator.py — città più vicine a una coordinata (GPS, link con lat/lon).
+
+Un BallTree di scikit-learn con metrica haversine (coordinate in radianti) per
+ogni scope dà il vicino più prossimo in distanza ortodromica reale, senza le
+distorsioni di un KD-tree su lat/lon a latitudini diverse. L'indice vive in
+memoria ed è ricostruito insieme a quello di ricerca; finché non è pronto si usa
+una query SQL su un riquadro attorno al punto, ordinata in Python.
+"""
+from __future__ import annotations
+
+import math
+import time
+from typing import Optional
+
+import numpy as np
+from sklearn.neighbors import BallTree
+from sqlalchemy.orm import Session
+
+from city_search import CITY_FIELDS, TYPE_PRIORITY, OTHER_TYPE_PRIORITY
+from database import City, SessionLocal
+
+EARTH_RADIUS_KM = 6371.0088
+# Oltre questa distanza una coordinata non viene attribuita a nessuna città in /api/weather
+RESOLVE_MAX_DISTANCE_KM = 10.0
+# A parità di distanza (entro 10 m) si preferisce il comune alla località
+RESOLVE_CANDIDATES = 4
+RESOLVE_TIE_KM = 0.01
+
+_locator: Optional["CityLocator"] = None
+_stats = {"builds": 0, "build_ms": None, "lookups": 0, "sql_lookups": 0}
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _as_result(row, distance_km: float) -> dict:
+    return {**{field: getattr(row, field) for field in CITY_FIELDS}, "distance_km": round(distance_km, 3)}
+
+
+class CityLocator:
+    """Indice spaziale immutabile: un BallTree haversine per scope."""
+
+    def __init__(self, rows):
+        self._rows = list(rows)
+        coords = np.radians(np.asarray([(row.lat, row.lon) for row in self._rows], dtype=float).reshape(-1, 2))
+        types = [row.locality_type for row in self._rows]
+        masks = {
+            "all": [True] * len(types),
+            "comuni": [kind == "comune" for kind in types],
+            "localita": [kind == "localita" for kind in types],
+        }
+        self._positions: dict[str, np.ndarray] = {}
+        self._trees: dict[str, BallTree] = {}
+        for scope, mask in masks.items():
+            positions = np.flatnonzero(np.asarray(mask, dtype=bool))
+            if len(positions):
+                self._positions[scope] = positions
+                self._trees[scope] = BallTree(coords[positions], metric="haversine")
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def nearest(self, lat: float, lon: float, *, limit: int = 1, max_km: float, scope: str = "all") -> list[dict]:
+        """Fino a `limit` città entro `max_km`, dalla più vicina, con la distanza in km."""
+        tree = self._trees.get(scope)
+        if tree is None:
+            return []
+        positions = self._positions[scope]
+        distances, indices = tree.query(np.radians([[lat, lon]]), k=min(limit, len(positions)))
+        results = []
+        for distance, index in zip(distances[0].tolist(), indices[0].tolist()):
+            distance_km = distance * EARTH_RADIUS_KM
+            if distance_km > max_km:
+                break
+            results.append(_as_result(self._rows[positions[index]], distance_km))
+        return results
+
+
+def rebuild() -> int:
+    """Ricostruisce l'indice dal database e lo sostituisce a quello attivo; ritorna le città indicizzate."""
+    global _locator
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        rows = db.query(*(getattr(City, field) for field in CITY_FIELDS)).all()
+    locator = CityLocator(rows)
+    _locator = locator
+
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    _stats.update(builds=_stats["builds"] + 1, build_ms=elapsed_ms)
+    print(f"[LOCATOR] Indice spaziale città pronto: {len(locator)} città in {elapsed_ms} ms")
+    return len(locator)
+
+
+def nearest_sql(db: Session, lat: float, lon: float, *, limit: int, max_km: float, scope: str = "all") -> list[dict]:
+    """Ripiego senza indice in memoria: città nel riquadro di lato 2·max_km, ordinate per distanza."""
+    dlat = max_km / 111.0
+    dlon = max_km / (111.32 * max(math.cos(math.radians(lat)), 0.01))
+    query = db.query(City).filter(
+        City.lat.between(lat - dlat, lat + dlat),
+        City.lon.between(lon - dlon, lon + dlon),
+    )
+    if scope == "comuni":
+        query = query.filter(City.locality_type == "comune")
+    elif scope == "localita":
+        query = query.filter(City.locality_type == "localita")
+
+    scored = sorted(
+        ((haversine_km(lat, lon, row.lat, row.lon), row) for row in query.all()),
+        key=lambda item: item[0],
+    )
+    return [_as_result(row, distance_km) for distance_km, row in scored[:limit] if distance_km <= max_km]
+
+
+def nearest(
+    db: Session,
+    lat: float,
+    lon: float,
+    *,
+    limit: int = 1,
+    max_km: float = RESOLVE_MAX_DISTANCE_KM,
+    scope: str = "all",
+) -> list[dict]:
+    """Città più vicine dall'indice in memoria, o dal database se l'indice non è ancora pronto."""
+    locator = _locator
+    if locator is None:
+        _stats["sql_lookups"] += 1
+        return nearest_sql(db, lat, lon, limit=limit, max_km=max_km, scope=scope)
+    _stats["lookups"] += 1
+    return locator.nearest(lat, lon, limit=limit, max_km=max_km, scope=scope)
+
+
+def resolve(db: Session, lat: float, lon: float, *, max_km: float = RESOLVE_MAX_DISTANCE_KM) -> Optional[dict]:
+    """La città a cui attribuire una coordinata: la più vicina, preferendo i comuni a parità di distanza."""
+    candidates = nearest(db, lat, lon, limit=RESOLVE_CANDIDATES, max_km=max_km)
+    if not candidates:
+        return None
+    closest = candidates[0]["distance_km"]
+    tied = [city for city in candidates if city["distance_km"] - closest <= RESOLVE_TIE_KM]
+    return min(tied, key=lambda city: TYPE_PRIORITY.get(city["locality_type"], OTHER_TYPE_PRIORITY))
+
+
+def is_ready() -> bool:
+    return _locator is not None
+
+
+def clear():
+    global _locator
+    _locator = None
+
+
+def get_stats() -> dict:
+    locator = _locator
+    return {
+        **_stats,
+        "ready": locator is not None,
+        "cities": len(locator) if locator is not None else 0,
+        "resolve_max_distance_km": RESOLVE_MAX_DISTANCE_KM,
+    }
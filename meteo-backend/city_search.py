@@ -0,0 +1,308 @@
+"""
+city_search.py — indice in memoria per l'autocompletamento di /api/cities.
+
+Le città sono numerate in ordine di rilevanza (comuni prima delle località, poi
+popolazione decrescente e nome più corto): la posizione è anche il rango. Ogni
+città ha una o più chiavi di ricerca normalizzate (nome senza accenti e
+punteggiatura più i nomi alternativi GeoNames), numerate nello stesso ordine.
+Il prefisso si risolve con bisect su un array di chiavi ordinate, la sottostringa
+con le liste di chiavi degli n-grammi, la ricerca fuzzy con la similarità sui
+trigrammi (come pg_trgm) entro un budget di posizioni lette. L'indice è
+immutabile e viene sostituito in blocco a ogni ricostruzione (avvio e
+caricamenti di cities_loader); finché non è pronto il router usa le query SQL.
+"""
+from __future__ import annotations
+
+import bisect
+import re
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import bindparam, func, or_, select, text, update
+from sqlalchemy.orm import Query, Session
+
+from database import City, CityAlternateName, SessionLocal
+
+SHORT_NGRAM_MAX = 2
+TYPE_PRIORITY = {"comune": 0, "localita": 1}
+OTHER_TYPE_PRIORITY = 2
+CITY_FIELDS = ("id", "name", "region", "province", "lat", "lon", "locality_type")
+# Ricerca fuzzy: soglia di pg_trgm, query di almeno 3 caratteri, al massimo
+# FUZZY_MAX_POSTINGS posizioni lette (si parte dai trigrammi più rari)
+FUZZY_MIN_QUERY = 3
+FUZZY_MIN_SIMILARITY = 0.3
+FUZZY_MAX_POSTINGS = 60_000
+REFRESH_CHUNK = 5000
+# Limite superiore per le chiavi che iniziano con un prefisso
+_PREFIX_END = "\U0010ffff"
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+_index: Optional["CitySearchIndex"] = None
+_pg_trgm: Optional[bool] = None
+_stats = {"builds": 0, "build_ms": None, "built_at": None, "searches": 0, "fuzzy_searches": 0}
+
+
+def normalize_name(name: str) -> str:
+    """Minuscolo senza accenti, apostrofi e trattini: "Reggio nell'Emilia" -> "reggio nell emilia"."""
+    decomposed = unicodedata.normalize("NFKD", name.casefold())
+    folded = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(_NON_ALNUM.sub(" ", folded).split())
+
+
+def _rank_key(row) -> tuple:
+    return (
+        TYPE_PRIORITY.get(row.locality_type, OTHER_TYPE_PRIORITY),
+        -(row.population or 0),
+        len(row.name_lower),
+        row.name_lower,
+    )
+
+
+def _short_ngrams(text: str) -> set[str]:
+    return {
+        text[start:start + size]
+        for size in range(1, SHORT_NGRAM_MAX + 1)
+        for start in range(len(text) - size + 1)
+    }
+
+
+def _trigrams(text: str) -> set[str]:
+    """Trigrammi con due spazi iniziali e uno finale: contengono anche quelli interni di ogni sottostringa."""
+    padded = f"  {text} "
+    return {padded[start:start + 3] for start in range(len(padded) - 2)}
+
+
+class CitySearchIndex:
+    """Indice di ricerca immutabile costruito da righe con i campi di City e dai nomi alternativi."""
+
+    def __init__(self, rows, alternate_names=()):
+        ranked = sorted(rows, key=_rank_key)
+        self._cities = [{field: getattr(row, field) for field in CITY_FIELDS} for row in ranked]
+
+        position = {row.id: pos for pos, row in enumerate(ranked)}
+        keys = [(pos, normalize_name(row.name) or row.name_lower) for pos, row in enumerate(ranked)]
+        keys += [
+            (position[city_id], name_search)
+            for city_id, name_search in alternate_names
+            if city_id in position and name_search
+        ]
+        keys = list(dict.fromkeys(sorted(keys, key=lambda key: key[0])))
+        self._keys = [name for _, name in keys]
+        self._key_city = np.asarray([pos for pos, _ in keys], dtype=np.int32)
+
+        order = sorted(range(len(self._keys)), key=self._keys.__getitem__)
+        self._sorted_keys = [self._keys[key_id] for key_id in order]
+        self._sorted_cities = self._key_city[np.asarray(order, dtype=np.int64)]
+
+        n_comuni = sum(1 for row in ranked if row.locality_type == "comune")
+        n_localita = sum(1 for row in ranked if row.locality_type == "localita")
+        self._scope_bounds = {
+            "comuni": (0, n_comuni),
+            "localita": (n_comuni, n_comuni + n_localita),
+            "all": (0, len(ranked)),
+        }
+
+        short_postings: dict[str, list[int]] = defaultdict(list)
+        trigram_postings: dict[str, list[int]] = defaultdict(list)
+        trigram_counts = []
+        for key_id, key in enumerate(self._keys):
+            for gram in _short_ngrams(key):
+                short_postings[gram].append(key_id)
+            grams = _trigrams(key)
+            trigram_counts.append(len(grams))
+            for gram in grams:
+                trigram_postings[gram].append(key_id)
+        self._short_postings = {gram: np.asarray(ids, dtype=np.int32) for gram, ids in short_postings.items()}
+        self._trigram_postings = {gram: np.asarray(ids, dtype=np.int32) for gram, ids in trigram_postings.items()}
+        self._trigram_counts = np.asarray(trigram_counts, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self._cities)
+
+    @property
+    def n_keys(self) -> int:
+        return len(self._keys)
+
+    def _prefix(self, q: str, start: int, stop: int, limit: int) -> list[int]:
+        lo = bisect.bisect_left(self._sorted_keys, q)
+        hi = bisect.bisect_right(self._sorted_keys, q + _PREFIX_END, lo)
+        cities = self._sorted_cities[lo:hi]
+        cities = cities[(cities >= start) & (cities < stop)]
+        # Una città può comparire con più chiavi: si ordinano solo le migliori, salvo troppi duplicati
+        head = 4 * limit
+        if len(cities) > head:
+            best = np.unique(np.partition(cities, head - 1)[:head])
+            if len(best) >= limit:
+                return best[:limit].tolist()
+        return np.unique(cities)[:limit].tolist()
+
+    def _candidates(self, q: str) -> np.ndarray:
+        """Chiavi (in ordine di rango) che contengono tutti gli n-grammi di q."""
+        if len(q) <= SHORT_NGRAM_MAX:
+            return self._short_postings.get(q, np.empty(0, dtype=np.int32))
+        grams = {q[start:start + 3] for start in range(len(q) - 2)}
+        lists = sorted((self._trigram_postings.get(gram) for gram in grams), key=lambda p: -1 if p is None else len(p))
+        if lists[0] is None:
+            return np.empty(0, dtype=np.int32)
+        candidates = lists[0]
+        for key_ids in lists[1:]:
+            candidates = np.intersect1d(candidates, key_ids, assume_unique=True)
+            if not len(candidates):
+                break
+        return candidates
+
+    def _contains(self, q: str, key_bounds: tuple[int, int], seen: set[int], limit: int) -> list[int]:
+        candidates = self._candidates(q)
+        lo, hi = np.searchsorted(candidates, key_bounds)
+        found = []
+        for key_id in candidates[lo:hi].tolist():
+            pos = int(self._key_city[key_id])
+            if pos in seen or (len(q) > 3 and q not in self._keys[key_id]):
+                continue
+            seen.add(pos)
+            found.append(pos)
+            if len(found) >= limit:
+                break
+        return found
+
+    def _fuzzy(self, q: str, key_bounds: tuple[int, int], seen: set[int], limit: int) -> list[int]:
+        """Città per similarità di trigrammi decrescente (poi per rango), sopra FUZZY_MIN_SIMILARITY."""
+        grams = _trigrams(q)
+        lists = sorted(
+            (self._trigram_postings[gram] for gram in grams if gram in self._trigram_postings),
+            key=len,
+        )
+        selected, scanned = [], 0
+        for key_ids in lists:
+            if selected and scanned + len(key_ids) > FUZZY_MAX_POSTINGS:
+                break
+            selected.append(key_ids)
+            scanned += len(key_ids)
+        if not selected:
+            return []
+
+        key_ids = np.concatenate(selected)
+        key_ids = key_ids[(key_ids >= key_bounds[0]) & (key_ids < key_bounds[1])]
+        shared = np.bincount(key_ids, minlength=len(self._keys))
+        hits = np.flatnonzero(shared)
+        similarity = shared[hits] / (len(grams) + self._trigram_counts[hits] - shared[hits])
+        good = similarity >= FUZZY_MIN_SIMILARITY
+        hits, similarity = hits[good], similarity[good]
+
+        found = []
+        for key_id in hits[np.lexsort((hits, -similarity))].tolist():
+            pos = int(self._key_city[key_id])
+            if pos in seen:
+                continue
+            seen.add(pos)
+            found.append(pos)
+            if len(found) >= limit:
+                break
+        return found
+
+    def search(self, q: str, *, limit: int = 8, scope: str = "all") -> list[dict]:
+        """Prima le chiavi che iniziano con q, poi quelle che lo contengono, infine le più simili."""
+        q = normalize_name(q)
+        start, stop = self._scope_bounds[scope]
+        key_bounds = tuple(np.searchsorted(self._key_city, (start, stop)).tolist())
+        positions = self._prefix(q, start, stop, limit)
+        seen = set(positions)
+        if len(positions) < limit and q:
+            positions += self._contains(q, key_bounds, seen, limit - len(positions))
+        if len(positions) < limit and len(q) >= FUZZY_MIN_QUERY:
+            _stats["fuzzy_searches"] += 1
+            positions += self._fuzzy(q, key_bounds, seen, limit - len(positions))
+        return [self._cities[pos] for pos in positions]
+
+
+def refresh_search_names() -> int:
+    """Calcola `name_search` per le città che non lo hanno (righe caricate prima della colonna)."""
+    cities = City.__table__
+    stmt = update(cities).where(cities.c.id == bindparam("city_id")).values(name_search=bindparam("search"))
+    with SessionLocal() as db:
+        stale = db.query(City.id, City.name).filter(City.name_search.is_(None)).all()
+        rows = [{"city_id": row.id, "search": normalize_name(row.name)} for row in stale]
+        for start in range(0, len(rows), REFRESH_CHUNK):
+            db.connection().execute(stmt, rows[start:start + REFRESH_CHUNK])
+        db.commit()
+    return len(rows)
+
+
+def rebuild() -> int:
+    """Ricostruisce l'indice dal database e lo sostituisce a quello attivo; ritorna le città indicizzate."""
+    global _index
+    started = time.perf_counter()
+    with SessionLocal() as db:
+        rows = db.query(
+            City.id,
+            City.name,
+            City.name_lower,
+            City.region,
+            City.province,
+            City.lat,
+            City.lon,
+            City.population,
+            City.locality_type,
+        ).all()
+        alternate_names = db.query(CityAlternateName.city_id, CityAlternateName.name_search).all()
+    index = CitySearchIndex(rows, alternate_names)
+    _index = index
+
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    _stats.update(builds=_stats["builds"] + 1, build_ms=elapsed_ms, built_at=time.time())
+    print(f"[SEARCH] Indice città pronto: {len(index)} città, {index.n_keys} chiavi in {elapsed_ms} ms")
+    return len(index)
+
+
+def search(q: str, *, limit: int = 8, scope: str = "all") -> Optional[list[dict]]:
+    """Risultati dall'indice in memoria, oppure None se l'indice non è ancora stato costruito."""
+    index = _index
+    if index is None:
+        return None
+    _stats["searches"] += 1
+    return index.search(q, limit=limit, scope=scope)
+
+
+def pg_trgm_enabled(db: Session) -> bool:
+    """True se il database è PostgreSQL con l'estensione pg_trgm (verificato una volta per processo)."""
+    global _pg_trgm
+    if _pg_trgm is None:
+        _pg_trgm = db.get_bind().dialect.name == "postgresql" and db.execute(
+            text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        ).first() is not None
+    return _pg_trgm
+
+
+def sql_fuzzy_search(base_query: Query, q: str, *, limit: int, exclude_ids: list[int]) -> list:
+    """Città simili a q con l'operatore % di pg_trgm su nome e nomi alternativi (indici GIN)."""
+    q_search = normalize_name(q)
+    if len(q_search) < FUZZY_MIN_QUERY:
+        return []
+    alternate_match = select(CityAlternateName.city_id).where(CityAlternateName.name_search.op("%")(q_search))
+    query = base_query.filter(or_(City.name_search.op("%")(q_search), City.id.in_(alternate_match)))
+    if exclude_ids:
+        query = query.filter(~City.id.in_(exclude_ids))
+    return query.order_by(func.similarity(City.name_search, q_search).desc()).limit(limit).all()
+
+
+def is_ready() -> bool:
+    return _index is not None
+
+
+def clear():
+    global _index
+    _index = None
+
+
+def get_stats() -> dict:
+    index = _index
+    return {
+        **_stats,
+        "ready": index is not None,
+        "cities": len(index) if index is not None else 0,
+        "keys": index.n_keys if index is not None else 0,
+        "pg_trgm": _pg_trgm,
+    }
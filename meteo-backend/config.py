@@ -23,6 +23,17 @@ class Settings:
     stripe_webhook_secret: str
     supporter_email_encryption_key: str
     supporter_email_hash_key: str
+    # Livello condiviso della cache meteo pubblica: memory (solo processo), sql, redis
+    public_cache_backend: str = "memory"
+    public_cache_url: str = ""
+    public_cache_ttl_seconds: int = 300
+    # Fallback single-city: ritardo prima di avviare la fonte successiva in parallelo,
+    # deadline per singola fonte e per l'intera richiesta
+    public_hedge_delay_seconds: float = 1.5
+    public_stage_deadline_seconds: float = 8.0
+    public_request_deadline_seconds: float = 12.0
+    # Passo in gradi della griglia che raggruppa località vicine sotto una sola previsione (0 = disattiva)
+    public_grid_step_degrees: float = 0.05
 
     @property
     def is_production(self) -> bool:
@@ -66,6 +77,13 @@ def load_settings() -> Settings:
         stripe_webhook_secret=os.getenv("STRIPE_WEBHOOK_SECRET", "").strip(),
         supporter_email_encryption_key=os.getenv("SUPPORTER_EMAIL_ENCRYPTION_KEY", "").strip(),
         supporter_email_hash_key=os.getenv("SUPPORTER_EMAIL_HASH_KEY", "").strip(),
+        public_cache_backend=os.getenv("PUBLIC_CACHE_BACKEND", "memory").strip().lower() or "memory",
+        public_cache_url=os.getenv("PUBLIC_CACHE_URL", "").strip(),
+        public_cache_ttl_seconds=int(os.getenv("PUBLIC_CACHE_TTL_SECONDS", "300")),
+        public_hedge_delay_seconds=float(os.getenv("PUBLIC_HEDGE_DELAY_SECONDS", "1.5")),
+        public_stage_deadline_seconds=float(os.getenv("PUBLIC_STAGE_DEADLINE_SECONDS", "8")),
+        public_request_deadline_seconds=float(os.getenv("PUBLIC_REQUEST_DEADLINE_SECONDS", "12")),
+        public_grid_step_degrees=float(os.getenv("PUBLIC_GRID_STEP_DEGREES", "0.05")),
     )
 
 
@@ -5,7 +5,7 @@ import os
 from pathlib import Path
 from sqlalchemy import (
     create_engine, Column, Integer, BigInteger, Text, Float,
-    Boolean, DateTime, LargeBinary, ForeignKey, Index, text
+    Boolean, Date, DateTime, LargeBinary, ForeignKey, Index, text
 )
 from sqlalchemy.orm import DeclarativeBase, relationship, sessionmaker
 from dotenv import load_dotenv
@@ -49,11 +49,23 @@ class City(Base):
     lon        = Column(Float, nullable=False)
     population    = Column(Integer)
     locality_type = Column(Text, default="comune")  # "comune" (ISTAT) o "localita" (GeoNames)
+    grid_cell     = Column(Text)  # cella della griglia meteo condivisa ("passo:i:j", vedi geo_grid)
+    name_search   = Column(Text)  # nome senza accenti e punteggiatura (vedi city_search.normalize_name)
 
     observations = relationship("WeatherObservation", back_populates="city", lazy="dynamic")
     predictions  = relationship("MlPrediction", back_populates="city", lazy="dynamic")
 
 
+class CityAlternateName(Base):
+    """Nome alternativo GeoNames di una città, già normalizzato per la ricerca."""
+    __tablename__ = "city_alternate_names"
+
+    id          = Column(Integer, primary_key=True)
+    city_id     = Column(Integer, ForeignKey("cities.id"), nullable=False)
+    name        = Column(Text, nullable=False)
+    name_search = Column(Text, nullable=False)
+
+
 class WeatherObservation(Base):
     """Osservazione meteo reale raccolta ogni ora dal cron job."""
     __tablename__ = "weather_observations"
@@ -116,6 +128,30 @@ class MlModelStore(Base):
     n_samples   = Column(Integer)
 
 
+class MlErrorStat(Base):
+    """Aggregati incrementali dell'errore per giorno (UTC di predicted_at), regione e lead time."""
+    __tablename__ = "ml_error_stats"
+
+    id            = Column(Integer, primary_key=True)
+    day           = Column(Date, nullable=False)
+    region        = Column(Text, nullable=False)
+    lead_hours    = Column(Integer, nullable=False)
+    n_predictions = Column(Integer, nullable=False, default=0)
+    n_verified    = Column(Integer, nullable=False, default=0)
+    sum_abs_error = Column(Float, nullable=False, default=0.0)
+    sum_error     = Column(Float, nullable=False, default=0.0)
+
+
+class PublicWeatherCacheEntry(Base):
+    """Livello condiviso della cache meteo pubblica (payload compatti, vedi weather_cache)."""
+    __tablename__ = "public_weather_cache"
+
+    cache_key  = Column(Text, primary_key=True)
+    stored_at  = Column(Float, nullable=False)
+    expires_at = Column(Float, nullable=False, index=True)
+    payload    = Column(LargeBinary, nullable=False)
+
+
 class Supporter(Base):
     """Supporter che ha completato almeno una donazione."""
     __tablename__ = "supporters"
@@ -155,8 +191,11 @@ Index("idx_obs_city_time",  WeatherObservation.city_id, WeatherObservation.obser
 Index("idx_pred_city_time", MlPrediction.city_id, MlPrediction.predicted_at)
 Index("idx_pred_target_time", MlPrediction.city_id, MlPrediction.target_time)
 Index("idx_pred_verified",  MlPrediction.verified)
+Index("idx_error_stats_bucket", MlErrorStat.day, MlErrorStat.region, MlErrorStat.lead_hours, unique=True)
 Index("idx_cities_name",    City.name_lower)
 Index("idx_cities_type",    City.locality_type)
+Index("idx_cities_grid_cell", City.grid_cell)
+Index("idx_city_alt_names_city_id", CityAlternateName.city_id)
 Index("idx_supporters_email_lookup_hash", Supporter.email_lookup_hash)
 Index("idx_supporter_tokens_supporter_id", SupporterToken.supporter_id)
 Index("idx_supporter_tokens_token_hash", SupporterToken.token_hash)
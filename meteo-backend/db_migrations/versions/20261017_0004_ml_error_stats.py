@@ -0,0 +1,135 @@
+"""Add materialized forecast error statistics.
+
+Revision ID: 20261017_0004
+Revises: 20260404_0003
+Create Date: 2026-10-17 09:30:00
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20261017_0004"
+down_revision = "20260404_0003"
+branch_labels = None
+depends_on = None
+
+
+def _has_table(inspector, table_name: str) -> bool:
+    return table_name in inspector.get_table_names()
+
+
+def _has_index(inspector, table_name: str, index_name: str) -> bool:
+    return index_name in {index["name"] for index in inspector.get_indexes(table_name)}
+
+
+def _backfill(bind) -> None:
+    """Ricostruisce gli aggregati dallo storico già presente in ml_predictions."""
+    metadata = sa.MetaData()
+    predictions = sa.Table(
+        "ml_predictions",
+        metadata,
+        sa.Column("city_id", sa.Integer()),
+        sa.Column("predicted_at", sa.DateTime(timezone=True)),
+        sa.Column("lead_hours", sa.Integer()),
+        sa.Column("verified", sa.Boolean()),
+        sa.Column("error", sa.Float()),
+    )
+    cities = sa.Table("cities", metadata, sa.Column("id", sa.Integer()), sa.Column("region", sa.Text()))
+    stats = sa.Table(
+        "ml_error_stats",
+        metadata,
+        sa.Column("day", sa.Date()),
+        sa.Column("region", sa.Text()),
+        sa.Column("lead_hours", sa.Integer()),
+        sa.Column("n_predictions", sa.Integer()),
+        sa.Column("n_verified", sa.Integer()),
+        sa.Column("sum_abs_error", sa.Float()),
+        sa.Column("sum_error", sa.Float()),
+    )
+
+    query = sa.select(
+        predictions.c.predicted_at,
+        predictions.c.lead_hours,
+        predictions.c.verified,
+        predictions.c.error,
+        cities.c.region,
+    ).select_from(predictions.outerjoin(cities, predictions.c.city_id == cities.c.id))
+
+    buckets: dict[tuple, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    for row in bind.execute(query.execution_options(yield_per=5000)):
+        predicted_at = row.predicted_at
+        if predicted_at is None:
+            continue
+        if predicted_at.tzinfo is not None:
+            predicted_at = predicted_at.astimezone(timezone.utc)
+        bucket = buckets[(predicted_at.date(), row.region or "Sconosciuta", row.lead_hours or 0)]
+        bucket["n_predictions"] += 1
+        if row.verified and row.error is not None:
+            bucket["n_verified"] += 1
+            bucket["sum_abs_error"] += abs(row.error)
+            bucket["sum_error"] += row.error
+
+    if buckets:
+        bind.execute(stats.insert(), [
+            {
+                "day": day,
+                "region": region,
+                "lead_hours": lead_hours,
+                "n_predictions": int(values["n_predictions"]),
+                "n_verified": int(values["n_verified"]),
+                "sum_abs_error": values["sum_abs_error"],
+                "sum_error": values["sum_error"],
+            }
+            for (day, region, lead_hours), values in buckets.items()
+        ])
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    if not _has_table(inspector, "ml_error_stats"):
+        op.create_table(
+            "ml_error_stats",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("day", sa.Date(), nullable=False),
+            sa.Column("region", sa.Text(), nullable=False),
+            sa.Column("lead_hours", sa.Integer(), nullable=False),
+            sa.Column("n_predictions", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("n_verified", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("sum_abs_error", sa.Float(), nullable=False, server_default="0"),
+            sa.Column("sum_error", sa.Float(), nullable=False, server_default="0"),
+        )
+        op.create_index(
+            "idx_error_stats_bucket",
+            "ml_error_stats",
+            ["day", "region", "lead_hours"],
+            unique=True,
+        )
+        if _has_table(inspector, "ml_predictions") and _has_table(inspector, "cities"):
+            _backfill(bind)
+        return
+
+    inspector = sa.inspect(bind)
+    if not _has_index(inspector, "ml_error_stats", "idx_error_stats_bucket"):
+        op.create_index(
+            "idx_error_stats_bucket",
+            "ml_error_stats",
+            ["day", "region", "lead_hours"],
+            unique=True,
+        )
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    if _has_table(inspector, "ml_error_stats"):
+        if _has_index(inspector, "ml_error_stats", "idx_error_stats_bucket"):
+            op.drop_index("idx_error_stats_bucket", table_name="ml_error_stats")
+        op.drop_table("ml_error_stats")
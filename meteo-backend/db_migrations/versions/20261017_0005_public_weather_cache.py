@@ -0,0 +1,52 @@
+"""Add shared public weather cache table.
+
+Revision ID: 20261017_0005
+Revises: 20261017_0004
+Create Date: 2026-10-17 15:00:00
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20261017_0005"
+down_revision = "20261017_0004"
+branch_labels = None
+depends_on = None
+
+
+def _has_table(inspector, table_name: str) -> bool:
+    return table_name in inspector.get_table_names()
+
+
+def _has_index(inspector, table_name: str, index_name: str) -> bool:
+    return index_name in {index["name"] for index in inspector.get_indexes(table_name)}
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    if not _has_table(inspector, "public_weather_cache"):
+        op.create_table(
+            "public_weather_cache",
+            sa.Column("cache_key", sa.Text(), primary_key=True),
+            sa.Column("stored_at", sa.Float(), nullable=False),
+            sa.Column("expires_at", sa.Float(), nullable=False),
+            sa.Column("payload", sa.LargeBinary(), nullable=False),
+        )
+        inspector = sa.inspect(bind)
+
+    if not _has_index(inspector, "public_weather_cache", "ix_public_weather_cache_expires_at"):
+        op.create_index("ix_public_weather_cache_expires_at", "public_weather_cache", ["expires_at"])
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    if _has_table(inspector, "public_weather_cache"):
+        if _has_index(inspector, "public_weather_cache", "ix_public_weather_cache_expires_at"):
+            op.drop_index("ix_public_weather_cache_expires_at", table_name="public_weather_cache")
+        op.drop_table("public_weather_cache")
@@ -0,0 +1,47 @@
+"""Add grid cell column to cities.
+
+Revision ID: 20261017_0006
+Revises: 20261017_0005
+Create Date: 2026-10-17 18:00:00
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20261017_0006"
+down_revision = "20261017_0005"
+branch_labels = None
+depends_on = None
+
+
+def _has_column(inspector, table_name: str, column_name: str) -> bool:
+    return column_name in {column["name"] for column in inspector.get_columns(table_name)}
+
+
+def _has_index(inspector, table_name: str, index_name: str) -> bool:
+    return index_name in {index["name"] for index in inspector.get_indexes(table_name)}
+
+
+def upgrade() -> None:
+    # I valori vengono calcolati all'avvio da geo_grid.refresh_city_cells con il passo configurato
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    if not _has_column(inspector, "cities", "grid_cell"):
+        op.add_column("cities", sa.Column("grid_cell", sa.Text(), nullable=True))
+        inspector = sa.inspect(bind)
+
+    if not _has_index(inspector, "cities", "idx_cities_grid_cell"):
+        op.create_index("idx_cities_grid_cell", "cities", ["grid_cell"])
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    if _has_index(inspector, "cities", "idx_cities_grid_cell"):
+        op.drop_index("idx_cities_grid_cell", table_name="cities")
+    if _has_column(inspector, "cities", "grid_cell"):
+        op.drop_column("cities", "grid_cell")
@@ -0,0 +1,96 @@
+"""Add normalized search names and GeoNames alternate names.
+
+Revision ID: 20261017_0007
+Revises: 20261017_0006
+Create Date: 2026-10-17 19:00:00
+"""
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "20261017_0007"
+down_revision = "20261017_0006"
+branch_labels = None
+depends_on = None
+
+TRGM_INDEXES = {
+    "ix_cities_name_search_trgm": "cities",
+    "ix_city_alt_names_name_search_trgm": "city_alternate_names",
+}
+
+
+def _has_table(inspector, table_name: str) -> bool:
+    return table_name in inspector.get_table_names()
+
+
+def _has_column(inspector, table_name: str, column_name: str) -> bool:
+    return column_name in {column["name"] for column in inspector.get_columns(table_name)}
+
+
+def _has_index(inspector, table_name: str, index_name: str) -> bool:
+    return index_name in {index["name"] for index in inspector.get_indexes(table_name)}
+
+
+def _enable_pg_trgm(bind) -> bool:
+    """Attiva pg_trgm se disponibile; senza privilegi o estensione la ricerca resta in memoria/LIKE."""
+    available = bind.execute(sa.text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).first()
+    if available is None:
+        return False
+    savepoint = bind.begin_nested()
+    try:
+        bind.execute(sa.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except sa.exc.DBAPIError:
+        savepoint.rollback()
+        return False
+    savepoint.commit()
+    return True
+
+
+def upgrade() -> None:
+    # I valori di name_search vengono calcolati all'avvio da city_search.refresh_search_names
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    if not _has_column(inspector, "cities", "name_search"):
+        op.add_column("cities", sa.Column("name_search", sa.Text(), nullable=True))
+
+    if not _has_table(inspector, "city_alternate_names"):
+        op.create_table(
+            "city_alternate_names",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("city_id", sa.Integer(), sa.ForeignKey("cities.id"), nullable=False),
+            sa.Column("name", sa.Text(), nullable=False),
+            sa.Column("name_search", sa.Text(), nullable=False),
+        )
+    inspector = sa.inspect(bind)
+
+    if not _has_index(inspector, "city_alternate_names", "idx_city_alt_names_city_id"):
+        op.create_index("idx_city_alt_names_city_id", "city_alternate_names", ["city_id"])
+
+    if bind.dialect.name == "postgresql" and _enable_pg_trgm(bind):
+        for index_name, table_name in TRGM_INDEXES.items():
+            if not _has_index(inspector, table_name, index_name):
+                op.create_index(
+                    index_name,
+                    table_name,
+                    ["name_search"],
+                    postgresql_using="gin",
+                    postgresql_ops={"name_search": "gin_trgm_ops"},
+                )
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    for index_name, table_name in TRGM_INDEXES.items():
+        if _has_table(inspector, table_name) and _has_index(inspector, table_name, index_name):
+            op.drop_index(index_name, table_name=table_name)
+    if _has_table(inspector, "city_alternate_names"):
+        if _has_index(inspector, "city_alternate_names", "idx_city_alt_names_city_id"):
+            op.drop_index("idx_city_alt_names_city_id", table_name="city_alternate_names")
+        op.drop_table("city_alternate_names")
+    if _has_column(inspector, "cities", "name_search"):
+        op.drop_column("cities", "name_search")
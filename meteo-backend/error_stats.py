@@ -0,0 +1,149 @@
+"""
+error_stats.py — statistiche materializzate dell'errore di previsione.
+
+Gli aggregati per giorno (UTC di `predicted_at`), regione e lead time vengono
+aggiornati in modo incrementale dal ciclo orario: le letture sommano al più
+giorni di retention × regioni × lead bucket, indipendentemente dal volume
+di `ml_predictions`. La retention degli aggregati procede per giorni interi
+(vedi `prune`).
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from typing import Iterable
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from database import City, MlErrorStat
+
+UNKNOWN_REGION = "Sconosciuta"
+_COUNTERS = ("n_predictions", "n_verified", "sum_abs_error", "sum_error")
+_BUCKET_COLUMNS = ("day", "region", "lead_hours")
+
+
+def _bucket_day(predicted_at: datetime) -> date:
+    if predicted_at.tzinfo is not None:
+        predicted_at = predicted_at.astimezone(timezone.utc)
+    return predicted_at.date()
+
+
+def city_regions(db: Session, city_ids: Iterable[int]) -> dict[int, str]:
+    ids = set(city_ids)
+    if not ids:
+        return {}
+    rows = db.query(City.id, City.region).filter(City.id.in_(ids)).all()
+    return {row.id: row.region or UNKNOWN_REGION for row in rows}
+
+
+def _upsert(db: Session, increments: dict[tuple, dict[str, float]]):
+    if not increments:
+        return
+
+    rows = [
+        {**dict(zip(_BUCKET_COLUMNS, key)), **{name: values.get(name, 0) for name in _COUNTERS}}
+        for key, values in increments.items()
+    ]
+    dialect = db.get_bind().dialect.name
+    if dialect in {"postgresql", "sqlite"}:
+        insert = pg_insert if dialect == "postgresql" else sqlite_insert
+        stmt = insert(MlErrorStat)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(_BUCKET_COLUMNS),
+            set_={name: MlErrorStat.__table__.c[name] + stmt.excluded[name] for name in _COUNTERS},
+        )
+        db.execute(stmt, rows)
+        return
+
+    for row in rows:
+        bucket = db.query(MlErrorStat).filter_by(**{name: row[name] for name in _BUCKET_COLUMNS}).first()
+        if bucket is None:
+            db.add(MlErrorStat(**row))
+            continue
+        for name in _COUNTERS:
+            setattr(bucket, name, getattr(bucket, name) + row[name])
+
+
+def record_predictions(db: Session, rows: Iterable[tuple[int, datetime, int | None]]):
+    """Incrementa `n_predictions` per righe (city_id, predicted_at, lead_hours) appena salvate."""
+    rows = list(rows)
+    regions = city_regions(db, (city_id for city_id, _, _ in rows))
+    increments: dict[tuple, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    for city_id, predicted_at, lead_hours in rows:
+        key = (_bucket_day(predicted_at), regions.get(city_id, UNKNOWN_REGION), lead_hours or 0)
+        increments[key]["n_predictions"] += 1
+    _upsert(db, increments)
+
+
+def record_verifications(db: Session, rows: Iterable[tuple[int, datetime, int | None, float | None]]):
+    """Accumula l'errore per righe (city_id, predicted_at, lead_hours, error) appena verificate."""
+    rows = [row for row in rows if row[3] is not None]
+    regions = city_regions(db, (row[0] for row in rows))
+    increments: dict[tuple, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    for city_id, predicted_at, lead_hours, error in rows:
+        key = (_bucket_day(predicted_at), regions.get(city_id, UNKNOWN_REGION), lead_hours or 0)
+        bucket = increments[key]
+        bucket["n_verified"] += 1
+        bucket["sum_abs_error"] += abs(error)
+        bucket["sum_error"] += error
+    _upsert(db, increments)
+
+
+def prune(db: Session, cutoff: datetime) -> int:
+    """
+    Rimuove i bucket fino al giorno del cutoff di retention compreso.
+    La finestra degli aggregati è misurata in giorni UTC interi: il giorno del cutoff,
+    già in parte cancellato da `ml_predictions`, esce tutto insieme, così
+    `read_summary` non conta mai righe fuori dalla retention.
+    """
+    return db.query(MlErrorStat).filter(MlErrorStat.day <= _bucket_day(cutoff)).delete(
+        synchronize_session=False
+    )
+
+
+def read_summary(db: Session) -> dict:
+    """Totali, MAE globale e MAE per lead time e per regione letti dagli aggregati."""
+    lead_rows = (
+        db.query(
+            MlErrorStat.lead_hours,
+            func.sum(MlErrorStat.n_predictions),
+            func.sum(MlErrorStat.n_verified),
+            func.sum(MlErrorStat.sum_abs_error),
+        )
+        .group_by(MlErrorStat.lead_hours)
+        .order_by(MlErrorStat.lead_hours)
+        .all()
+    )
+    region_rows = (
+        db.query(
+            MlErrorStat.region,
+            func.sum(MlErrorStat.n_verified),
+            func.sum(MlErrorStat.sum_abs_error),
+        )
+        .group_by(MlErrorStat.region)
+        .order_by(MlErrorStat.region)
+        .all()
+    )
+
+    total = sum(int(row[1] or 0) for row in lead_rows)
+    verified = sum(int(row[2] or 0) for row in lead_rows)
+    sum_abs = sum(float(row[3] or 0.0) for row in lead_rows)
+
+    return {
+        "total_predictions": total,
+        "verified_predictions": verified,
+        "avg_error_celsius": round(sum_abs / verified, 3) if verified else None,
+        "lead_time_error": [
+            {"lead_hours": lead_hours, "avg_abs_error": round(float(abs_sum) / int(n_verified), 3)}
+            for lead_hours, _, n_verified, abs_sum in lead_rows
+            if n_verified
+        ],
+        "region_error": [
+            {"region": region, "avg_abs_error": round(float(abs_sum) / int(n_verified), 3)}
+            for region, n_verified, abs_sum in region_rows
+            if n_verified
+        ],
+    }
@@ -0,0 +1,210 @@
+"""
+forecast_snapshots.py — previsioni pubbliche per comune ricavate dal ciclo orario.
+
+Il batch orario scarica già current, hourly e daily per tutti i comuni: per ogni
+città si conserva uno snapshot compatto (formato di weather_cache) con i tempi
+in epoch UTC. Alla lettura lo snapshot diventa un payload con la stessa forma
+della chiamata single-city (orari locali Europe/Rome), con la finestra oraria e
+i giorni riallineati all'istante della richiesta.
+
+Con un livello condiviso attivo (PUBLIC_CACHE_BACKEND sql o redis) ogni batch
+pubblica gli snapshot anche lì: i worker che non hanno eseguito il ciclo e i
+processi appena riavviati li leggono al primo miss locale invece di aspettare
+il ciclo successivo.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from datetime import datetime
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from weather_cache import SharedCacheBackend, decode_payload, encode_payload
+
+ROME_TZ = ZoneInfo("Europe/Rome")
+# Il ciclo gira ogni ora: oltre questa età lo snapshot è "stale", oltre SNAPSHOT_MAX_AGE_SECONDS non si usa
+SNAPSHOT_REFRESH_SECONDS = 3600
+SNAPSHOT_MAX_AGE_SECONDS = 2 * 3600
+SNAPSHOT_HOURLY_HOURS = 24
+SNAPSHOT_FORECAST_DAYS = 16
+
+SHARED_KEY_PREFIX = "snapshot:"
+# Voce con l'istante dell'ultimo batch pubblicato, per sapere all'avvio se il ciclo è recente
+SHARED_CYCLE_KEY = "snapshot:last-cycle"
+
+# city_id -> (istante del ciclo in epoch, blob compatto)
+_snapshots: dict[int, tuple[float, bytes]] = {}
+_shared_backend: Optional[SharedCacheBackend] = None
+_stats = {
+    "stored": 0, "hits": 0, "misses": 0, "expired": 0,
+    "shared_writes": 0, "shared_hits": 0, "shared_misses": 0, "shared_errors": 0,
+}
+
+
+def set_shared_backend(backend: Optional[SharedCacheBackend]):
+    """Livello condiviso su cui pubblicare e da cui rileggere gli snapshot (None = solo memoria)."""
+    global _shared_backend
+    _shared_backend = backend
+
+
+def _shared_key(city_id: int) -> str:
+    return f"{SHARED_KEY_PREFIX}{city_id}"
+
+
+def _snapshot_from_batch(city: dict, city_data: dict) -> Optional[dict]:
+    """Estrae dalla risposta batch di una città i blocchi usati dal frontend; None se incompleta."""
+    current = city_data.get("current") or {}
+    hourly = city_data.get("hourly") or {}
+    daily = city_data.get("daily") or {}
+    if current.get("temperature_2m") is None or not hourly.get("time") or not daily.get("time"):
+        return None
+    if not all(isinstance(value, (int, float)) for value in (*hourly["time"], *daily["time"])):
+        return None
+    return {
+        "latitude": city["lat"],
+        "longitude": city["lon"],
+        "current": current,
+        "hourly": hourly,
+        "daily": daily,
+    }
+
+
+def store_batch(cities: list[dict], payload: list[dict], *, fetched_at: float | None = None) -> int:
+    """
+    Salva gli snapshot di un batch (payload con timeformat=unixtime); ritorna quanti ne ha salvati.
+    Con un livello condiviso attivo li pubblica anche lì: chiamare da un thread (asyncio.to_thread).
+    """
+    fetched_at = time.time() if fetched_at is None else fetched_at
+    shared_items = []
+    for city, city_data in zip(cities, payload):
+        snapshot = _snapshot_from_batch(city, city_data or {})
+        if snapshot is None:
+            continue
+        _snapshots[city["id"]] = (fetched_at, encode_payload(snapshot, fetched_at))
+        shared_items.append((_shared_key(city["id"]), snapshot))
+    stored = len(shared_items)
+    _stats["stored"] += stored
+
+    backend = _shared_backend
+    if backend is not None and stored:
+        try:
+            backend.set_many(
+                [*shared_items, (SHARED_CYCLE_KEY, {"fetched_at": fetched_at})],
+                ttl_seconds=SNAPSHOT_MAX_AGE_SECONDS,
+            )
+            _stats["shared_writes"] += stored
+        except Exception as exc:
+            _stats["shared_errors"] += 1
+            print(f"[WARN] Snapshot non pubblicati sulla cache condivisa {backend.name}: {exc}")
+    return stored
+
+
+def _slice_block(block: dict, start: int, stop: int) -> dict:
+    return {key: values[start:stop] if isinstance(values, list) else values for key, values in block.items()}
+
+
+def _to_public_payload(snapshot: dict, now: float) -> dict:
+    hourly = snapshot["hourly"]
+    hour_start = int(now // 3600) * 3600
+    first_hour = next((idx for idx, value in enumerate(hourly["time"]) if value >= hour_start), len(hourly["time"]))
+    hourly = _slice_block(hourly, first_hour, first_hour + SNAPSHOT_HOURLY_HOURS)
+    hourly["time"] = [
+        datetime.fromtimestamp(value, tz=ROME_TZ).strftime("%Y-%m-%dT%H:%M") for value in hourly["time"]
+    ]
+
+    daily = snapshot["daily"]
+    today = datetime.fromtimestamp(now, tz=ROME_TZ).date()
+    days = [datetime.fromtimestamp(value, tz=ROME_TZ).date() for value in daily["time"]]
+    first_day = next((idx for idx, day in enumerate(days) if day >= today), len(days))
+    daily = _slice_block(daily, first_day, first_day + SNAPSHOT_FORECAST_DAYS)
+    daily["time"] = [day.isoformat() for day in days[first_day:first_day + SNAPSHOT_FORECAST_DAYS]]
+
+    current = dict(snapshot["current"])
+    if isinstance(current.get("time"), (int, float)):
+        current["time"] = datetime.fromtimestamp(current["time"], tz=ROME_TZ).strftime("%Y-%m-%dT%H:%M")
+
+    return {**snapshot, "current": current, "hourly": hourly, "daily": daily, "timezone": "Europe/Rome"}
+
+
+def lookup(city_id: int, *, now: float | None = None) -> Optional[tuple[dict, float]]:
+    """(payload in formato single-city, età in secondi) se lo snapshot è utilizzabile, altrimenti None."""
+    now = time.time() if now is None else now
+    entry = _snapshots.get(city_id)
+    if entry is None:
+        _stats["misses"] += 1
+        return None
+    fetched_at, blob = entry
+    age = max(0.0, now - fetched_at)
+    if age >= SNAPSHOT_MAX_AGE_SECONDS:
+        _snapshots.pop(city_id, None)
+        _stats["expired"] += 1
+        _stats["misses"] += 1
+        return None
+
+    snapshot, _ = decode_payload(blob)
+    _stats["hits"] += 1
+    return _to_public_payload(snapshot, now), age
+
+
+async def lookup_shared(city_id: int, *, now: float | None = None) -> Optional[tuple[dict, float]]:
+    """Come `lookup`, ma dal livello condiviso; se servibile lo snapshot viene copiato in memoria."""
+    backend = _shared_backend
+    if backend is None:
+        return None
+    try:
+        found = await asyncio.to_thread(backend.get, _shared_key(city_id))
+    except Exception as exc:
+        _stats["shared_errors"] += 1
+        print(f"[WARN] Cache condivisa {backend.name} non disponibile per gli snapshot: {exc}")
+        return None
+    if found is None or found[1] >= SNAPSHOT_MAX_AGE_SECONDS:
+        _stats["shared_misses"] += 1
+        return None
+
+    now = time.time() if now is None else now
+    snapshot, age = found
+    _snapshots[city_id] = (now - age, encode_payload(snapshot, now - age))
+    _stats["shared_hits"] += 1
+    return _to_public_payload(snapshot, now), age
+
+
+def has_recent_cycle(*, now: float | None = None) -> bool:
+    """True se in memoria o sul livello condiviso ci sono snapshot di meno di un ciclo (chiamata bloccante)."""
+    now = time.time() if now is None else now
+    if any(now - fetched_at < SNAPSHOT_REFRESH_SECONDS for fetched_at, _ in list(_snapshots.values())):
+        return True
+    backend = _shared_backend
+    if backend is None:
+        return False
+    try:
+        found = backend.get(SHARED_CYCLE_KEY)
+    except Exception as exc:
+        _stats["shared_errors"] += 1
+        print(f"[WARN] Cache condivisa {backend.name} non disponibile per gli snapshot: {exc}")
+        return False
+    return found is not None and found[1] < SNAPSHOT_REFRESH_SECONDS
+
+
+def freshness(age: float) -> dict:
+    """Stessi campi di weather_service.get_public_freshness, per header e risposta di /api/weather."""
+    return {
+        "status": "fresh" if age < SNAPSHOT_REFRESH_SECONDS else "stale",
+        "age_seconds": int(age),
+        "max_age_seconds": SNAPSHOT_REFRESH_SECONDS,
+        "stale_while_revalidate_seconds": SNAPSHOT_MAX_AGE_SECONDS - SNAPSHOT_REFRESH_SECONDS,
+    }
+
+
+def clear():
+    _snapshots.clear()
+
+
+def get_stats() -> dict:
+    return {
+        **_stats,
+        "cities": len(_snapshots),
+        "bytes": sum(len(blob) for _, blob in _snapshots.values()),
+        "max_age_seconds": SNAPSHOT_MAX_AGE_SECONDS,
+        "shared_backend": _shared_backend.name if _shared_backend is not None else None,
+    }
@@ -0,0 +1,78 @@
+"""
+geo_grid.py — griglia regolare lat/lon per condividere le previsioni tra località vicine.
+
+La griglia dei modelli Open-Meteo è di alcuni km: comuni e località GeoNames nella
+stessa cella ricevono di fatto gli stessi dati. Cache e fetch pubblici usano il
+centro della cella come chiave, così una sola chiamata upstream serve tutta la cella.
+Ogni City conserva il proprio `grid_cell` ("passo:i:j"), ricalcolato all'avvio se
+il passo configurato cambia: /api/weather lo usa per servire località e coordinate
+con lo snapshot orario di un comune della stessa cella. Con passo 0 si torna all'arrotondamento a 4 decimali.
+"""
+from __future__ import annotations
+
+import math
+
+from sqlalchemy import bindparam, distinct, or_, update
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import City, SessionLocal
+
+GRID_STEP_DEGREES = settings.public_grid_step_degrees
+REFRESH_CHUNK = 5000
+
+
+def _step(step: float | None) -> float:
+    return GRID_STEP_DEGREES if step is None else step
+
+
+def cell_index(lat: float, lon: float, step: float | None = None) -> tuple[int, int]:
+    step = _step(step)
+    return math.floor(lat / step), math.floor(lon / step)
+
+
+def cell_id(lat: float, lon: float, step: float | None = None) -> str:
+    step = _step(step)
+    if step <= 0:
+        return f"0:{round(lat, 4)}:{round(lon, 4)}"
+    i, j = cell_index(lat, lon, step)
+    return f"{step:g}:{i}:{j}"
+
+
+def snap(lat: float, lon: float, step: float | None = None) -> tuple[float, float]:
+    """Centro della cella che contiene (lat, lon)."""
+    step = _step(step)
+    if step <= 0:
+        return round(lat, 4), round(lon, 4)
+    i, j = cell_index(lat, lon, step)
+    return round((i + 0.5) * step, 6), round((j + 0.5) * step, 6)
+
+
+def refresh_city_cells(step: float | None = None) -> int:
+    """Calcola `grid_cell` per le città senza cella o con un passo diverso da quello configurato."""
+    step = _step(step)
+    prefix = cell_id(0.0, 0.0, step).split(":", 1)[0] + ":"
+    cities = City.__table__
+    stmt = update(cities).where(cities.c.id == bindparam("city_id")).values(grid_cell=bindparam("cell"))
+    with SessionLocal() as db:
+        stale = (
+            db.query(City.id, City.lat, City.lon)
+            .filter(or_(City.grid_cell.is_(None), ~City.grid_cell.startswith(prefix)))
+            .all()
+        )
+        rows = [{"city_id": row.id, "cell": cell_id(row.lat, row.lon, step)} for row in stale]
+        for start in range(0, len(rows), REFRESH_CHUNK):
+            db.connection().execute(stmt, rows[start:start + REFRESH_CHUNK])
+        db.commit()
+    return len(rows)
+
+
+def get_grid_stats(db: Session) -> dict:
+    cities = db.query(City).count()
+    cells = db.query(distinct(City.grid_cell)).filter(City.grid_cell.isnot(None)).count()
+    return {
+        "step_degrees": GRID_STEP_DEGREES,
+        "cities": cities,
+        "cells": cells,
+        "cities_per_cell": round(cities / cells, 2) if cells else None,
+    }
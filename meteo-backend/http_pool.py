@@ -0,0 +1,141 @@
+"""
+http_pool.py — client HTTP condiviso per le chiamate ai provider meteo.
+
+Un solo `httpx.AsyncClient` creato nel lifespan dell'app mantiene le connessioni
+keep-alive verso Open-Meteo e met.no: le richieste successive evitano DNS,
+handshake TCP e TLS. HTTP/2 viene attivato solo se il pacchetto `h2` è installato.
+Fuori dal lifespan (script, test) `borrow_client` apre un client temporaneo.
+"""
+from __future__ import annotations
+
+import importlib.util
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import httpx
+
+POOL_MAX_CONNECTIONS = 32
+POOL_MAX_KEEPALIVE_CONNECTIONS = 16
+POOL_KEEPALIVE_EXPIRY_SECONDS = 90.0
+CONNECT_TIMEOUT_SECONDS = 5.0
+READ_TIMEOUT_SECONDS = 30.0
+
+_client: Optional[httpx.AsyncClient] = None
+_host_stats: dict[str, dict[str, int]] = defaultdict(
+    lambda: {"requests": 0, "new_connections": 0, "reused_connections": 0, "errors": 0}
+)
+_http_versions: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+class _MeteredTransport(httpx.AsyncBaseTransport):
+    """Transport che conta per host le richieste servite su connessioni nuove o riusate."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        opened = False
+        upstream_trace = request.extensions.get("trace")
+
+        async def trace(event_name: str, info: dict):
+            nonlocal opened
+            if event_name == "connection.connect_tcp.complete":
+                opened = True
+            if upstream_trace is not None:
+                await upstream_trace(event_name, info)
+
+        request.extensions["trace"] = trace
+        stats = _host_stats[host]
+        stats["requests"] += 1
+        try:
+            response = await self._transport.handle_async_request(request)
+        except Exception:
+            stats["errors"] += 1
+            raise
+        finally:
+            stats["new_connections" if opened else "reused_connections"] += 1
+
+        _http_versions[host][response.extensions.get("http_version", b"HTTP/1.1").decode("ascii", "replace")] += 1
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def _new_client() -> httpx.AsyncClient:
+    http2 = http2_available()
+    limits = httpx.Limits(
+        max_connections=POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=POOL_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=POOL_KEEPALIVE_EXPIRY_SECONDS,
+    )
+    transport = httpx.AsyncHTTPTransport(limits=limits, http2=http2, retries=1)
+    return httpx.AsyncClient(
+        transport=_MeteredTransport(transport),
+        timeout=httpx.Timeout(READ_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+        http2=http2,
+    )
+
+
+async def start():
+    """Crea il client condiviso (idempotente): chiamato allo startup dell'app."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _new_client()
+        print(f"[HTTP] Pool condiviso attivo (HTTP/2: {'sì' if http2_available() else 'no'})")
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> Optional[httpx.AsyncClient]:
+    return _client if _client is not None and not _client.is_closed else None
+
+
+@asynccontextmanager
+async def borrow_client() -> AsyncIterator[httpx.AsyncClient]:
+    """Il client condiviso se attivo, altrimenti un client temporaneo chiuso all'uscita."""
+    shared = get_client()
+    if shared is not None:
+        yield shared
+        return
+
+    async with _new_client() as client:
+        yield client
+
+
+def get_pool_stats() -> dict:
+    """Metriche di riuso connessioni per host, esposte nello stato admin."""
+    hosts = {}
+    for host, stats in sorted(_host_stats.items()):
+        completed = stats["new_connections"] + stats["reused_connections"]
+        hosts[host] = {
+            **stats,
+            "reuse_ratio": round(stats["reused_connections"] / completed, 3) if completed else None,
+            "http_versions": dict(_http_versions.get(host, {})),
+        }
+    return {
+        "active": get_client() is not None,
+        "http2": http2_available(),
+        "limits": {
+            "max_connections": POOL_MAX_CONNECTIONS,
+            "max_keepalive_connections": POOL_MAX_KEEPALIVE_CONNECTIONS,
+            "keepalive_expiry_seconds": POOL_KEEPALIVE_EXPIRY_SECONDS,
+        },
+        "hosts": hosts,
+    }
+
+
+def reset_pool_stats():
+    _host_stats.clear()
+    _http_versions.clear()
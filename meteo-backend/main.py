@@ -15,7 +15,13 @@ from dotenv import load_dotenv
 from config import settings
 from database import init_db, SessionLocal, City, db_healthcheck
 from scheduler import start_scheduler, stop_scheduler
+import cities_index
+import city_locator
+import city_search
+import geo_grid
+import http_pool
 import ml_model
+import weather_service
 
 load_dotenv()
 
@@ -47,6 +53,26 @@ def _load_cities_if_empty():
         else:
             print(f"[GEONAMES] {count_localita} località GeoNames presenti nel DB")
 
+        # 3. Celle della griglia meteo condivisa (nuove righe o passo cambiato)
+        updated_cells = geo_grid.refresh_city_cells()
+        if updated_cells:
+            print(f"[GRID] Calcolata la cella meteo per {updated_cells} città (passo {geo_grid.GRID_STEP_DEGREES}°)")
+
+        # 4. Nomi normalizzati e nomi alternativi GeoNames per la ricerca
+        updated_names = city_search.refresh_search_names()
+        if updated_names:
+            print(f"[SEARCH] Normalizzato il nome di {updated_names} città")
+        from cities_loader import load_alternate_names
+        load_alternate_names()
+
+        # 5. Indici in memoria (già ricostruiti da cities_loader se ha caricato righe)
+        if not city_search.is_ready():
+            city_search.rebuild()
+        if not city_locator.is_ready():
+            city_locator.rebuild()
+        if not cities_index.is_ready():
+            cities_index.rebuild()
+
     except Exception as e:
         print(f"[WARN] Caricamento città fallito: {e}")
         import traceback
@@ -61,6 +87,8 @@ async def lifespan(app: FastAPI):
     init_db()
     threading.Thread(target=_load_cities_if_empty, daemon=True).start()
     ml_model.load_latest_model()
+    await http_pool.start()
+    weather_service.start_shared_public_cache()
     start_scheduler()
     print("[OK] Backend pronto\n")
 
@@ -68,6 +96,8 @@ async def lifespan(app: FastAPI):
 
     # --- SHUTDOWN ---
     stop_scheduler()
+    await http_pool.close()
+    weather_service.close_shared_public_cache()
     print("[BYE] Backend fermato")
 
 
@@ -119,11 +149,14 @@ def ready():
     db_ok = db_healthcheck()
     model_summary = ml_model.get_public_summary()
     scheduler_running = bool(current_scheduler.running)
+    upstreams = weather_service.get_breaker_states()
+    upstreams_ok = all(state["state"] == "closed" for state in upstreams.values())
 
     return {
-        "status": "ready" if db_ok and scheduler_running else "degraded",
+        "status": "ready" if db_ok and scheduler_running and upstreams_ok else "degraded",
         "database": {"ok": db_ok},
         "scheduler": {"running": scheduler_running, "jobs": len(current_scheduler.get_jobs())},
+        "upstreams": upstreams,
         "ml": model_summary,
         "env": settings.app_env,
     }
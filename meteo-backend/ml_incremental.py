@@ -0,0 +1,112 @@
+"""
+ml_incremental.py — aggiornamento incrementale dei modelli tra due training completi.
+
+Il modello temperatura (StandardScaler + Ridge) si ricava in forma chiusa da
+statistiche sufficienti centrate (medie, XᵀX, Xᵀy) che si aggiornano con le
+sole righe nuove. I classificatori SGD pioggia/condizioni proseguono con
+`partial_fit` sulle feature scalate dallo scaler dell'ultimo training completo.
+"""
+from __future__ import annotations
+
+import copy
+from typing import Optional
+
+import numpy as np
+from sklearn.linear_model import Ridge, SGDClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.utils.class_weight import compute_sample_weight
+
+
+class RidgeAccumulator:
+    """Statistiche sufficienti per una Ridge standardizzata, aggiornabili a blocchi (merge di Chan)."""
+
+    def __init__(self, n_features: int):
+        self.n_samples = 0
+        self.mean_x = np.zeros(n_features)
+        self.mean_y = 0.0
+        self.xx = np.zeros((n_features, n_features))
+        self.xy = np.zeros(n_features)
+
+    def update(self, X: np.ndarray, y: np.ndarray):
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+        n_batch = len(y)
+        if n_batch == 0:
+            return
+
+        batch_mean_x = X.mean(axis=0)
+        batch_mean_y = float(y.mean())
+        centered_x = X - batch_mean_x
+        centered_y = y - batch_mean_y
+
+        total = self.n_samples + n_batch
+        delta_x = batch_mean_x - self.mean_x
+        delta_y = batch_mean_y - self.mean_y
+        weight = self.n_samples * n_batch / total
+
+        self.xx += centered_x.T @ centered_x + np.outer(delta_x, delta_x) * weight
+        self.xy += centered_x.T @ centered_y + delta_x * delta_y * weight
+        self.mean_x += delta_x * n_batch / total
+        self.mean_y += delta_y * n_batch / total
+        self.n_samples = total
+
+    def to_pipeline(self, alpha: float = 1.0) -> Pipeline:
+        """Pipeline equivalente a StandardScaler + Ridge(alpha) addestrata su tutte le righe accumulate."""
+        n_features = len(self.mean_x)
+        var = np.diag(self.xx) / max(self.n_samples, 1)
+        scale = np.sqrt(var)
+        scale[scale < 10 * np.finfo(float).eps] = 1.0
+
+        gram = self.xx / np.outer(scale, scale)
+        coef = np.linalg.solve(gram + alpha * np.eye(n_features), self.xy / scale)
+
+        scaler = StandardScaler()
+        scaler.mean_ = self.mean_x.copy()
+        scaler.var_ = var
+        scaler.scale_ = scale
+        scaler.n_samples_seen_ = self.n_samples
+        scaler.n_features_in_ = n_features
+
+        ridge = Ridge(alpha=alpha)
+        ridge.coef_ = coef
+        ridge.intercept_ = self.mean_y
+        ridge.n_features_in_ = n_features
+        return Pipeline([("scaler", scaler), ("ridge", ridge)])
+
+
+def balanced_sample_weight(y: np.ndarray) -> np.ndarray:
+    """Pesi per classe bilanciati sul blocco, dato che `partial_fit` non accetta class_weight='balanced'."""
+    return compute_sample_weight("balanced", y)
+
+
+def supports_partial_fit(pipeline: Optional[Pipeline]) -> bool:
+    if pipeline is None or len(getattr(pipeline, "steps", ())) != 2:
+        return False
+    return isinstance(pipeline.steps[0][1], StandardScaler) and isinstance(pipeline.steps[1][1], SGDClassifier)
+
+
+def partial_fit_pipeline(pipeline: Optional[Pipeline], X: np.ndarray, y: np.ndarray) -> Optional[Pipeline]:
+    """
+    Copia della pipeline con il classificatore aggiornato sulle righe nuove.
+    Lo scaler resta quello del training completo; le etichette mai viste vengono scartate.
+    Ritorna None se la pipeline non supporta l'aggiornamento o non ci sono righe utilizzabili.
+    """
+    if not supports_partial_fit(pipeline):
+        return None
+
+    classifier = pipeline.steps[1][1]
+    known = np.isin(y, classifier.classes_)
+    if not known.any():
+        return None
+
+    updated = copy.deepcopy(pipeline)
+    scaler, classifier = updated.steps[0][1], updated.steps[1][1]
+    X_known, y_known = X[known], y[known]
+    classifier.partial_fit(
+        scaler.transform(X_known),
+        y_known,
+        classes=classifier.classes_,
+        sample_weight=balanced_sample_weight(y_known),
+    )
+    return updated
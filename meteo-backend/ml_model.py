@@ -3,19 +3,25 @@ ml_model.py — modelli ML per correzione temperatura, probabilità pioggia e co
 """
 from __future__ import annotations
 
+import copy
 import pickle
+import threading
+import time
 from datetime import datetime, timezone
 from typing import Optional
 
 import numpy as np
-from sklearn.linear_model import LogisticRegression, Ridge
+from sklearn.linear_model import Ridge, SGDClassifier
 from sklearn.metrics import accuracy_score, mean_absolute_error
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import LabelEncoder, StandardScaler
-from sqlalchemy import func
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 
 from database import City, MlModelStore, MlPrediction, SessionLocal
+from ml_incremental import RidgeAccumulator, balanced_sample_weight, partial_fit_pipeline
+from ml_scoring import LinearScorer, compile_pipeline
+import error_stats
 
 CONDITION_LABELS = ("sereno", "parzialmente nuvoloso", "nuvoloso", "pioggia")
 CONDITION_TO_CODE = {label: index for index, label in enumerate(CONDITION_LABELS)}
@@ -30,8 +36,14 @@ RAIN_WEATHER_CODES = {
 _pipeline: Optional[Pipeline] = None
 _rain_pipeline: Optional[Pipeline] = None
 _condition_pipeline: Optional[Pipeline] = None
-_label_encoder: Optional[LabelEncoder] = None
-_known_regions: list[str] = []
+# Scorer NumPy compilati dalle pipeline promosse (None => si usa la pipeline scikit-learn)
+_scorer: Optional[LinearScorer] = None
+_rain_scorer: Optional[LinearScorer] = None
+_condition_scorer: Optional[LinearScorer] = None
+# Codici regione del modello attivo: lookup O(1) al posto di LabelEncoder.transform per riga
+_region_codebook: dict[str, int] = {}
+# Statistiche e cursore per l'aggiornamento incrementale tra due training completi
+_incremental_state: Optional[dict] = None
 _latest_summary: dict = {
     "model_ready": False,
     "rain_model_ready": False,
@@ -46,6 +58,14 @@ _latest_summary: dict = {
     "model_trained_at": None,
 }
 
+# Snapshot delle statistiche servito dagli endpoint pubblici senza query per richiesta
+STATS_CACHE_TTL_SECONDS = 600
+# _stats_lock protegge solo lo snapshot; la query gira fuori, serializzata da _stats_load_lock
+_stats_lock = threading.Lock()
+_stats_load_lock = threading.Lock()
+_stats_loading = False
+_stats_snapshot: dict = {"value": None, "loaded_at": None, "hits": 0, "misses": 0}
+
 
 def _safe_float(value: float | int | None, fallback: float = 0.0) -> float:
     return float(value if value is not None else fallback)
@@ -58,9 +78,20 @@ def _normalize_wind_direction(value: float | int | None) -> float:
 
 
 def _region_code(region: str) -> int:
-    if _label_encoder and region in _known_regions:
-        return int(_label_encoder.transform([region])[0])
-    return 0
+    return _region_codebook.get(region, 0)
+
+
+def _codebook_from_encoder(encoder: LabelEncoder) -> dict[str, int]:
+    return {str(region): index for index, region in enumerate(encoder.classes_)}
+
+
+def _encode_region_column(regions: np.ndarray | list[str], codebook: dict[str, int]) -> np.ndarray:
+    """Codifica un'intera colonna di regioni: un lookup per valore distinto, poi indicizzazione NumPy."""
+    if len(regions) == 0:
+        return np.zeros(0, dtype=float)
+    distinct, inverse = np.unique(np.asarray(regions, dtype=object), return_inverse=True)
+    codes = np.array([codebook.get(region, 0) for region in distinct], dtype=float)
+    return codes[inverse]
 
 
 def _condition_from_inputs(
@@ -131,77 +162,86 @@ def _daily_summary(condition_label: str, rain_probability: float, wind_speed: fl
     return f"{condition_text}. Scenario asciutto e piuttosto regolare durante la giornata."
 
 
-def _build_features(
-    *,
-    forecast_temp: float,
-    humidity: float,
-    hour: int,
-    month: int,
-    lat: float,
-    region: str,
-    cloud_cover: float,
-    lead_hours: int,
-) -> np.ndarray:
-    """Feature vector legacy per temperatura/pioggia, mantenuto compatibile coi modelli esistenti."""
-    return np.array([[
-        forecast_temp,
-        humidity or 50.0,
-        hour,
-        month,
-        lat,
-        cloud_cover or 50.0,
-        max(0, lead_hours or 0),
-        _region_code(region),
-    ]])
-
-
-def _build_condition_features(
-    *,
-    forecast_temp: float,
-    humidity: float,
-    hour: int,
-    month: int,
-    lat: float,
-    region: str,
-    cloud_cover: float,
-    lead_hours: int,
-    forecast_precipitation: float,
-    forecast_wind_speed: float,
-    forecast_wind_direction: float,
-    forecast_weather_code: int | None,
-) -> np.ndarray:
-    provider_condition = _condition_from_inputs(
-        weather_code=forecast_weather_code,
-        cloud_cover=cloud_cover,
-        precipitation=forecast_precipitation,
+def _feature_matrix(items: list[dict]) -> np.ndarray:
+    """Feature legacy per temperatura/pioggia, una riga per item, compatibile coi modelli esistenti."""
+    return np.array([
+        [
+            item["forecast_temp"],
+            item.get("humidity") or 50.0,
+            item["hour"],
+            item["month"],
+            item["lat"],
+            item.get("cloud_cover", 50.0) or 50.0,
+            max(0, item.get("lead_hours") or 0),
+            _region_code(item["region"]),
+        ]
+        for item in items
+    ], dtype=float)
+
+
+def _provider_condition(item: dict) -> str:
+    return _condition_from_inputs(
+        weather_code=item.get("forecast_weather_code"),
+        cloud_cover=item.get("cloud_cover", 50.0),
+        precipitation=item.get("forecast_precipitation", 0.0),
     )
 
-    return np.array([[
-        forecast_temp,
-        humidity or 50.0,
-        hour,
-        month,
-        lat,
-        cloud_cover or 50.0,
-        max(0, lead_hours or 0),
-        forecast_precipitation or 0.0,
-        forecast_wind_speed or 0.0,
-        _normalize_wind_direction(forecast_wind_direction),
-        _region_code(region),
-        CONDITION_TO_CODE[provider_condition],
-        forecast_weather_code or 0,
-    ]])
-
-
-def _prepare_training_rows(db: Session) -> list[dict]:
-    rows = (
-        db.query(
-            MlPrediction.predicted_at,
-            MlPrediction.target_time,
-            MlPrediction.predicted_temp,
-            MlPrediction.forecast_temp,
+
+def _condition_feature_matrix(items: list[dict], provider_conditions: list[str]) -> np.ndarray:
+    return np.array([
+        [
+            item["forecast_temp"],
+            item.get("humidity") or 50.0,
+            item["hour"],
+            item["month"],
+            item["lat"],
+            item.get("cloud_cover", 50.0) or 50.0,
+            max(0, item.get("lead_hours") or 0),
+            item.get("forecast_precipitation") or 0.0,
+            item.get("forecast_wind_speed") or 0.0,
+            _normalize_wind_direction(item.get("forecast_wind_direction")),
+            _region_code(item["region"]),
+            CONDITION_TO_CODE[provider_condition],
+            item.get("forecast_weather_code") or 0,
+        ]
+        for item, provider_condition in zip(items, provider_conditions)
+    ], dtype=float)
+
+
+TRAINING_FETCH_CHUNK = 5000
+# Iperparametri dei modelli: regolarizzazione della Ridge e dei classificatori SGD
+RIDGE_ALPHA = 1.0
+SGD_ALPHA = 1e-4
+# Colonne numeriche del training set: (nome, valore di default se NULL o zero)
+# Il default replica il vecchio `valore or default` per restare allineati alle feature di inferenza
+_TRAINING_FLOAT_COLUMNS = (
+    ("forecast_temp", None),
+    ("humidity", 50.0),
+    ("lat", 43.0),
+    ("cloud_cover", 50.0),
+    ("lead_hours", 0.0),
+    ("error", None),
+    ("forecast_precipitation", 0.0),
+    ("forecast_weather_code", None),
+    ("forecast_wind_speed", 0.0),
+    ("forecast_wind_direction", None),
+    ("actual_precipitation", None),
+    ("actual_weather_code", None),
+    ("actual_cloud_cover", None),
+)
+
+
+def _training_query(verified_after: datetime | None = None, verified_until: datetime | None = None):
+    target_time = func.coalesce(MlPrediction.target_time, MlPrediction.predicted_at)
+    query = (
+        select(
+            target_time.label("target_time"),
+            func.coalesce(MlPrediction.forecast_temp, MlPrediction.predicted_temp).label("forecast_temp"),
             MlPrediction.humidity,
-            MlPrediction.forecast_cloud_cover,
+            City.lat,
+            MlPrediction.forecast_cloud_cover.label("cloud_cover"),
+            MlPrediction.lead_hours,
+            MlPrediction.error,
             MlPrediction.forecast_precipitation,
             MlPrediction.forecast_weather_code,
             MlPrediction.forecast_wind_speed,
@@ -209,133 +249,150 @@ def _prepare_training_rows(db: Session) -> list[dict]:
             MlPrediction.actual_precipitation,
             MlPrediction.actual_weather_code,
             MlPrediction.actual_cloud_cover,
-            MlPrediction.actual_wind_speed,
-            MlPrediction.actual_wind_direction,
-            MlPrediction.lead_hours,
-            MlPrediction.error,
-            City.lat,
             City.region,
         )
         .join(City, MlPrediction.city_id == City.id)
-        .filter(MlPrediction.verified.is_(True))
-        .filter(MlPrediction.actual_temp.isnot(None))
-        .filter(MlPrediction.error.isnot(None))
-        .all()
+        .where(MlPrediction.verified.is_(True))
+        .where(MlPrediction.actual_temp.isnot(None))
+        .where(MlPrediction.error.isnot(None))
+        .order_by(target_time, MlPrediction.id)
     )
+    if verified_after is not None:
+        query = query.where(MlPrediction.verified_at > verified_after)
+    if verified_until is not None:
+        query = query.where(MlPrediction.verified_at <= verified_until)
+    return query
 
-    prepared: list[dict] = []
-    for row in rows:
-        target_time = row.target_time or row.predicted_at
-        if not target_time:
-            continue
-
-        forecast_temp = row.forecast_temp if row.forecast_temp is not None else row.predicted_temp
-        prepared.append({
-            "target_time": target_time,
-            "forecast_temp": forecast_temp,
-            "humidity": row.humidity or 50.0,
-            "hour": target_time.hour,
-            "month": target_time.month,
-            "lat": row.lat or 43.0,
-            "cloud_cover": row.forecast_cloud_cover or 50.0,
-            "lead_hours": row.lead_hours or 0,
-            "region": row.region or "Sconosciuta",
-            "error": row.error,
-            "forecast_precipitation": row.forecast_precipitation or 0.0,
-            "forecast_weather_code": row.forecast_weather_code,
-            "forecast_wind_speed": row.forecast_wind_speed or 0.0,
-            "forecast_wind_direction": _normalize_wind_direction(row.forecast_wind_direction),
-            "actual_precipitation": row.actual_precipitation,
-            "actual_weather_code": row.actual_weather_code,
-            "actual_cloud_cover": row.actual_cloud_cover,
-            "actual_wind_speed": row.actual_wind_speed,
-            "actual_wind_direction": row.actual_wind_direction,
-        })
-    prepared.sort(key=lambda item: item["target_time"])
-    return prepared
 
+def _verified_cursor(db: Session) -> datetime | None:
+    """Ultimo verified_at presente: delimita le righe già viste dal modello."""
+    return db.execute(select(func.max(MlPrediction.verified_at)).where(MlPrediction.verified.is_(True))).scalar()
 
-def _encode_regions(rows: list[dict]) -> LabelEncoder:
-    global _known_regions, _label_encoder
 
-    regions = sorted({row["region"] for row in rows} or {"Sconosciuta"})
+def _load_training_columns(
+    db: Session,
+    chunk_size: int = TRAINING_FETCH_CHUNK,
+    *,
+    verified_after: datetime | None = None,
+    verified_until: datetime | None = None,
+) -> dict[str, np.ndarray]:
+    """
+    Carica le previsioni verificate in array NumPy colonnari, già ordinati per target_time.
+    Le righe arrivano a blocchi (`yield_per`, cursore lato server su PostgreSQL) dentro array
+    preallocati sul conteggio iniziale, senza dizionari per riga.
+    `verified_after`/`verified_until` limitano il caricamento a una finestra di verified_at.
+    """
+    query = _training_query(verified_after, verified_until)
+    capacity = int(db.execute(select(func.count()).select_from(query.order_by(None).subquery())).scalar() or 0)
+
+    names = [name for name, _ in _TRAINING_FLOAT_COLUMNS]
+    buffers = {name: np.empty(capacity, dtype=float) for name in names}
+    buffers["hour"] = np.empty(capacity, dtype=float)
+    buffers["month"] = np.empty(capacity, dtype=float)
+    buffers["region"] = np.empty(capacity, dtype=object)
+
+    size = 0
+    result = db.execute(query.execution_options(yield_per=chunk_size))
+    for partition in result.partitions():
+        end = size + len(partition)
+        if end > capacity:
+            # Righe verificate arrivate tra il conteggio e la lettura
+            capacity = max(end, capacity * 2)
+            buffers = {name: np.resize(values, capacity) for name, values in buffers.items()}
+
+        target_times, *values, regions = zip(*partition)
+        for name, column in zip(names, values):
+            buffers[name][size:end] = np.array(column, dtype=float)
+        buffers["hour"][size:end] = [target_time.hour for target_time in target_times]
+        buffers["month"][size:end] = [target_time.month for target_time in target_times]
+        buffers["region"][size:end] = [region or "Sconosciuta" for region in regions]
+        size = end
+
+    columns = {name: values[:size] for name, values in buffers.items()}
+    for name, default in _TRAINING_FLOAT_COLUMNS:
+        if default is not None:
+            column = columns[name]
+            column[np.isnan(column) | (column == 0)] = default
+    columns["forecast_wind_direction"] = np.nan_to_num(columns["forecast_wind_direction"]) % 360.0
+    return columns
+
+
+def _take_rows(columns: dict[str, np.ndarray], mask: np.ndarray) -> dict[str, np.ndarray]:
+    return {name: values[mask] for name, values in columns.items()}
+
+
+def _condition_codes(weather_code: np.ndarray, cloud_cover: np.ndarray, precipitation: np.ndarray) -> np.ndarray:
+    """Versione colonnare di `_condition_from_inputs`: NaN equivale a None, ritorna i codici CONDITION_TO_CODE."""
+    rain = (np.nan_to_num(precipitation) > 0.15) | np.isin(weather_code, list(RAIN_WEATHER_CODES))
+    from_cloud = np.select([cloud_cover <= 25, cloud_cover <= 60], [0, 1], default=2)
+    from_code = np.select([np.isin(weather_code, [0, 1]), weather_code == 2], [0, 1], default=2)
+    codes = np.where(np.isnan(cloud_cover), from_code, from_cloud)
+    return np.where(rain, CONDITION_TO_CODE["pioggia"], codes).astype(int)
+
+
+def _encode_regions(regions: np.ndarray) -> tuple[LabelEncoder, dict[str, int]]:
     encoder = LabelEncoder()
-    encoder.fit(regions)
-    _known_regions = regions
-    _label_encoder = encoder
-    return encoder
-
-
-def _build_temperature_matrices(rows: list[dict], encoder: LabelEncoder) -> tuple[np.ndarray, np.ndarray]:
-    X, y = [], []
-    for row in rows:
-        region_code = int(encoder.transform([row["region"]])[0])
-        X.append([
-            row["forecast_temp"],
-            row["humidity"],
-            row["hour"],
-            row["month"],
-            row["lat"],
-            row["cloud_cover"],
-            row["lead_hours"],
-            region_code,
-        ])
-        y.append(row["error"])
-    return np.array(X), np.array(y)
-
-
-def _build_rain_matrices(rows: list[dict], encoder: LabelEncoder) -> tuple[np.ndarray, np.ndarray]:
-    X, y = [], []
-    for row in rows:
-        region_code = int(encoder.transform([row["region"]])[0])
-        X.append([
-            row["forecast_temp"],
-            row["humidity"],
-            row["hour"],
-            row["month"],
-            row["lat"],
-            row["cloud_cover"],
-            row["lead_hours"],
-            region_code,
-        ])
-        y.append(1 if (row["actual_precipitation"] or 0.0) > 0.1 else 0)
-    return np.array(X), np.array(y)
-
-
-def _build_condition_matrices(rows: list[dict], encoder: LabelEncoder) -> tuple[np.ndarray, np.ndarray]:
-    X, y = [], []
-    for row in rows:
-        if row["actual_weather_code"] is None and row["actual_cloud_cover"] is None and row["actual_precipitation"] is None:
-            continue
-
-        region_code = int(encoder.transform([row["region"]])[0])
-        provider_condition = _condition_from_inputs(
-            weather_code=row["forecast_weather_code"],
-            cloud_cover=row["cloud_cover"],
-            precipitation=row["forecast_precipitation"],
-        )
-        actual_condition = _condition_from_inputs(
-            weather_code=row["actual_weather_code"],
-            cloud_cover=row["actual_cloud_cover"],
-            precipitation=row["actual_precipitation"],
-        )
-        X.append([
-            row["forecast_temp"],
-            row["humidity"],
-            row["hour"],
-            row["month"],
-            row["lat"],
-            row["cloud_cover"],
-            row["lead_hours"],
-            row["forecast_precipitation"],
-            row["forecast_wind_speed"],
-            row["forecast_wind_direction"],
-            region_code,
-            CONDITION_TO_CODE[provider_condition],
-            row["forecast_weather_code"] or 0,
-        ])
-        y.append(CONDITION_TO_CODE[actual_condition])
-    return np.array(X), np.array(y)
+    encoder.fit(sorted(set(regions.tolist()) or {"Sconosciuta"}))
+    return encoder, _codebook_from_encoder(encoder)
+
+
+def _legacy_feature_columns(columns: dict[str, np.ndarray]) -> np.ndarray:
+    return np.column_stack([
+        columns["forecast_temp"],
+        columns["humidity"],
+        columns["hour"],
+        columns["month"],
+        columns["lat"],
+        columns["cloud_cover"],
+        columns["lead_hours"],
+        columns["region_code"],
+    ])
+
+
+def _build_temperature_matrices(columns: dict[str, np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    return _legacy_feature_columns(columns), columns["error"]
+
+
+def _build_rain_matrices(columns: dict[str, np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    y = (np.nan_to_num(columns["actual_precipitation"]) > 0.1).astype(int)
+    return _legacy_feature_columns(columns), y
+
+
+def _build_condition_matrices(columns: dict[str, np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    observed = ~(
+        np.isnan(columns["actual_weather_code"])
+        & np.isnan(columns["actual_cloud_cover"])
+        & np.isnan(columns["actual_precipitation"])
+    )
+    columns = _take_rows(columns, observed)
+
+    provider_codes = _condition_codes(
+        columns["forecast_weather_code"], columns["cloud_cover"], columns["forecast_precipitation"]
+    )
+    actual_codes = _condition_codes(
+        columns["actual_weather_code"], columns["actual_cloud_cover"], columns["actual_precipitation"]
+    )
+    X = np.column_stack([
+        columns["forecast_temp"],
+        columns["humidity"],
+        columns["hour"],
+        columns["month"],
+        columns["lat"],
+        columns["cloud_cover"],
+        columns["lead_hours"],
+        columns["forecast_precipitation"],
+        columns["forecast_wind_speed"],
+        columns["forecast_wind_direction"],
+        columns["region_code"],
+        provider_codes,
+        np.nan_to_num(columns["forecast_weather_code"]),
+    ])
+    return X, actual_codes
+
+
+def _majority_accuracy(y: np.ndarray) -> float:
+    """Accuratezza del baseline che predice sempre la classe più frequente."""
+    return float(np.max(np.bincount(y)) / len(y))
 
 
 def _split_train_validation(X: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray] | None:
@@ -349,9 +406,8 @@ def _split_train_validation(X: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, n
     return X[:split_idx], X[split_idx:], y[:split_idx], y[split_idx:]
 
 
-def _train_temperature_pipeline(rows: list[dict]) -> dict:
-    encoder = _encode_regions(rows)
-    X, y = _build_temperature_matrices(rows, encoder)
+def _train_temperature_pipeline(columns: dict[str, np.ndarray]) -> dict:
+    X, y = _build_temperature_matrices(columns)
     split = _split_train_validation(X, y)
     if split is None:
         return {"success": False, "message": "Campioni insufficienti per split temporale"}
@@ -361,7 +417,7 @@ def _train_temperature_pipeline(rows: list[dict]) -> dict:
 
     pipeline = Pipeline([
         ("scaler", StandardScaler()),
-        ("ridge", Ridge(alpha=1.0)),
+        ("ridge", Ridge(alpha=RIDGE_ALPHA)),
     ])
     pipeline.fit(X_train, y_train)
 
@@ -373,37 +429,40 @@ def _train_temperature_pipeline(rows: list[dict]) -> dict:
             "baseline_mae": baseline_mae,
             "mae": mae,
             "pipeline": None,
-            "encoder": encoder,
         }
 
     return {
         "success": True,
         "pipeline": pipeline,
-        "encoder": encoder,
         "mae": mae,
         "baseline_mae": baseline_mae,
-        "n_samples": len(rows),
+        "n_samples": len(y),
     }
 
 
-def _train_rain_pipeline(rows: list[dict], encoder: LabelEncoder) -> dict:
-    rain_rows = [row for row in rows if row["actual_precipitation"] is not None]
-    if len(rain_rows) < 20:
+def _classifier_pipeline() -> Pipeline:
+    """Regressione logistica via SGD: stesso modello del training completo, aggiornabile con partial_fit."""
+    return Pipeline([
+        ("scaler", StandardScaler()),
+        ("clf", SGDClassifier(loss="log_loss", alpha=SGD_ALPHA, max_iter=1000, tol=1e-4, random_state=0)),
+    ])
+
+
+def _train_rain_pipeline(columns: dict[str, np.ndarray]) -> dict:
+    rain_columns = _take_rows(columns, ~np.isnan(columns["actual_precipitation"]))
+    if len(rain_columns["error"]) < 20:
         return {"success": False, "message": "Dati insufficienti per il modello pioggia"}
 
-    X, y = _build_rain_matrices(rain_rows, encoder)
+    X, y = _build_rain_matrices(rain_columns)
     split = _split_train_validation(X, y)
     if split is None:
         return {"success": False, "message": "Campioni insufficienti per il modello pioggia"}
 
     X_train, X_val, y_train, y_val = split
-    baseline_acc = max(float(np.mean(y_val)), 1.0 - float(np.mean(y_val)))
+    baseline_acc = _majority_accuracy(y_val)
 
-    pipeline = Pipeline([
-        ("scaler", StandardScaler()),
-        ("clf", LogisticRegression(class_weight="balanced", max_iter=1000)),
-    ])
-    pipeline.fit(X_train, y_train)
+    pipeline = _classifier_pipeline()
+    pipeline.fit(X_train, y_train, clf__sample_weight=balanced_sample_weight(y_train))
 
     acc = float(accuracy_score(y_val, pipeline.predict(X_val)))
     if acc < baseline_acc:
@@ -419,13 +478,13 @@ def _train_rain_pipeline(rows: list[dict], encoder: LabelEncoder) -> dict:
         "pipeline": pipeline,
         "accuracy": acc,
         "baseline_accuracy": baseline_acc,
-        "n_samples": len(rain_rows),
+        "n_samples": len(y),
         "rain_share": round(float(np.mean(y)), 3),
     }
 
 
-def _train_condition_pipeline(rows: list[dict], encoder: LabelEncoder) -> dict:
-    X, y = _build_condition_matrices(rows, encoder)
+def _train_condition_pipeline(columns: dict[str, np.ndarray]) -> dict:
+    X, y = _build_condition_matrices(columns)
     if len(X) < 40:
         return {"success": False, "message": "Dati insufficienti per il modello condizioni"}
     if len(set(y.tolist())) < 2:
@@ -436,13 +495,10 @@ def _train_condition_pipeline(rows: list[dict], encoder: LabelEncoder) -> dict:
         return {"success": False, "message": "Campioni insufficienti per il modello condizioni"}
 
     X_train, X_val, y_train, y_val = split
-    baseline_acc = float(np.max(np.bincount(y_val)) / len(y_val))
+    baseline_acc = _majority_accuracy(y_val)
 
-    pipeline = Pipeline([
-        ("scaler", StandardScaler()),
-        ("clf", LogisticRegression(class_weight="balanced", max_iter=2000)),
-    ])
-    pipeline.fit(X_train, y_train)
+    pipeline = _classifier_pipeline()
+    pipeline.fit(X_train, y_train, clf__sample_weight=balanced_sample_weight(y_train))
 
     acc = float(accuracy_score(y_val, pipeline.predict(X_val)))
     if acc < baseline_acc:
@@ -462,23 +518,72 @@ def _train_condition_pipeline(rows: list[dict], encoder: LabelEncoder) -> dict:
     }
 
 
+def _promote_models(
+    pipeline: Optional[Pipeline],
+    rain_pipeline: Optional[Pipeline],
+    condition_pipeline: Optional[Pipeline],
+    region_codebook: Optional[dict[str, int]] = None,
+):
+    """Attiva le pipeline, il codebook regioni e gli scorer compilati per il percorso di richiesta."""
+    global _pipeline, _rain_pipeline, _condition_pipeline, _scorer, _rain_scorer, _condition_scorer
+    global _region_codebook
+
+    _region_codebook = dict(region_codebook or {})
+    _pipeline = pipeline
+    _rain_pipeline = rain_pipeline
+    _condition_pipeline = condition_pipeline
+    _scorer = compile_pipeline(pipeline)
+    _rain_scorer = compile_pipeline(rain_pipeline)
+    _condition_scorer = compile_pipeline(condition_pipeline)
+
+
+def _store_model(
+    db: Session,
+    payload: dict,
+    *,
+    trained_at: datetime,
+    mae: float,
+    n_samples: int,
+    replace_latest: bool = False,
+) -> MlModelStore:
+    """Salva il modello in un nuovo record, oppure sovrascrive l'ultimo con `replace_latest`."""
+    record = None
+    if replace_latest:
+        record = db.query(MlModelStore).order_by(MlModelStore.trained_at.desc()).first()
+    if record is None:
+        record = MlModelStore()
+        db.add(record)
+    record.trained_at = trained_at
+    record.model_bytes = pickle.dumps(payload)
+    record.mae = mae
+    record.n_samples = n_samples
+    db.commit()
+    return record
+
+
 def train(min_samples: int = 100) -> dict:
     """
     Addestra i modelli sulle previsioni verificate con target_time futuro.
     Promuove ogni modello solo se batte un baseline semplice.
+    Inizializza anche lo stato per gli aggiornamenti incrementali successivi.
     """
-    global _pipeline, _rain_pipeline, _condition_pipeline, _latest_summary
+    global _latest_summary, _incremental_state
 
     db: Session = SessionLocal()
     try:
-        rows = _prepare_training_rows(db)
-        if len(rows) < min_samples:
+        cursor = _verified_cursor(db)
+        columns = _load_training_columns(db, verified_until=cursor)
+        n_rows = len(columns["error"])
+        if n_rows < min_samples:
             return {
                 "success": False,
-                "message": f"Dati insufficienti: {len(rows)} campioni (minimo {min_samples})",
+                "message": f"Dati insufficienti: {n_rows} campioni (minimo {min_samples})",
             }
 
-        temp_result = _train_temperature_pipeline(rows)
+        encoder, codebook = _encode_regions(columns["region"])
+        columns["region_code"] = _encode_region_column(columns["region"], codebook)
+
+        temp_result = _train_temperature_pipeline(columns)
         if not temp_result["success"]:
             return {
                 "success": False,
@@ -488,38 +593,35 @@ def train(min_samples: int = 100) -> dict:
             }
 
         pipeline = temp_result["pipeline"]
-        encoder = temp_result["encoder"]
-        rain_result = _train_rain_pipeline(rows, encoder)
-        condition_result = _train_condition_pipeline(rows, encoder)
+        rain_result = _train_rain_pipeline(columns)
+        condition_result = _train_condition_pipeline(columns)
 
         rain_pipeline = rain_result["pipeline"] if rain_result.get("success") else None
         condition_pipeline = condition_result["pipeline"] if condition_result.get("success") else None
 
-        model_data = pickle.dumps({
+        trained_at = datetime.now(timezone.utc)
+        X, y = _build_temperature_matrices(columns)
+        ridge = RidgeAccumulator(X.shape[1])
+        ridge.update(X, y)
+        incremental = {"ridge": ridge, "cursor": cursor, "full_trained_at": trained_at, "updates": 0}
+
+        record = _store_model(db, {
             "pipeline": pipeline,
             "rain_pipeline": rain_pipeline,
             "condition_pipeline": condition_pipeline,
             "le": encoder,
-            "regions": _known_regions,
+            "regions": list(codebook),
+            "region_codebook": codebook,
             "baseline_mae": temp_result["baseline_mae"],
             "rain_accuracy": rain_result.get("accuracy"),
             "rain_baseline_accuracy": rain_result.get("baseline_accuracy"),
             "condition_accuracy": condition_result.get("accuracy"),
             "condition_baseline_accuracy": condition_result.get("baseline_accuracy"),
-        })
+            "incremental": incremental,
+        }, trained_at=trained_at, mae=temp_result["mae"], n_samples=temp_result["n_samples"])
 
-        record = MlModelStore(
-            trained_at=datetime.now(timezone.utc),
-            model_bytes=model_data,
-            mae=temp_result["mae"],
-            n_samples=temp_result["n_samples"],
-        )
-        db.add(record)
-        db.commit()
-
-        _pipeline = pipeline
-        _rain_pipeline = rain_pipeline
-        _condition_pipeline = condition_pipeline
+        _promote_models(pipeline, rain_pipeline, condition_pipeline, codebook)
+        _incremental_state = incremental
         _latest_summary = {
             "model_ready": True,
             "rain_model_ready": rain_pipeline is not None,
@@ -533,6 +635,7 @@ def train(min_samples: int = 100) -> dict:
             "model_samples": temp_result["n_samples"],
             "model_trained_at": record.trained_at.isoformat(),
         }
+        refresh_stats()
 
         return {
             "success": True,
@@ -556,18 +659,181 @@ def train(min_samples: int = 100) -> dict:
         db.close()
 
 
+def _split_columns(columns: dict[str, np.ndarray]) -> tuple[dict, dict] | None:
+    """Split temporale delle colonne con lo stesso taglio di `_split_train_validation`."""
+    n_rows = len(columns["error"])
+    if n_rows < 10:
+        return None
+    split_idx = min(max(int(n_rows * 0.8), 1), n_rows - 1)
+    update_mask = np.arange(n_rows) < split_idx
+    return _take_rows(columns, update_mask), _take_rows(columns, ~update_mask)
+
+
+def _update_classifier(
+    active: Optional[Pipeline],
+    update: tuple[np.ndarray, np.ndarray],
+    holdout: tuple[np.ndarray, np.ndarray],
+    previous: tuple[float | None, float | None],
+) -> dict:
+    """
+    partial_fit del classificatore attivo sulle righe di update, valutato sulle righe di holdout.
+    La copia aggiornata sostituisce quella attiva solo se batte il baseline e non la peggiora;
+    le metriche ritornate sono sempre quelle del classificatore tenuto, sull'holdout.
+    Senza righe di holdout il classificatore attivo resta con le metriche `previous`.
+    """
+    X_hold, y_hold = holdout
+    if active is None or len(y_hold) == 0:
+        return {"pipeline": active, "updated": False, "accuracy": previous[0], "baseline_accuracy": previous[1]}
+
+    baseline_acc = _majority_accuracy(y_hold)
+    active_acc = float(accuracy_score(y_hold, active.predict(X_hold)))
+    candidate = partial_fit_pipeline(active, *update)
+    if candidate is not None:
+        acc = float(accuracy_score(y_hold, candidate.predict(X_hold)))
+        if acc >= baseline_acc and acc >= active_acc:
+            return {"pipeline": candidate, "updated": True, "accuracy": acc, "baseline_accuracy": baseline_acc}
+    return {"pipeline": active, "updated": False, "accuracy": active_acc, "baseline_accuracy": baseline_acc}
+
+
+def train_incremental() -> dict:
+    """
+    Aggiorna i modelli promossi con le sole previsioni verificate dopo l'ultimo aggiornamento.
+    Le righe nuove si dividono in update e holdout temporale (80/20, come il training completo):
+    la Ridge temperatura viene risolta dalle statistiche accumulate con le righe di update,
+    i classificatori proseguono con partial_fit. Le pipeline aggiornate sono valutate sull'holdout
+    prima della promozione e le metriche salvate sono le loro. Se la Ridge aggiornata non batte
+    il baseline l'aggiornamento viene scartato e si segnala la necessità di un training completo.
+    Le righe di holdout entrano nei modelli solo al training completo successivo.
+    """
+    global _latest_summary, _incremental_state
+
+    state = _incremental_state
+    if state is None or _pipeline is None:
+        return {"success": False, "skipped": True, "message": "Nessuno stato incrementale: serve un training completo"}
+
+    db: Session = SessionLocal()
+    try:
+        cursor = _verified_cursor(db)
+        # Un cursore assente esclude comunque le righe senza verified_at, già viste dal training completo
+        verified_after = state["cursor"] or datetime.min.replace(tzinfo=timezone.utc)
+        columns = _load_training_columns(db, verified_after=verified_after, verified_until=cursor)
+        n_new = len(columns["error"])
+        if n_new == 0:
+            return {"success": False, "skipped": True, "message": "Nessuna nuova previsione verificata"}
+
+        columns["region_code"] = _encode_region_column(columns["region"], _region_codebook)
+        split = _split_columns(columns)
+        if split is None:
+            # Il cursore non avanza: le righe restano per il prossimo aggiornamento
+            return {
+                "success": False,
+                "skipped": True,
+                "message": f"Solo {n_new} nuove previsioni verificate: troppo poche per validare l'aggiornamento",
+            }
+
+        update_columns, holdout_columns = split
+        X_hold, y_hold = _build_temperature_matrices(holdout_columns)
+
+        ridge = copy.deepcopy(state["ridge"])
+        ridge.update(*_build_temperature_matrices(update_columns))
+        pipeline = ridge.to_pipeline(alpha=RIDGE_ALPHA)
+        mae = float(mean_absolute_error(y_hold, pipeline.predict(X_hold)))
+        baseline_mae = float(np.mean(np.abs(y_hold)))
+        if mae >= baseline_mae:
+            return {
+                "success": False,
+                "needs_full_refit": True,
+                "message": f"Il modello aggiornato non supera il baseline sui nuovi dati (MAE {mae:.3f} vs {baseline_mae:.3f})",
+                "mae": mae,
+                "baseline_mae": baseline_mae,
+            }
+
+        rain_update = _take_rows(update_columns, ~np.isnan(update_columns["actual_precipitation"]))
+        rain_holdout = _take_rows(holdout_columns, ~np.isnan(holdout_columns["actual_precipitation"]))
+        rain = _update_classifier(
+            _rain_pipeline,
+            _build_rain_matrices(rain_update),
+            _build_rain_matrices(rain_holdout),
+            (_latest_summary.get("rain_accuracy"), _latest_summary.get("rain_baseline_accuracy")),
+        )
+        condition = _update_classifier(
+            _condition_pipeline,
+            _build_condition_matrices(update_columns),
+            _build_condition_matrices(holdout_columns),
+            (_latest_summary.get("condition_accuracy"), _latest_summary.get("condition_baseline_accuracy")),
+        )
+        rain_pipeline, condition_pipeline = rain["pipeline"], condition["pipeline"]
+
+        trained_at = datetime.now(timezone.utc)
+        incremental = {**state, "ridge": ridge, "cursor": cursor, "updates": state["updates"] + 1}
+        # Dopo il primo aggiornamento l'ultimo record è già incrementale: lo si sovrascrive,
+        # così lo store tiene i training completi più un solo record incrementale
+        record = _store_model(db, {
+            "pipeline": pipeline,
+            "rain_pipeline": rain_pipeline,
+            "condition_pipeline": condition_pipeline,
+            "le": LabelEncoder().fit(list(_region_codebook)),
+            "regions": list(_region_codebook),
+            "region_codebook": _region_codebook,
+            "baseline_mae": baseline_mae,
+            "rain_accuracy": rain["accuracy"],
+            "rain_baseline_accuracy": rain["baseline_accuracy"],
+            "condition_accuracy": condition["accuracy"],
+            "condition_baseline_accuracy": condition["baseline_accuracy"],
+            "incremental": incremental,
+        }, trained_at=trained_at, mae=mae, n_samples=ridge.n_samples, replace_latest=state["updates"] > 0)
+
+        _promote_models(pipeline, rain_pipeline, condition_pipeline, _region_codebook)
+        _incremental_state = incremental
+        _latest_summary = {
+            **_latest_summary,
+            "model_mae": mae,
+            "baseline_mae": baseline_mae,
+            "rain_accuracy": rain["accuracy"],
+            "rain_baseline_accuracy": rain["baseline_accuracy"],
+            "condition_accuracy": condition["accuracy"],
+            "condition_baseline_accuracy": condition["baseline_accuracy"],
+            "model_samples": ridge.n_samples,
+            "model_trained_at": record.trained_at.isoformat(),
+        }
+        refresh_stats()
+
+        return {
+            "success": True,
+            "mae": mae,
+            "baseline_mae": baseline_mae,
+            "n_new": n_new,
+            "n_holdout": len(y_hold),
+            "n_samples": ridge.n_samples,
+            "trained_at": record.trained_at.isoformat(),
+            "rain_updated": rain["updated"],
+            "rain_accuracy": rain["accuracy"],
+            "condition_updated": condition["updated"],
+            "condition_accuracy": condition["accuracy"],
+        }
+    except Exception as e:
+        print(f"[ERROR] Errore aggiornamento incrementale ML: {e}")
+        return {"success": False, "message": str(e)}
+    finally:
+        db.close()
+
+
+def last_full_training() -> datetime | None:
+    """Istante dell'ultimo training completo da cui discende il modello attivo."""
+    return _incremental_state["full_trained_at"] if _incremental_state else None
+
+
 def load_latest_model() -> bool:
     """Carica in memoria l'ultimo modello promosso."""
-    global _pipeline, _rain_pipeline, _condition_pipeline, _label_encoder, _known_regions, _latest_summary
+    global _latest_summary, _incremental_state
 
     db: Session = SessionLocal()
     try:
         record = db.query(MlModelStore).order_by(MlModelStore.trained_at.desc()).first()
         if not record or not record.model_bytes:
             print("[INFO]  Nessun modello ML salvato nel DB")
-            _pipeline = None
-            _rain_pipeline = None
-            _condition_pipeline = None
+            _promote_models(None, None, None)
+            _incremental_state = None
             _latest_summary = {
                 **_latest_summary,
                 "model_ready": False,
@@ -582,11 +848,12 @@ def load_latest_model() -> bool:
             return False
 
         data = pickle.loads(record.model_bytes)
-        _pipeline = data["pipeline"]
-        _rain_pipeline = data.get("rain_pipeline")
-        _condition_pipeline = data.get("condition_pipeline")
-        _label_encoder = data["le"]
-        _known_regions = data.get("regions", [])
+        codebook = data.get("region_codebook")
+        if codebook is None and data.get("le") is not None:
+            # Modelli salvati prima del codebook: lo si ricava dalle classi dell'encoder
+            codebook = _codebook_from_encoder(data["le"])
+        _promote_models(data["pipeline"], data.get("rain_pipeline"), data.get("condition_pipeline"), codebook)
+        _incremental_state = data.get("incremental")
         _latest_summary = {
             "model_ready": _pipeline is not None,
             "rain_model_ready": _rain_pipeline is not None,
@@ -609,6 +876,110 @@ def load_latest_model() -> bool:
         db.close()
 
 
+def predict_corrections(items: list[dict]) -> list[dict]:
+    """Correzioni di temperatura per più previsioni con una sola chiamata al modello."""
+    if not items:
+        return []
+    if _pipeline is None:
+        return [
+            {"correction": 0.0, "corrected_temp": item["forecast_temp"], "model_ready": False}
+            for item in items
+        ]
+
+    try:
+        model = _scorer if _scorer is not None else _pipeline
+        corrections = np.clip(model.predict(_feature_matrix(items)), -5.0, 5.0).tolist()
+    except Exception as e:
+        return [
+            {"correction": 0.0, "corrected_temp": item["forecast_temp"], "model_ready": False, "error": str(e)}
+            for item in items
+        ]
+
+    return [
+        {
+            "correction": round(correction, 2),
+            "corrected_temp": round(item["forecast_temp"] + correction, 1),
+            "model_ready": True,
+            "confidence": _confidence_from_score(abs(correction) / 1.5),
+        }
+        for item, correction in zip(items, corrections)
+    ]
+
+
+def predict_rain_probabilities(items: list[dict]) -> list[dict]:
+    """Probabilità di pioggia per più previsioni con una sola chiamata al modello."""
+    if not items:
+        return []
+    if _rain_pipeline is None:
+        return [
+            {"model_ready": False, "message": "Modello pioggia non ancora disponibile"}
+            for _ in items
+        ]
+
+    try:
+        model = _rain_scorer if _rain_scorer is not None else _rain_pipeline
+        probabilities = model.predict_proba(_feature_matrix(items))[:, 1].tolist()
+    except Exception as e:
+        return [{"model_ready": False, "error": str(e)} for _ in items]
+
+    return [
+        {
+            "rain_probability": round(rain_prob, 3),
+            "will_rain": rain_prob >= 0.5,
+            "model_ready": True,
+            "confidence": _confidence_from_score(abs(rain_prob - 0.5) * 2),
+        }
+        for rain_prob in probabilities
+    ]
+
+
+def _provider_outlook(provider_condition: str, error: str | None = None) -> dict:
+    outlook = {
+        "model_ready": False,
+        "expected_condition": provider_condition,
+        "display_condition": _condition_display(provider_condition),
+        "confidence": "media",
+        "source": "provider",
+    }
+    if error is not None:
+        outlook["error"] = error
+    return outlook
+
+
+def predict_condition_outlooks(items: list[dict]) -> list[dict]:
+    """Condizione attesa per più previsioni: una sola `predict_proba`, classe scelta per argmax."""
+    if not items:
+        return []
+    provider_conditions = [_provider_condition(item) for item in items]
+    if _condition_pipeline is None:
+        return [_provider_outlook(condition) for condition in provider_conditions]
+
+    try:
+        model = _condition_scorer if _condition_scorer is not None else _condition_pipeline
+        probabilities = model.predict_proba(_condition_feature_matrix(items, provider_conditions))
+        best = np.argmax(probabilities, axis=1)
+        predicted_codes = model.classes_[best].tolist()
+        top_probabilities = probabilities[np.arange(len(items)), best].tolist()
+    except Exception as e:
+        return [_provider_outlook(condition, str(e)) for condition in provider_conditions]
+
+    outlooks = []
+    for provider_condition, predicted_code, top_probability in zip(
+        provider_conditions, predicted_codes, top_probabilities
+    ):
+        predicted_label = CONDITION_LABELS[int(predicted_code)]
+        outlooks.append({
+            "model_ready": True,
+            "expected_condition": predicted_label,
+            "display_condition": _condition_display(predicted_label),
+            "confidence": _confidence_from_score(top_probability),
+            "source": "ml",
+            "probability": round(top_probability, 3),
+            "provider_condition": provider_condition,
+        })
+    return outlooks
+
+
 def predict_correction(
     *,
     temp: float,
@@ -621,32 +992,16 @@ def predict_correction(
     lead_hours: int = 0,
 ) -> dict:
     """Predice la correzione da applicare alla temperatura prevista."""
-    if _pipeline is None:
-        return {"correction": 0.0, "corrected_temp": temp, "model_ready": False}
-
-    try:
-        features = _build_features(
-            forecast_temp=temp,
-            humidity=humidity,
-            hour=hour,
-            month=month,
-            lat=lat,
-            region=region,
-            cloud_cover=cloud_cover,
-            lead_hours=lead_hours,
-        )
-        correction = float(_pipeline.predict(features)[0])
-        correction = max(-5.0, min(5.0, correction))
-        confidence = _confidence_from_score(abs(correction) / 1.5)
-
-        return {
-            "correction": round(correction, 2),
-            "corrected_temp": round(temp + correction, 1),
-            "model_ready": True,
-            "confidence": confidence,
-        }
-    except Exception as e:
-        return {"correction": 0.0, "corrected_temp": temp, "model_ready": False, "error": str(e)}
+    return predict_corrections([{
+        "forecast_temp": temp,
+        "humidity": humidity,
+        "hour": hour,
+        "month": month,
+        "lat": lat,
+        "region": region,
+        "cloud_cover": cloud_cover,
+        "lead_hours": lead_hours,
+    }])[0]
 
 
 def predict_rain_probability(
@@ -661,34 +1016,16 @@ def predict_rain_probability(
     lead_hours: int = 0,
 ) -> dict:
     """Predice la probabilità di pioggia per una previsione futura."""
-    if _rain_pipeline is None:
-        return {
-            "model_ready": False,
-            "message": "Modello pioggia non ancora disponibile",
-        }
-
-    try:
-        features = _build_features(
-            forecast_temp=forecast_temp,
-            humidity=humidity,
-            hour=hour,
-            month=month,
-            lat=lat,
-            region=region,
-            cloud_cover=cloud_cover,
-            lead_hours=lead_hours,
-        )
-        proba = _rain_pipeline.predict_proba(features)[0]
-        rain_prob = float(proba[1])
-
-        return {
-            "rain_probability": round(rain_prob, 3),
-            "will_rain": rain_prob >= 0.5,
-            "model_ready": True,
-            "confidence": _confidence_from_score(abs(rain_prob - 0.5) * 2),
-        }
-    except Exception as e:
-        return {"model_ready": False, "error": str(e)}
+    return predict_rain_probabilities([{
+        "forecast_temp": forecast_temp,
+        "humidity": humidity,
+        "hour": hour,
+        "month": month,
+        "lat": lat,
+        "region": region,
+        "cloud_cover": cloud_cover,
+        "lead_hours": lead_hours,
+    }])[0]
 
 
 def predict_condition_outlook(
@@ -706,112 +1043,44 @@ def predict_condition_outlook(
     forecast_wind_direction: float = 0.0,
     forecast_weather_code: int | None = None,
 ) -> dict:
-    provider_condition = _condition_from_inputs(
-        weather_code=forecast_weather_code,
-        cloud_cover=cloud_cover,
-        precipitation=forecast_precipitation,
-    )
-
-    if _condition_pipeline is None:
-        return {
-            "model_ready": False,
-            "expected_condition": provider_condition,
-            "display_condition": _condition_display(provider_condition),
-            "confidence": "media",
-            "source": "provider",
-        }
-
-    try:
-        features = _build_condition_features(
-            forecast_temp=forecast_temp,
-            humidity=humidity,
-            hour=hour,
-            month=month,
-            lat=lat,
-            region=region,
-            cloud_cover=cloud_cover,
-            lead_hours=lead_hours,
-            forecast_precipitation=forecast_precipitation,
-            forecast_wind_speed=forecast_wind_speed,
-            forecast_wind_direction=forecast_wind_direction,
-            forecast_weather_code=forecast_weather_code,
-        )
-        probabilities = _condition_pipeline.predict_proba(features)[0]
-        predicted_code = int(_condition_pipeline.predict(features)[0])
-        top_probability = float(np.max(probabilities))
-        predicted_label = CONDITION_LABELS[predicted_code]
-
-        return {
-            "model_ready": True,
-            "expected_condition": predicted_label,
-            "display_condition": _condition_display(predicted_label),
-            "confidence": _confidence_from_score(top_probability),
-            "source": "ml",
-            "probability": round(top_probability, 3),
-            "provider_condition": provider_condition,
-        }
-    except Exception as e:
-        return {
-            "model_ready": False,
-            "expected_condition": provider_condition,
-            "display_condition": _condition_display(provider_condition),
-            "confidence": "media",
-            "source": "provider",
-            "error": str(e),
-        }
+    return predict_condition_outlooks([{
+        "forecast_temp": forecast_temp,
+        "humidity": humidity,
+        "hour": hour,
+        "month": month,
+        "lat": lat,
+        "region": region,
+        "cloud_cover": cloud_cover,
+        "lead_hours": lead_hours,
+        "forecast_precipitation": forecast_precipitation,
+        "forecast_wind_speed": forecast_wind_speed,
+        "forecast_wind_direction": forecast_wind_direction,
+        "forecast_weather_code": forecast_weather_code,
+    }])[0]
+
+
+def _daily_item(day: dict, *, lat: float, region: str, lead_hours: int) -> dict:
+    forecast_pop = _safe_float(day.get("pop"), 0.0)
+    return {
+        "forecast_temp": day.get("temp", {}).get("day", 0.0),
+        "humidity": _safe_float(day.get("humidity"), 55.0),
+        "hour": 14,
+        "month": datetime.fromisoformat(day["dt"]).month,
+        "lat": lat,
+        "region": region,
+        "cloud_cover": _safe_float(day.get("cloud_cover"), 55.0),
+        "lead_hours": min(lead_hours, 6),
+        "forecast_pop": forecast_pop,
+        "forecast_precipitation": round(forecast_pop * 2.0, 2),
+        "forecast_wind_speed": _safe_float(day.get("wind_speed"), 0.0),
+        "forecast_wind_direction": _safe_float(day.get("wind_deg"), 0.0),
+        "forecast_weather_code": day.get("weather_code"),
+    }
 
 
-def build_daily_insight(
-    *,
-    day: dict,
-    lat: float,
-    region: str,
-    lead_hours: int,
-) -> dict:
-    day_date = datetime.fromisoformat(day["dt"])
-    hour = 14
-    forecast_temp = day.get("temp", {}).get("day", 0.0)
-    forecast_pop = _safe_float(day.get("pop"), 0.0)
-    forecast_precipitation = round(forecast_pop * 2.0, 2)
-    cloud_cover = _safe_float(day.get("cloud_cover"), 55.0)
-    wind_speed = _safe_float(day.get("wind_speed"), 0.0)
-    wind_direction = _safe_float(day.get("wind_deg"), 0.0)
-    weather_code = day.get("weather_code")
-
-    correction = predict_correction(
-        temp=forecast_temp,
-        humidity=_safe_float(day.get("humidity"), 55.0),
-        hour=hour,
-        month=day_date.month,
-        lat=lat,
-        region=region,
-        cloud_cover=cloud_cover,
-        lead_hours=min(lead_hours, 6),
-    )
-    rain = predict_rain_probability(
-        forecast_temp=forecast_temp,
-        humidity=_safe_float(day.get("humidity"), 55.0),
-        hour=hour,
-        month=day_date.month,
-        lat=lat,
-        region=region,
-        cloud_cover=cloud_cover,
-        lead_hours=min(lead_hours, 6),
-    )
-    condition = predict_condition_outlook(
-        forecast_temp=forecast_temp,
-        humidity=_safe_float(day.get("humidity"), 55.0),
-        hour=hour,
-        month=day_date.month,
-        lat=lat,
-        region=region,
-        cloud_cover=cloud_cover,
-        lead_hours=min(lead_hours, 6),
-        forecast_precipitation=forecast_precipitation,
-        forecast_wind_speed=wind_speed,
-        forecast_wind_direction=wind_direction,
-        forecast_weather_code=weather_code,
-    )
+def _assemble_daily_insight(day: dict, item: dict, correction: dict, rain: dict, condition: dict) -> dict:
+    forecast_pop = item["forecast_pop"]
+    wind_speed = item["forecast_wind_speed"]
 
     blended_rain = forecast_pop
     if rain.get("model_ready"):
@@ -840,38 +1109,135 @@ def build_daily_insight(
     }
 
 
+def build_forecast_insights(
+    *,
+    days: list[dict],
+    lat: float,
+    region: str,
+    lead_hours: list[int],
+    current: dict | None = None,
+) -> dict:
+    """
+    Insight ML per le condizioni correnti (opzionali) e per tutti i giorni di previsione.
+    Ogni modello riceve una sola matrice: correnti + giorni per temperatura e pioggia, giorni per le condizioni.
+    """
+    day_items = [
+        _daily_item(day, lat=lat, region=region, lead_hours=lead)
+        for day, lead in zip(days, lead_hours)
+    ]
+    head = [current] if current is not None else []
+    corrections = predict_corrections([*head, *day_items])
+    rains = predict_rain_probabilities([*head, *day_items])
+    conditions = predict_condition_outlooks(day_items)
+    offset = len(head)
+
+    result = {
+        "daily": [
+            _assemble_daily_insight(day, item, corrections[offset + index], rains[offset + index], conditions[index])
+            for index, (day, item) in enumerate(zip(days, day_items))
+        ],
+    }
+    if current is not None:
+        result["correction"] = corrections[0]
+        result["rain_prediction"] = rains[0]
+    return result
+
+
+def build_daily_insight(
+    *,
+    day: dict,
+    lat: float,
+    region: str,
+    lead_hours: int,
+) -> dict:
+    return build_forecast_insights(days=[day], lat=lat, region=region, lead_hours=[lead_hours])["daily"][0]
+
+
 def get_public_summary() -> dict:
     return dict(_latest_summary)
 
 
-def get_stats() -> dict:
-    """Statistiche aggregate sul modello e sul dataset."""
+def _load_stats() -> dict:
     db: Session = SessionLocal()
     try:
-        total = db.query(func.count(MlPrediction.id)).scalar() or 0
-        verified = db.query(func.count(MlPrediction.id)).filter(MlPrediction.verified.is_(True)).scalar() or 0
-        avg_error = db.query(func.avg(func.abs(MlPrediction.error))).filter(
-            MlPrediction.verified.is_(True),
-            MlPrediction.error.isnot(None),
-        ).scalar()
-
-        lead_error_rows = (
-            db.query(MlPrediction.lead_hours, func.avg(func.abs(MlPrediction.error)))
-            .filter(MlPrediction.verified.is_(True), MlPrediction.error.isnot(None))
-            .group_by(MlPrediction.lead_hours)
-            .order_by(MlPrediction.lead_hours)
-            .all()
-        )
+        return error_stats.read_summary(db)
+    finally:
+        db.close()
+
+
+def _store_stats(value: dict) -> dict:
+    _stats_snapshot["value"] = value
+    _stats_snapshot["loaded_at"] = time.monotonic()
+    return value
 
+
+def _snapshot_is_fresh() -> bool:
+    loaded_at = _stats_snapshot["loaded_at"]
+    return (
+        _stats_snapshot["value"] is not None
+        and loaded_at is not None
+        and time.monotonic() - loaded_at < STATS_CACHE_TTL_SECONDS
+    )
+
+
+def _reload_stats(*, force: bool = False) -> dict:
+    """
+    Single-flight: un solo thread interroga il DB, chi arriva durante il caricamento
+    attende e riusa lo snapshot appena scritto. _stats_lock è preso solo per lo scambio.
+    """
+    global _stats_loading
+
+    with _stats_load_lock:
+        with _stats_lock:
+            if not force and _snapshot_is_fresh():
+                return _stats_snapshot["value"]
+            _stats_loading = True
+        try:
+            value = _load_stats()
+        finally:
+            with _stats_lock:
+                _stats_loading = False
+        with _stats_lock:
+            return _store_stats(value)
+
+
+def refresh_stats() -> dict:
+    """Ricalcola subito lo snapshot delle statistiche (ciclo orario, training)."""
+    value = _reload_stats(force=True)
+    return {**value, **get_public_summary()}
+
+
+def get_stats_cache_info() -> dict:
+    with _stats_lock:
+        loaded_at = _stats_snapshot["loaded_at"]
         return {
-            "total_predictions": int(total),
-            "verified_predictions": int(verified),
-            "avg_error_celsius": round(float(avg_error), 3) if avg_error is not None else None,
-            "lead_time_error": [
-                {"lead_hours": lead_hours or 0, "avg_abs_error": round(float(value), 3)}
-                for lead_hours, value in lead_error_rows
-            ],
-            **get_public_summary(),
+            "hits": _stats_snapshot["hits"],
+            "misses": _stats_snapshot["misses"],
+            "ttl_seconds": STATS_CACHE_TTL_SECONDS,
+            "age_seconds": (
+                round(time.monotonic() - loaded_at, 1)
+                if _stats_snapshot["value"] is not None and loaded_at is not None
+                else None
+            ),
         }
-    finally:
-        db.close()
+
+
+def get_stats() -> dict:
+    """
+    Statistiche aggregate sul modello e sul dataset.
+    La parte DB è servita da uno snapshot in memoria con TTL; il riepilogo modello è sempre attuale.
+    Uno snapshot scaduto resta servito finché un altro thread lo sta ricaricando.
+    """
+    with _stats_lock:
+        value = _stats_snapshot["value"]
+        if _snapshot_is_fresh():
+            _stats_snapshot["hits"] += 1
+        else:
+            _stats_snapshot["misses"] += 1
+            if not _stats_loading:
+                value = None
+
+    if value is None:
+        value = _reload_stats()
+
+    return {**value, **get_public_summary()}
@@ -0,0 +1,109 @@
+"""
+ml_scoring.py — scorer NumPy compilati dalle pipeline lineari scikit-learn.
+
+Una Pipeline `StandardScaler` + `Ridge`/`LogisticRegression`/`SGDClassifier`
+(log_loss) equivale a una trasformazione affine: scaler e coefficienti vengono
+fusi in una matrice pesi e un bias, così l'inferenza è un solo prodotto
+matriciale senza la validazione per chiamata di scikit-learn.
+"""
+from __future__ import annotations
+
+from typing import Optional
+
+import numpy as np
+from sklearn.linear_model import LogisticRegression, Ridge, SGDClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+PARITY_PROBE_ROWS = 16
+PARITY_TOLERANCE = 1e-6
+
+
+class LinearScorer:
+    """Modello lineare compilato con la stessa interfaccia `predict`/`predict_proba` della pipeline."""
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, *, kind: str, classes: np.ndarray | None = None):
+        self.weights = weights
+        self.bias = bias
+        self.kind = kind
+        self.classes_ = classes
+
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        return np.asarray(X, dtype=float) @ self.weights + self.bias
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        scores = self.decision_function(X)
+        if self.kind == "regression":
+            return scores[:, 0]
+        if self.kind == "binary":
+            return self.classes_[(scores[:, 0] > 0).astype(int)]
+        return self.classes_[np.argmax(scores, axis=1)]
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        scores = self.decision_function(X)
+        if self.kind == "binary":
+            positive = 1.0 / (1.0 + np.exp(-scores[:, 0]))
+            return np.column_stack([1.0 - positive, positive])
+        if self.kind == "multinomial":
+            shifted = np.exp(scores - scores.max(axis=1, keepdims=True))
+            return shifted / shifted.sum(axis=1, keepdims=True)
+        if self.kind == "ovr":
+            # Come SGDClassifier: sigmoidi one-vs-rest normalizzate
+            positive = 1.0 / (1.0 + np.exp(-scores))
+            totals = positive.sum(axis=1, keepdims=True)
+            return np.divide(positive, totals, out=np.full_like(positive, 1.0 / positive.shape[1]), where=totals > 0)
+        raise AttributeError("predict_proba non disponibile per un modello di regressione")
+
+
+def _parity_ok(scorer: LinearScorer, pipeline: Pipeline, probe: np.ndarray) -> bool:
+    if scorer.kind == "regression":
+        expected, actual = pipeline.predict(probe), scorer.predict(probe)
+    else:
+        expected, actual = pipeline.predict_proba(probe), scorer.predict_proba(probe)
+    return bool(np.allclose(expected, actual, rtol=0.0, atol=PARITY_TOLERANCE))
+
+
+def compile_pipeline(pipeline: Optional[Pipeline], probe: np.ndarray | None = None) -> Optional[LinearScorer]:
+    """
+    Compila una pipeline scaler + modello lineare in un `LinearScorer`.
+    Ritorna None se la pipeline ha un'altra forma o se il controllo di parità fallisce:
+    in quel caso il chiamante continua a usare la pipeline scikit-learn.
+    """
+    if pipeline is None or len(getattr(pipeline, "steps", ())) != 2:
+        return None
+
+    scaler, model = pipeline.steps[0][1], pipeline.steps[1][1]
+    if not isinstance(scaler, StandardScaler) or not isinstance(model, (Ridge, LogisticRegression, SGDClassifier)):
+        return None
+    if isinstance(model, SGDClassifier) and model.loss != "log_loss":
+        return None
+
+    try:
+        n_features = int(scaler.n_features_in_)
+        mean = scaler.mean_ if scaler.with_mean else np.zeros(n_features)
+        scale = scaler.scale_ if scaler.with_std else np.ones(n_features)
+        coef = np.atleast_2d(np.asarray(model.coef_, dtype=float)).T
+        weights = coef / scale[:, None]
+        bias = np.atleast_1d(np.asarray(model.intercept_, dtype=float)) - mean @ weights
+
+        if isinstance(model, Ridge):
+            if weights.shape[1] != 1:
+                return None
+            scorer = LinearScorer(weights, bias, kind="regression")
+        else:
+            if len(model.classes_) == 2:
+                kind = "binary"
+            else:
+                kind = "ovr" if isinstance(model, SGDClassifier) else "multinomial"
+            scorer = LinearScorer(weights, bias, kind=kind, classes=np.asarray(model.classes_))
+
+        if probe is None:
+            rng = np.random.default_rng(0)
+            probe = mean + scale * rng.normal(size=(PARITY_PROBE_ROWS, n_features))
+        if not _parity_ok(scorer, pipeline, probe):
+            print("[WARN]  Scorer compilato non allineato alla pipeline: uso scikit-learn")
+            return None
+        return scorer
+    except Exception as e:
+        print(f"[WARN]  Compilazione scorer fallita: {e}")
+        return None
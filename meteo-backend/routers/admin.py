@@ -20,7 +20,14 @@ def get_status():
         n_pred = db.query(MlPrediction).count()
         n_verif = db.query(MlPrediction).filter(MlPrediction.verified.is_(True)).count()
 
+        import cities_index
+        import city_locator
+        import city_search
+        import forecast_snapshots
+        import geo_grid
+        import http_pool
         import ml_model
+        import weather_service
         from scheduler import scheduler as sch
 
         return {
@@ -31,6 +38,14 @@ def get_status():
                 "ml_verified": n_verif,
             },
             "ml": ml_model.get_stats(),
+            "ml_stats_cache": ml_model.get_stats_cache_info(),
+            "http_pool": http_pool.get_pool_stats(),
+            "public_weather_cache": weather_service.get_public_cache_stats(),
+            "forecast_snapshots": forecast_snapshots.get_stats(),
+            "geo_grid": geo_grid.get_grid_stats(db),
+            "city_search": city_search.get_stats(),
+            "cities_index": cities_index.get_stats(),
+            "city_locator": city_locator.get_stats(),
             "scheduler": [
                 {
                     "id": job.id,
@@ -5,11 +5,14 @@ from __future__ import annotations
 
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from pydantic import BaseModel, ConfigDict
 from sqlalchemy import case, func
 from sqlalchemy.orm import Session
 
+import cities_index
+import city_locator
+import city_search
 from config import settings
 from database import City, get_db
 
@@ -28,6 +31,10 @@ class CityResult(BaseModel):
     locality_type: str | None = "comune"
 
 
+class NearestCityResult(CityResult):
+    distance_km: float
+
+
 class CityIndexItem(BaseModel):
     name: str
     region: str | None
@@ -39,42 +46,42 @@ class CityIndexItem(BaseModel):
 
 @router.get("/cities/index", response_model=List[CityIndexItem])
 def get_cities_index(
-    response: Response,
+    request: Request,
     scope: str = Query("comuni", pattern="^(comuni|localita|all)$"),
-    version: str = Query("v2"),
+    version: str | None = Query(None, description="Hash del contenuto: se coincide la risposta è immutabile"),
+    index_format: str = Query("json", alias="format", pattern="^(json|columnar|binary)$"),
     db: Session = Depends(get_db),
 ):
     """
     Restituisce un indice città compatto e cacheabile.
-    `scope=comuni` è il default per il frontend pubblico.
+    `scope=comuni` è il default per il frontend pubblico. Il corpo è precompresso
+    (vedi cities_index): `X-Cities-Index-Version` è l'hash del contenuto, l'ETag lo stesso
+    hash con il suffisso dell'encoding servito.
+    `format=columnar|binary` restituisce array paralleli con tabella stringhe e
+    coordinate a virgola fissa, più piccoli e veloci da leggere per i client mobili.
     """
-    query = db.query(
-        City.name,
-        City.region,
-        City.province,
-        City.lat,
-        City.lon,
-        City.locality_type,
-    )
-    if scope == "comuni":
-        query = query.filter(City.locality_type == "comune")
-    elif scope == "localita":
-        query = query.filter(City.locality_type == "localita")
-
-    rows = query.order_by(City.locality_type, City.name_lower).all()
-    response.headers["Cache-Control"] = f"public, max-age={settings.cities_index_cache_seconds}"
-    response.headers["X-Cities-Index-Version"] = version
-    return [
-        CityIndexItem(
-            name=row.name,
-            region=row.region,
-            province=row.province,
-            lat=row.lat,
-            lon=row.lon,
-            locality_type=row.locality_type,
-        )
-        for row in rows
-    ]
+    artifact = cities_index.get_artifact(scope, db, index_format)
+    # L'ETag dipende dall'encoding negoziato, anche per la 304
+    body, encoding = artifact.body_for(request.headers.get("accept-encoding", ""))
+    headers = {
+        "ETag": artifact.etag_for(encoding),
+        "X-Cities-Index-Version": artifact.version,
+        "X-Cities-Index-Format": index_format,
+        "Vary": "Accept-Encoding",
+    }
+    if version == artifact.version:
+        headers["Cache-Control"] = f"public, max-age={cities_index.IMMUTABLE_MAX_AGE_SECONDS}, immutable"
+    else:
+        headers["Cache-Control"] = f"public, max-age={settings.cities_index_cache_seconds}"
+
+    if cities_index.etag_matches(request.headers.get("if-none-match"), artifact.version):
+        cities_index.record_response(None, not_modified=True)
+        return Response(status_code=304, headers=headers)
+
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    cities_index.record_response(encoding)
+    return Response(content=body, media_type=cities_index.MEDIA_TYPES[index_format], headers=headers)
 
 
 @router.get("/cities", response_model=List[CityResult])
@@ -84,6 +91,11 @@ def search_cities(
     scope: str = Query("all", pattern="^(comuni|localita|all)$"),
     db: Session = Depends(get_db),
 ):
+    indexed = city_search.search(q, limit=limit, scope=scope)
+    if indexed is not None:
+        return indexed
+
+    # Indice in memoria non ancora pronto (caricamento città in corso): query SQL
     q_lower = q.strip().lower()
     type_priority = case((City.locality_type == "comune", 0), else_=1)
 
@@ -115,9 +127,30 @@ def search_cities(
         )
         results.extend(contains)
 
+    if len(results) < limit and city_search.pg_trgm_enabled(db):
+        results.extend(city_search.sql_fuzzy_search(
+            base_query,
+            q,
+            limit=limit - len(results),
+            exclude_ids=[city.id for city in results],
+        ))
+
     return results
 
 
+@router.get("/cities/nearest", response_model=List[NearestCityResult])
+def nearest_cities(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    limit: int = Query(1, ge=1, le=20),
+    max_km: float = Query(25.0, gt=0, le=200, description="Distanza massima in km"),
+    scope: str = Query("all", pattern="^(comuni|localita|all)$"),
+    db: Session = Depends(get_db),
+):
+    """Città più vicine a una coordinata (client con GPS), dalla più vicina."""
+    return city_locator.nearest(db, lat, lon, limit=limit, max_km=max_km, scope=scope)
+
+
 @router.get("/cities/{city_id}", response_model=CityResult)
 def get_city(city_id: int, db: Session = Depends(get_db)):
     city = db.query(City).filter(City.id == city_id).first()
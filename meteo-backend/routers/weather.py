@@ -5,13 +5,21 @@ from __future__ import annotations
 
 from datetime import datetime
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy import func
 from sqlalchemy.orm import Session
 
 from database import City, get_db
+import city_locator
+import forecast_snapshots
+import geo_grid
 import ml_model
-from weather_service import fetch_single_city, format_weather_for_frontend
+from weather_service import (
+    fetch_single_city,
+    format_weather_for_frontend,
+    get_public_freshness,
+    record_public_request,
+)
 
 router = APIRouter()
 
@@ -54,24 +62,53 @@ def _resolve_city(
     if city_lat is None or city_lon is None:
         raise HTTPException(status_code=400, detail="Fornisci 'city' oppure 'lat' e 'lon'")
 
+    distance_km = None
     if not city_row:
-        city_row = (
-            db.query(City)
-            .filter(City.lat == city_lat, City.lon == city_lon)
-            .order_by(City.locality_type)
-            .first()
-        )
+        # Coordinate (GPS o link): la città più vicina entro RESOLVE_MAX_DISTANCE_KM dà regione e contesto ML
+        match = city_locator.resolve(db, city_lat, city_lon)
+        if match is not None:
+            city_row = db.query(City).filter(City.id == match["id"]).first()
+            distance_km = match["distance_km"]
+            if city_row and not (name or city):
+                city_name = city_row.name
 
     return {
         "name": city_name,
         "lat": city_lat,
         "lon": city_lon,
         "city_row": city_row,
+        "distance_km": distance_km,
     }
 
 
+def _city_cell(city_row) -> str:
+    """Cella meteo salvata sulla città (geo_grid.refresh_city_cells), calcolata solo se manca."""
+    return getattr(city_row, "grid_cell", None) or geo_grid.cell_id(city_row.lat, city_row.lon)
+
+
+def _snapshot_city_id(db: Session, resolved: dict) -> int | None:
+    """
+    Comune il cui snapshot orario vale per la richiesta: quello risolto se è nella stessa cella
+    meteo del punto richiesto, altrimenti un comune della cella (indice su City.grid_cell), che
+    per costruzione della griglia riceve gli stessi dati di località e coordinate vicine.
+    """
+    city_row = resolved["city_row"]
+    request_cell = geo_grid.cell_id(resolved["lat"], resolved["lon"])
+    if city_row is not None and city_row.locality_type == "comune" and (
+        resolved["distance_km"] is None or _city_cell(city_row) == request_cell
+    ):
+        return city_row.id
+    comune = (
+        db.query(City.id)
+        .filter(City.grid_cell == request_cell, City.locality_type == "comune")
+        .first()
+    )
+    return comune.id if comune is not None else None
+
+
 @router.get("/weather")
 async def get_weather(
+    response: Response,
     city: str | None = Query(None, description="Nome città"),
     lat: float | None = Query(None),
     lon: float | None = Query(None),
@@ -80,53 +117,67 @@ async def get_weather(
     db: Session = Depends(get_db),
 ):
     resolved = _resolve_city(db=db, city=city, lat=lat, lon=lon, name=name)
+    city_row = resolved["city_row"]
 
-    raw = await fetch_single_city(resolved["lat"], resolved["lon"])
-    if not raw:
-        raise HTTPException(status_code=502, detail="Impossibile ottenere dati meteo da Open-Meteo")
+    # I comuni sono tutti nel batch orario: si risponde dallo snapshot (locale o condiviso) senza chiamate upstream
+    snapshot = None
+    snapshot_city_id = _snapshot_city_id(db, resolved)
+    if snapshot_city_id is not None:
+        snapshot = forecast_snapshots.lookup(snapshot_city_id)
+        if snapshot is None:
+            snapshot = await forecast_snapshots.lookup_shared(snapshot_city_id)
+
+    if snapshot is not None:
+        raw, age = snapshot
+        freshness = {**forecast_snapshots.freshness(age), "source": "snapshot"}
+    else:
+        # Solo il percorso live conta per il pre-riscaldamento: i comuni hanno già lo snapshot
+        record_public_request(resolved["lat"], resolved["lon"])
+        raw = await fetch_single_city(resolved["lat"], resolved["lon"])
+        if not raw:
+            raise HTTPException(status_code=502, detail="Impossibile ottenere dati meteo da Open-Meteo")
+        freshness = {**get_public_freshness(resolved["lat"], resolved["lon"]), "source": "live"}
+
+    response.headers["Cache-Control"] = (
+        f"public, max-age={max(0, freshness['max_age_seconds'] - freshness['age_seconds'])}, "
+        f"stale-while-revalidate={freshness['stale_while_revalidate_seconds']}"
+    )
+    response.headers["Age"] = str(freshness["age_seconds"])
 
     formatted = format_weather_for_frontend(raw, resolved["name"])
-    city_row = resolved["city_row"]
+    formatted["freshness"] = freshness
 
     if include_ml and formatted:
         now = datetime.now()
         region = city_row.region if city_row else "Sconosciuta"
         current = formatted["current"]
         stats = ml_model.get_stats()
-        correction = ml_model.predict_correction(
-            temp=current["temp"],
-            humidity=current.get("humidity", 50),
-            hour=now.hour,
-            month=now.month,
+        daily = formatted.get("daily", [])
+        insights = ml_model.build_forecast_insights(
+            current={
+                "forecast_temp": current["temp"],
+                "humidity": current.get("humidity", 50),
+                "hour": now.hour,
+                "month": now.month,
+                "lat": resolved["lat"],
+                "region": region,
+                "cloud_cover": current.get("clouds", 50),
+                "lead_hours": 0,
+            },
+            days=daily,
             lat=resolved["lat"],
             region=region,
-            cloud_cover=current.get("clouds", 50),
-            lead_hours=0,
-        )
-        rain = ml_model.predict_rain_probability(
-            forecast_temp=current["temp"],
-            humidity=current.get("humidity", 50),
-            hour=now.hour,
-            month=now.month,
-            lat=resolved["lat"],
-            region=region,
-            cloud_cover=current.get("clouds", 50),
-            lead_hours=0,
+            lead_hours=[max(0, (index * 24) + 14) for index in range(len(daily))],
         )
         formatted["ml"] = {
-            "correction": correction,
-            "rain_prediction": rain,
+            "correction": insights["correction"],
+            "rain_prediction": insights["rain_prediction"],
             "summary": ml_model.get_public_summary(),
             "stats": stats,
         }
 
-        for index, day in enumerate(formatted.get("daily", [])):
-            day["ml"] = ml_model.build_daily_insight(
-                day=day,
-                lat=resolved["lat"],
-                region=region,
-                lead_hours=max(0, (index * 24) + 14),
-            )
+        for day, insight in zip(daily, insights["daily"]):
+            day["ml"] = insight
 
     if city_row:
         formatted["city"] = {
@@ -4,21 +4,42 @@ scheduler.py — ciclo orario di raccolta osservazioni, verifica forecast e trai
 from __future__ import annotations
 
 import asyncio
+import sqlite3
 from datetime import datetime, timedelta, timezone
+from itertools import repeat
 
+import numpy as np
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.date import DateTrigger
 from apscheduler.triggers.interval import IntervalTrigger
-from sqlalchemy import text
+from sqlalchemy import (
+    Column, DateTime, Float, Index, Integer, MetaData, Table, and_, bindparam, func, insert, select, text,
+)
+from sqlalchemy.orm import Session
 
 from config import settings
 from database import City, MlModelStore, MlPrediction, SessionLocal, WeatherObservation
-from weather_service import fetch_all_cities_weather
+from weather_service import (
+    fetch_all_cities_weather,
+    get_breaker_states,
+    sweep_public_weather_cache,
+    sweep_shared_public_weather_cache,
+    warm_public_cache,
+)
+import error_stats
+import forecast_snapshots
 import ml_model
 
 MIN_VERIFIED_FOR_TRAINING = 500
-RETRAIN_EVERY_HOURS = 6
+# Training completo di sicurezza; nei cicli intermedi i modelli si aggiornano in modo incrementale
+RETRAIN_EVERY_HOURS = 24
+INCREMENTAL_TRAINING = True
 OBSERVATION_RETENTION_DAYS = 30
+PUBLIC_CACHE_SWEEP_SECONDS = 60
+PUBLIC_CACHE_WARMUP_SECONDS = 60
 PREDICTION_RETENTION_DAYS = 45
+# Attesa prima del recupero snapshot all'avvio, per lasciare al caricamento città il tempo di partire
+STARTUP_SNAPSHOT_DELAY_SECONDS = 30
 
 _last_training: datetime | None = None
 scheduler = AsyncIOScheduler(timezone="Europe/Rome")
@@ -32,7 +53,90 @@ def _db_get_cities() -> list[dict]:
         return [{"id": row.id, "name": row.name, "lat": row.lat, "lon": row.lon} for row in rows]
 
 
+def _nullable(values: np.ndarray, *, integer: bool = False) -> list:
+    """Colonna float in lista Python, con None al posto di NaN."""
+    missing = np.isnan(values)
+    converted = (np.where(missing, 0, values).astype(np.int64) if integer else values).astype(object)
+    converted[missing] = None
+    return converted.tolist()
+
+
+def _datetimes(epochs: np.ndarray) -> list[datetime]:
+    """Secondi epoch in datetime UTC, convertendo una volta sola ogni istante distinto."""
+    unique, inverse = np.unique(epochs, return_inverse=True)
+    converted = np.asarray([datetime.fromtimestamp(epoch, tz=timezone.utc) for epoch in unique.tolist()], dtype=object)
+    return converted[inverse].tolist()
+
+
+def _rows(columns: dict[str, list]) -> list[dict]:
+    keys = list(columns)
+    return [dict(zip(keys, row)) for row in zip(*columns.values())]
+
+
+def _observation_rows_from_columns(columns: dict) -> list[dict]:
+    if not len(columns["city_id"]):
+        return []
+    return _rows({
+        "city_id": columns["city_id"].tolist(),
+        "observed_at": _datetimes(columns["observed_at"]),
+        **{
+            key: _nullable(columns[key])
+            for key in ("temp", "humidity", "cloud_cover", "wind_speed", "wind_direction", "precipitation")
+        },
+    })
+
+
+def _prediction_rows_from_columns(columns: dict) -> list[dict]:
+    if not len(columns["city_id"]):
+        return []
+    forecast_temp = _nullable(columns["forecast_temp"])
+    precipitation = _nullable(columns["forecast_precipitation"])
+    weather_code = _nullable(columns["forecast_weather_code"], integer=True)
+    return _rows({
+        "city_id": columns["city_id"].tolist(),
+        "predicted_at": _datetimes(columns["predicted_at"]),
+        "target_time": _datetimes(columns["target_time"]),
+        "lead_hours": columns["lead_hours"].tolist(),
+        "forecast_source": repeat("open-meteo"),
+        "predicted_temp": forecast_temp,
+        "forecast_temp": forecast_temp,
+        "humidity": _nullable(columns["humidity"]),
+        "hour": ((columns["target_time"] // 3600) % 24).tolist(),
+        "verified": repeat(False),
+        "precipitation": precipitation,
+        "weather_code": weather_code,
+        "forecast_precipitation": precipitation,
+        "forecast_weather_code": weather_code,
+        **{
+            key: _nullable(columns[key])
+            for key in ("forecast_cloud_cover", "forecast_wind_speed", "forecast_wind_direction")
+        },
+    })
+
+
+def _db_save_cycle_data_columns(columns: dict) -> tuple[int, int]:
+    """Scrive osservazioni e previsioni dalla forma colonnare con INSERT executemany."""
+    obs_rows = _observation_rows_from_columns(columns["observations"])
+    pred_rows = _prediction_rows_from_columns(columns["predictions"])
+
+    with SessionLocal() as db:
+        if obs_rows:
+            db.execute(insert(WeatherObservation), obs_rows)
+        if pred_rows:
+            db.execute(insert(MlPrediction), pred_rows)
+            error_stats.record_predictions(
+                db, ((row["city_id"], row["predicted_at"], row["lead_hours"]) for row in pred_rows)
+            )
+        db.commit()
+
+    return len(obs_rows), len(pred_rows)
+
+
 def _db_save_cycle_data(payload: dict) -> tuple[int, int]:
+    columns = payload.get("columns")
+    if columns is not None:
+        return _db_save_cycle_data_columns(columns)
+
     observations = payload.get("observations", [])
     predictions = payload.get("predictions", [])
 
@@ -80,67 +184,175 @@ def _db_save_cycle_data(payload: dict) -> tuple[int, int]:
             db.bulk_save_objects(obs_objects)
         if pred_objects:
             db.bulk_save_objects(pred_objects)
+            error_stats.record_predictions(
+                db, ((pred.city_id, pred.predicted_at, pred.lead_hours) for pred in pred_objects)
+            )
         db.commit()
 
     return len(obs_objects), len(pred_objects)
 
 
-def _db_verify_predictions(observations: list[dict]) -> tuple[int, float]:
-    if not observations:
-        return 0, 0.0
+_VERIFY_ROW_SQL = text("""
+    UPDATE ml_predictions
+    SET actual_temp = :actual_temp,
+        actual_precipitation = :actual_precipitation,
+        actual_weather_code = :actual_weather_code,
+        actual_cloud_cover = :actual_cloud_cover,
+        actual_wind_speed = :actual_wind_speed,
+        actual_wind_direction = :actual_wind_direction,
+        error = :actual_temp - COALESCE(forecast_temp, predicted_temp),
+        verified = :v_true,
+        verified_at = :verified_at
+    WHERE city_id = :city_id
+      AND verified = :v_false
+      AND target_time = :target_time
+""").bindparams(
+    # Tipizzati per usare lo stesso formato di storage delle colonne DateTime (necessario su SQLite).
+    bindparam("verified_at", type_=DateTime(timezone=True)),
+    bindparam("target_time", type_=DateTime(timezone=True)),
+)
+
+# Tabella temporanea di staging per la verifica set-based del ciclo.
+_verification_staging = Table(
+    "cycle_verification_staging",
+    MetaData(),
+    Column("city_id", Integer, nullable=False),
+    Column("target_time", DateTime(timezone=True), nullable=False),
+    Column("actual_temp", Float, nullable=False),
+    Column("actual_precipitation", Float),
+    Column("actual_weather_code", Integer),
+    Column("actual_cloud_cover", Float),
+    Column("actual_wind_speed", Float),
+    Column("actual_wind_direction", Float),
+    Column("verified_at", DateTime(timezone=True), nullable=False),
+    Index("idx_cycle_verification_staging", "city_id", "target_time"),
+    prefixes=["TEMPORARY"],
+)
+
+_VERIFY_BULK_SQL = text("""
+    UPDATE ml_predictions AS p
+    SET actual_temp = s.actual_temp,
+        actual_precipitation = s.actual_precipitation,
+        actual_weather_code = s.actual_weather_code,
+        actual_cloud_cover = s.actual_cloud_cover,
+        actual_wind_speed = s.actual_wind_speed,
+        actual_wind_direction = s.actual_wind_direction,
+        error = s.actual_temp - COALESCE(p.forecast_temp, p.predicted_temp),
+        verified = :v_true,
+        verified_at = s.verified_at
+    FROM cycle_verification_staging AS s
+    WHERE p.city_id = s.city_id
+      AND p.target_time = s.target_time
+      AND p.verified = :v_false
+""")
+
+
+def _verification_params(obs: dict) -> dict:
+    return {
+        "city_id": obs["city_id"],
+        "target_time": obs["observed_at"].replace(minute=0, second=0, microsecond=0),
+        "actual_temp": obs["temp"],
+        "actual_precipitation": obs.get("precipitation"),
+        "actual_weather_code": obs.get("weather_code"),
+        "actual_cloud_cover": obs.get("cloud_cover"),
+        "actual_wind_speed": obs.get("wind_speed"),
+        "actual_wind_direction": obs.get("wind_direction"),
+        "verified_at": obs["observed_at"],
+    }
+
+
+def _verification_params_from_columns(columns: dict) -> list[dict]:
+    """Parametri di verifica costruiti in blocco dalle colonne delle osservazioni."""
+    if not len(columns["city_id"]):
+        return []
+    observed_at = columns["observed_at"]
+    return _rows({
+        "city_id": columns["city_id"].tolist(),
+        "target_time": _datetimes(observed_at // 3600 * 3600),
+        "actual_temp": columns["temp"].tolist(),
+        "actual_precipitation": _nullable(columns["precipitation"]),
+        "actual_weather_code": _nullable(columns["weather_code"], integer=True),
+        "actual_cloud_cover": _nullable(columns["cloud_cover"]),
+        "actual_wind_speed": _nullable(columns["wind_speed"]),
+        "actual_wind_direction": _nullable(columns["wind_direction"]),
+        "verified_at": _datetimes(observed_at),
+    })
+
+
+def _supports_update_from(db: Session) -> bool:
+    bind = db.get_bind()
+    if bind.dialect.name == "postgresql":
+        return True
+    if bind.dialect.name == "sqlite":
+        return sqlite3.sqlite_version_info >= (3, 33, 0)
+    return False
+
+
+def _pending_errors(connection) -> list[tuple]:
+    """Righe (city_id, predicted_at, lead_hours, error) che la verifica sta per chiudere."""
+    staging = _verification_staging.c
+    error = staging.actual_temp - func.coalesce(MlPrediction.forecast_temp, MlPrediction.predicted_temp)
+    query = (
+        select(MlPrediction.city_id, MlPrediction.predicted_at, MlPrediction.lead_hours, error)
+        .join(
+            _verification_staging,
+            and_(MlPrediction.city_id == staging.city_id, MlPrediction.target_time == staging.target_time),
+        )
+        .where(MlPrediction.verified.is_(False))
+    )
+    return [tuple(row) for row in connection.execute(query)]
+
 
+def _verify_rows(db: Session, params: list[dict]) -> int:
     verified_count = 0
+    for row in params:
+        result = db.execute(_VERIFY_ROW_SQL, {**row, "v_true": True, "v_false": False})
+        verified_count += result.rowcount
+    return verified_count
+
+
+def _verify_bulk(db: Session) -> int:
+    """Verifica tutte le previsioni che combaciano con lo staging con un solo UPDATE ... FROM."""
+    result = db.connection().execute(_VERIFY_BULK_SQL, {"v_true": True, "v_false": False})
+    return result.rowcount
+
+
+def _db_verify_predictions(observations: list[dict], *, bulk: bool = True) -> tuple[int, float]:
+    params = [_verification_params(obs) for obs in observations if obs.get("temp") is not None]
+    return _db_verify_params(params, bulk=bulk)
+
+
+def _db_verify_observation_columns(columns: dict, *, bulk: bool = True) -> tuple[int, float]:
+    return _db_verify_params(_verification_params_from_columns(columns), bulk=bulk)
+
+
+def _db_verify_params(params: list[dict], *, bulk: bool = True) -> tuple[int, float]:
+    if not params:
+        return 0, 0.0
+
     with SessionLocal() as db:
-        for obs in observations:
-            observed_at = obs["observed_at"].replace(minute=0, second=0, microsecond=0)
-            result = db.execute(
-                text("""
-                    UPDATE ml_predictions
-                    SET actual_temp = :actual_temp,
-                        actual_precipitation = :actual_precipitation,
-                        actual_weather_code = :actual_weather_code,
-                        actual_cloud_cover = :actual_cloud_cover,
-                        actual_wind_speed = :actual_wind_speed,
-                        actual_wind_direction = :actual_wind_direction,
-                        error = :actual_temp - COALESCE(forecast_temp, predicted_temp),
-                        verified = :v_true,
-                        verified_at = :verified_at
-                    WHERE city_id = :city_id
-                      AND verified = :v_false
-                      AND target_time = :target_time
-                """),
-                {
-                    "actual_temp": obs["temp"],
-                    "actual_precipitation": obs.get("precipitation"),
-                    "actual_weather_code": obs.get("weather_code"),
-                    "actual_cloud_cover": obs.get("cloud_cover"),
-                    "actual_wind_speed": obs.get("wind_speed"),
-                    "actual_wind_direction": obs.get("wind_direction"),
-                    "verified_at": obs["observed_at"],
-                    "city_id": obs["city_id"],
-                    "target_time": observed_at,
-                    "v_true": True,
-                    "v_false": False,
-                },
-            )
-            verified_count += result.rowcount
+        connection = db.connection()
+        _verification_staging.drop(connection, checkfirst=True)
+        _verification_staging.create(connection)
+        connection.execute(_verification_staging.insert(), params)
+        pending = _pending_errors(connection)
+
+        if bulk and _supports_update_from(db):
+            verified_count = _verify_bulk(db)
+        else:
+            verified_count = _verify_rows(db, params)
 
+        _verification_staging.drop(connection)
+        error_stats.record_verifications(db, pending)
         db.commit()
-        avg_error = db.execute(
-            text("""
-                SELECT AVG(ABS(error))
-                FROM ml_predictions
-                WHERE verified = true
-                  AND error IS NOT NULL
-            """)
-        ).scalar()
+        avg_error = error_stats.read_summary(db)["avg_error_celsius"]
 
     return verified_count, float(avg_error or 0.0)
 
 
 def _db_count_verified() -> int:
     with SessionLocal() as db:
-        return db.query(MlPrediction).filter(MlPrediction.verified.is_(True)).count()
+        return error_stats.read_summary(db)["verified_predictions"]
 
 
 def _db_cleanup(now: datetime) -> dict:
@@ -154,6 +366,7 @@ def _db_cleanup(now: datetime) -> dict:
         deleted_pred = db.query(MlPrediction).filter(
             MlPrediction.predicted_at < pred_cutoff
         ).delete()
+        error_stats.prune(db, pred_cutoff)
 
         model_ids = [
             row.id
@@ -189,26 +402,54 @@ async def hourly_cycle():
         print("[WARN] Nessuna città nel DB")
         return
 
+    breaker = get_breaker_states()["open-meteo"]
+    if breaker["state"] == "open":
+        print(
+            f"[PAUSE] Circuit breaker Open-Meteo aperto: batch orario saltato "
+            f"(nuova prova tra {breaker['retry_in_seconds']:.0f}s)"
+        )
+        return
+
     payload = await fetch_all_cities_weather(cities)
-    observations = payload.get("observations", [])
-    predictions = payload.get("predictions", [])
-    if not observations:
+    fetch_stats = payload.get("stats") or {}
+    if fetch_stats.get("completion_ratio", 1.0) < 1.0:
+        print(
+            f"[WARN] Copertura parziale: {fetch_stats['completed_batches']}/{fetch_stats['batches']} batch "
+            f"({fetch_stats['failed_batches']} scartati, {fetch_stats['paused_batches']} sospesi dal circuit breaker)"
+        )
+    observation_columns = payload["columns"]["observations"]
+    if not len(observation_columns["city_id"]):
         print("[WARN] Nessuna osservazione scaricata")
         return
 
     n_obs, n_pred = await asyncio.to_thread(_db_save_cycle_data, payload)
     print(f"[SAVE] Salvate {n_obs} osservazioni e {n_pred} previsioni future")
 
-    verified_count, avg_error = await asyncio.to_thread(_db_verify_predictions, observations)
+    verified_count, avg_error = await asyncio.to_thread(_db_verify_observation_columns, observation_columns)
     print(f"[OK] Verificate {verified_count} predictions (errore medio: {avg_error:.2f}°C)")
 
     now = datetime.now(timezone.utc)
     total_verified = await asyncio.to_thread(_db_count_verified)
+    last_full = _last_training or ml_model.last_full_training()
     should_retrain = (
         total_verified >= MIN_VERIFIED_FOR_TRAINING
-        and (_last_training is None or (now - _last_training).total_seconds() >= RETRAIN_EVERY_HOURS * 3600)
+        and (last_full is None or (now - last_full).total_seconds() >= RETRAIN_EVERY_HOURS * 3600)
     )
 
+    if not should_retrain and INCREMENTAL_TRAINING:
+        result = await asyncio.to_thread(ml_model.train_incremental)
+        if result["success"]:
+            print(
+                f"[DONE] Aggiornamento incrementale su {result['n_new']} nuove righe — "
+                f"MAE {result['mae']:.3f} (baseline {result['baseline_mae']:.3f}), "
+                f"{result['n_samples']} campioni accumulati"
+            )
+        elif result.get("needs_full_refit"):
+            print(f"[WARN] {result['message']}: avvio training completo")
+            should_retrain = total_verified >= MIN_VERIFIED_FOR_TRAINING
+        elif not result.get("skipped"):
+            print(f"[WARN] Aggiornamento incrementale non riuscito: {result.get('message')}")
+
     if should_retrain:
         print(f"[TRAIN] Avvio training su {total_verified} campioni verificati")
         result = await asyncio.to_thread(ml_model.train, 100)
@@ -242,9 +483,56 @@ async def hourly_cycle():
             f"pred={cleanup['deleted_predictions']} models={cleanup['deleted_models']}"
         )
 
+    await asyncio.to_thread(ml_model.refresh_stats)
+
     print("[OK] Ciclo completato — prossimo tra 1 ora\n")
 
 
+async def refresh_snapshots_at_startup() -> int:
+    """
+    Il ciclo orario parte un'ora dopo l'avvio: se né la memoria né il livello condiviso hanno
+    snapshot recenti si scaricano subito i batch dei comuni, solo per gli snapshot. Osservazioni e
+    previsioni non vengono salvate: il ciclo precedente le ha già scritte per quest'ora.
+    """
+    if await asyncio.to_thread(forecast_snapshots.has_recent_cycle):
+        print("[SNAPSHOT] Snapshot recenti già disponibili: nessun recupero all'avvio")
+        return 0
+    if get_breaker_states()["open-meteo"]["state"] == "open":
+        print("[PAUSE] Circuit breaker Open-Meteo aperto: recupero snapshot all'avvio saltato")
+        return 0
+    cities = await asyncio.to_thread(_db_get_cities)
+    if not cities:
+        print("[WARN] Nessuna città nel DB: snapshot rimandati al ciclo orario")
+        return 0
+
+    payload = await fetch_all_cities_weather(cities)
+    stored = forecast_snapshots.get_stats()["cities"]
+    print(
+        f"[SNAPSHOT] Snapshot all'avvio pronti per {stored} comuni "
+        f"({payload['stats']['completed_batches']}/{payload['stats']['batches']} batch)"
+    )
+    return stored
+
+
+async def _sweep_public_cache():
+    # Coroutine: gira nel loop dell'app, lo stesso che legge e scrive la cache
+    removed = sweep_public_weather_cache()
+    if removed:
+        print(f"[CACHE] Rimosse {removed} previsioni pubbliche scadute")
+    removed_shared = await sweep_shared_public_weather_cache()
+    if removed_shared:
+        print(f"[CACHE] Rimosse {removed_shared} previsioni scadute dalla cache condivisa")
+
+
+async def _warm_public_cache():
+    result = await warm_public_cache()
+    if result["due"]:
+        print(
+            f"[CACHE] Pre-riscaldate {result['refreshed']}/{result['due']} città più richieste "
+            f"in {result['batches']} batch"
+        )
+
+
 def start_scheduler():
     scheduler.add_job(
         hourly_cycle,
@@ -254,6 +542,30 @@ def start_scheduler():
         replace_existing=True,
         max_instances=1,
     )
+    scheduler.add_job(
+        _sweep_public_cache,
+        trigger=IntervalTrigger(seconds=PUBLIC_CACHE_SWEEP_SECONDS),
+        id="public_cache_sweep",
+        name="Pulizia cache meteo pubblica",
+        replace_existing=True,
+        max_instances=1,
+    )
+    scheduler.add_job(
+        _warm_public_cache,
+        trigger=IntervalTrigger(seconds=PUBLIC_CACHE_WARMUP_SECONDS),
+        id="public_cache_warmup",
+        name="Pre-riscaldamento cache meteo per le città più richieste",
+        replace_existing=True,
+        max_instances=1,
+    )
+    scheduler.add_job(
+        refresh_snapshots_at_startup,
+        trigger=DateTrigger(run_date=datetime.now(timezone.utc) + timedelta(seconds=STARTUP_SNAPSHOT_DELAY_SECONDS)),
+        id="startup_snapshots",
+        name="Snapshot previsioni pubbliche all'avvio",
+        replace_existing=True,
+        max_instances=1,
+    )
     scheduler.start()
     print("[SCHED] Scheduler avviato — ciclo ogni ora attivo")
 
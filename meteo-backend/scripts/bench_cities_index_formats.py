@@ -0,0 +1,81 @@
+"""
+Benchmark formati di /api/cities/index: dimensione e tempo di lettura.
+
+Uso: python scripts/bench_cities_index_formats.py [n_citta] [ripetizioni]
+Genera un indice sintetico con la stessa composizione di quello reale (~8k
+comuni con provincia, località GeoNames senza provincia, 20 regioni) e per i
+formati json, columnar e binary misura i byte senza compressione, gzip e
+brotli (se installato) e il tempo di lettura: parse del corpo fino agli array
+(per json la lista di oggetti) e ricostruzione delle righe come oggetti.
+"""
+from __future__ import annotations
+
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import cities_index  # noqa: E402
+from cities_loader import ADMIN1_TO_REGION  # noqa: E402
+
+SYLLABLES = ("ro", "ma", "mi", "la", "no", "ve", "ne", "zia", "to", "ri", "co", "gio", "bel", "fer", "sa", "lu", "ca")
+PREFIXES = ("", "", "", "San ", "Santa ", "Monte", "Castel", "Borgo ", "Villa ")
+
+
+def _items(n_cities: int) -> list[dict]:
+    rng = random.Random(0)
+    regions = list(ADMIN1_TO_REGION.values())
+    provinces = [chr(65 + i // 26) + chr(65 + i % 26) for i in range(107)]
+    items = []
+    for city_id in range(n_cities):
+        comune = city_id % 7 == 0
+        name = rng.choice(PREFIXES) + "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+        items.append({
+            "name": name,
+            "region": rng.choice(regions),
+            "province": rng.choice(provinces) if comune else None,
+            "lat": round(rng.uniform(36.6, 47.1), rng.randint(4, 7)),
+            "lon": round(rng.uniform(6.6, 18.5), rng.randint(4, 7)),
+            "locality_type": "comune" if comune else "localita",
+        })
+    return sorted(items, key=lambda item: (item["locality_type"], item["name"].lower()))
+
+
+def _time(fn, repeats: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - started) / repeats * 1e3
+
+
+def main() -> int:
+    n_cities = int(sys.argv[1]) if len(sys.argv) > 1 else 58_000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    items = _items(n_cities)
+
+    readers = {
+        "json": (json.loads, json.loads),
+        "columnar": (json.loads, lambda body: cities_index.decode_columnar(json.loads(body))),
+        "binary": (cities_index.binary_to_columnar, cities_index.decode_binary),
+    }
+    baseline = None
+    for fmt in cities_index.FORMATS:
+        artifact = cities_index.build_artifact(items, fmt)
+        parse, decode = readers[fmt]
+        parse_ms = _time(lambda: parse(artifact.identity), repeats)
+        decode_ms = _time(lambda: decode(artifact.identity), repeats)
+        baseline = baseline or artifact
+        brotli = f"{len(artifact.brotli) / 1024:7.0f}KB" if artifact.brotli is not None else "    n/d"
+        print(
+            f"[{fmt:>8}] raw={len(artifact.identity) / 1024:6.0f}KB gzip={len(artifact.gzip) / 1024:5.0f}KB "
+            f"({len(artifact.gzip) / len(baseline.gzip):4.0%}) br={brotli} "
+            f"parse={parse_ms:6.1f}ms righe={decode_ms:6.1f}ms"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
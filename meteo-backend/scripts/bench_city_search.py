@@ -0,0 +1,93 @@
+"""
+Benchmark ricerca città: query SQL LIKE vs indice in memoria di city_search.
+
+Uso: python scripts/bench_city_search.py [n_citta] [ripetizioni]
+Crea un SQLite temporaneo con nomi sintetici (stessa distribuzione di prefissi
+comuni come "San", "Monte", "Castel") e misura /api/cities per query tipiche
+di autocompletamento, dalla prima lettera alla sottostringa senza prefisso,
+fino ai refusi che solo la ricerca fuzzy dell'indice trova.
+"""
+from __future__ import annotations
+
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+import city_search  # noqa: E402
+from database import Base, City  # noqa: E402
+from routers.cities import search_cities  # noqa: E402
+
+PREFIXES = ("", "", "", "San ", "Santa ", "Monte", "Castel", "Borgo ", "Villa ", "Porto ")
+SYLLABLES = ("ro", "ma", "mi", "la", "no", "ve", "ne", "zia", "to", "ri", "co", "gio", "bel", "fer", "sa", "lu", "ca")
+QUERIES = ("r", "ro", "rom", "san", "santa ma", "castel", "ezia", "zzz", "santa mra", "castl lunoro", "monteroma fer")
+
+
+def _seed(session_factory, n_cities: int):
+    rng = random.Random(0)
+    rows = []
+    for city_id in range(1, n_cities + 1):
+        name = rng.choice(PREFIXES) + "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+        comune = city_id % 7 == 0
+        rows.append({
+            "id": city_id,
+            "name": name,
+            "name_lower": name.lower(),
+            "region": "Lazio",
+            "lat": 42.0,
+            "lon": 12.0,
+            "population": rng.randint(500, 500_000) if comune else None,
+            "locality_type": "comune" if comune else "localita",
+        })
+    with session_factory() as db:
+        db.execute(insert(City), rows)
+        db.commit()
+
+
+def _time(fn, repeats: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - started) / repeats * 1e3
+
+
+def main() -> int:
+    n_cities = int(sys.argv[1]) if len(sys.argv) > 1 else 58_000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'bench.db'}")
+        Base.metadata.create_all(engine)
+        session_factory = sessionmaker(bind=engine)
+        _seed(session_factory, n_cities)
+        city_search.SessionLocal = session_factory
+
+        started = time.perf_counter()
+        city_search.rebuild()
+        print(f"costruzione indice: {(time.perf_counter() - started) * 1e3:.0f} ms per {n_cities} città")
+
+        with session_factory() as db:
+            for q in QUERIES:
+                index = city_search._index
+                city_search.clear()
+                sql_ms = _time(lambda: search_cities(q=q, limit=8, scope="all", db=db), repeats)
+                sql_names = [city.name for city in search_cities(q=q, limit=8, scope="all", db=db)]
+                city_search._index = index
+                index_ms = _time(lambda: search_cities(q=q, limit=8, scope="all", db=db), repeats)
+                found = len(search_cities(q=q, limit=8, scope="all", db=db))
+                print(
+                    f"[{q!r:>10}] sql={sql_ms:7.3f}ms indice={index_ms:6.3f}ms "
+                    f"speedup={sql_ms / index_ms:6.1f}x risultati={found}/{len(sql_names)}"
+                )
+        engine.dispose()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
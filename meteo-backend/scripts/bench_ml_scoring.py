@@ -0,0 +1,66 @@
+"""
+Benchmark inferenza ML: pipeline scikit-learn vs scorer NumPy compilati.
+
+Uso: python scripts/bench_ml_scoring.py [ripetizioni]
+Addestra pipeline sintetiche con la stessa forma di quelle in produzione e
+misura predict/predict_proba su 1 riga (condizioni attuali) e 17 righe
+(16 giorni di insight + riga corrente).
+"""
+from __future__ import annotations
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np  # noqa: E402
+from sklearn.linear_model import LogisticRegression, Ridge  # noqa: E402
+from sklearn.pipeline import Pipeline  # noqa: E402
+from sklearn.preprocessing import StandardScaler  # noqa: E402
+
+from ml_scoring import compile_pipeline  # noqa: E402
+
+
+def _fit_models(rng: np.random.Generator) -> dict[str, Pipeline]:
+    X = rng.normal(size=(2000, 8)) * 5 + 10
+    X_cond = rng.normal(size=(2000, 13))
+    return {
+        "temperatura": Pipeline([("scaler", StandardScaler()), ("ridge", Ridge())]).fit(X, X @ rng.normal(size=8)),
+        "pioggia": Pipeline([("scaler", StandardScaler()), ("lr", LogisticRegression(max_iter=500))]).fit(
+            X, (X[:, 2] > 10).astype(int)
+        ),
+        "condizione": Pipeline([("scaler", StandardScaler()), ("lr", LogisticRegression(max_iter=500))]).fit(
+            X_cond, np.digitize(X_cond[:, 0], [-1.0, 0.0, 1.0])
+        ),
+    }
+
+
+def _time(fn, X: np.ndarray, repeats: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn(X)
+    return (time.perf_counter() - started) / repeats * 1e6
+
+
+def main() -> int:
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rng = np.random.default_rng(0)
+
+    for name, pipeline in _fit_models(rng).items():
+        scorer = compile_pipeline(pipeline)
+        width = pipeline.n_features_in_
+        method = "predict" if name == "temperatura" else "predict_proba"
+        for rows in (1, 17):
+            X = rng.normal(size=(rows, width))
+            sklearn_us = _time(getattr(pipeline, method), X, repeats)
+            scorer_us = _time(getattr(scorer, method), X, repeats)
+            print(
+                f"[{name}] righe={rows:>2} sklearn={sklearn_us:8.1f}us "
+                f"scorer={scorer_us:6.1f}us speedup={sklearn_us / scorer_us:5.1f}x"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
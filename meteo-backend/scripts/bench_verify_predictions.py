@@ -0,0 +1,83 @@
+"""
+Benchmark verifica previsioni: UPDATE per riga vs UPDATE ... FROM su staging.
+
+Uso: python scripts/bench_verify_predictions.py [n_citta] [database_url]
+Senza database_url usa un SQLite temporaneo. Con un URL PostgreSQL crea le
+tabelle se mancano e inserisce dati sintetici: usare solo un DB di prova.
+"""
+from __future__ import annotations
+
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from sqlalchemy import create_engine, delete, insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+import scheduler  # noqa: E402
+from database import Base, City, MlPrediction  # noqa: E402
+
+LEADS = (1, 2, 3, 4, 5, 6)
+
+
+def _seed(session_factory, n_cities: int, anchor: datetime) -> list[dict]:
+    with session_factory() as db:
+        db.execute(delete(MlPrediction))
+        db.execute(delete(City))
+        db.execute(insert(City), [
+            {"id": city_id, "name": f"C{city_id}", "name_lower": f"c{city_id}", "lat": 42.0, "lon": 12.0}
+            for city_id in range(1, n_cities + 1)
+        ])
+        db.execute(insert(MlPrediction), [
+            {
+                "city_id": city_id,
+                "predicted_at": anchor - timedelta(hours=lead),
+                "target_time": anchor,
+                "lead_hours": lead,
+                "predicted_temp": 15.0,
+                "forecast_temp": 15.0,
+                "verified": False,
+            }
+            for city_id in range(1, n_cities + 1)
+            for lead in LEADS
+        ])
+        db.commit()
+
+    return [
+        {"city_id": city_id, "observed_at": anchor + timedelta(minutes=3), "temp": 16.0, "precipitation": 0.0}
+        for city_id in range(1, n_cities + 1)
+    ]
+
+
+def main() -> int:
+    n_cities = int(sys.argv[1]) if len(sys.argv) > 1 else 7900
+    if len(sys.argv) > 2:
+        database_url = sys.argv[2]
+    else:
+        database_url = f"sqlite:///{Path(tempfile.mkdtemp()) / 'bench_verify.db'}"
+
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+    scheduler.SessionLocal = session_factory
+    anchor = datetime(2026, 4, 4, 10, 0, tzinfo=timezone.utc)
+
+    print(f"[bench] {engine.dialect.name}, {n_cities} osservazioni, {n_cities * len(LEADS)} previsioni")
+    timings = {}
+    for label, bulk in (("per-riga", False), ("bulk", True)):
+        observations = _seed(session_factory, n_cities, anchor)
+        started = time.perf_counter()
+        verified_count, avg_error = scheduler._db_verify_predictions(observations, bulk=bulk)
+        timings[label] = time.perf_counter() - started
+        print(f"[{label}] verificate={verified_count} mae={avg_error:.3f} tempo={timings[label]:.3f}s")
+
+    print(f"[bench] speedup bulk: {timings['per-riga'] / timings['bulk']:.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
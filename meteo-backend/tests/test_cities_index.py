@@ -1,4 +1,6 @@
 """Test per gli endpoint città."""
+import gzip
+import json
 from types import SimpleNamespace
 
 from fastapi.testclient import TestClient
@@ -8,6 +10,7 @@ import os
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+import cities_index
 from main import app
 from database import get_db
 
@@ -69,20 +72,115 @@ def override_db(rows):
 
 
 def test_cities_index_returns_cacheable_payload():
+    cities_index.clear()
     fake_rows = [make_fake_city(), make_fake_city(city_id=2, name="Milano", region="Lombardia", province="MI")]
     app.dependency_overrides[get_db] = override_db(fake_rows)
     try:
-        response = client.get("/api/cities/index?scope=comuni&version=v2")
+        response = client.get("/api/cities/index?scope=comuni")
     finally:
         app.dependency_overrides.pop(get_db, None)
 
     assert response.status_code == 200
     assert response.headers["Cache-Control"].startswith("public")
-    assert response.headers["X-Cities-Index-Version"] == "v2"
+    suffix = cities_index.ETAG_SUFFIXES[response.headers.get("Content-Encoding")]
+    assert response.headers["ETag"] == f'"{response.headers["X-Cities-Index-Version"]}{suffix}"'
     item = response.json()[0]
     assert set(item.keys()) == {"name", "region", "province", "lat", "lon", "locality_type"}
 
 
+def test_cities_index_is_prebuilt_and_served_with_etag_and_304():
+    cities_index.clear()
+    fake_rows = [make_fake_city(), make_fake_city(city_id=2, name="Milano", region="Lombardia", province="MI")]
+    app.dependency_overrides[get_db] = override_db(fake_rows)
+    try:
+        first = client.get("/api/cities/index?scope=comuni", headers={"Accept-Encoding": "gzip"})
+        version = first.headers["X-Cities-Index-Version"]
+        # Dopo la prima costruzione il database non viene più interrogato
+        app.dependency_overrides[get_db] = override_db([])
+        cached = client.get(f"/api/cities/index?scope=comuni&version={version}")
+        revalidated = client.get(
+            "/api/cities/index?scope=comuni",
+            headers={"If-None-Match": first.headers["ETag"], "Accept-Encoding": "gzip"},
+        )
+        identity = client.get("/api/cities/index?scope=comuni", headers={"Accept-Encoding": "identity"})
+        # Una cache con la variante gzip che rivalida senza gzip riceve la 304 con l'ETag identity
+        revalidated_identity = client.get(
+            "/api/cities/index?scope=comuni",
+            headers={"If-None-Match": first.headers["ETag"], "Accept-Encoding": "identity"},
+        )
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+    assert first.status_code == 200
+    assert first.headers["Content-Encoding"] == "gzip"
+    assert [item["name"] for item in first.json()] == ["Roma", "Milano"]
+    assert cached.json() == first.json()
+    assert cached.headers["Cache-Control"].endswith("immutable")
+    assert "immutable" not in first.headers["Cache-Control"]
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["ETag"] == first.headers["ETag"]
+    assert "Content-Encoding" not in identity.headers
+    assert identity.json() == first.json()
+    assert first.headers["ETag"] == f'"{version}-gz"'
+    assert identity.headers["ETag"] == f'"{version}"'
+    assert revalidated_identity.status_code == 304
+    assert revalidated_identity.headers["ETag"] == identity.headers["ETag"]
+
+
+def test_artifact_encoding_negotiation_and_content_hash():
+    items = [{"name": "Roma", "region": "Lazio", "province": "RM", "lat": 41.9, "lon": 12.5, "locality_type": "comune"}]
+    artifact = cities_index.build_artifact(items)
+
+    assert cities_index.build_artifact(items) == artifact
+    assert cities_index.build_artifact(items[:0]).version != artifact.version
+    assert gzip.decompress(artifact.gzip) == artifact.identity
+    assert artifact.body_for("gzip;q=0, deflate") == (artifact.identity, None)
+    assert artifact.body_for("br;q=1.0, gzip;q=0.5")[1] == ("br" if artifact.brotli is not None else "gzip")
+    assert artifact.etag_for("gzip") == f'"{artifact.version}-gz"' != artifact.etag_for(None)
+    assert cities_index.etag_matches('W/"x", ' + artifact.etag_for(None), artifact.version)
+    assert cities_index.etag_matches(artifact.etag_for("br"), artifact.version)
+    assert not cities_index.etag_matches('"x"', artifact.version)
+    assert not cities_index.etag_matches(f'"{artifact.version}-zz"', artifact.version)
+
+
+def test_columnar_and_binary_formats_round_trip():
+    items = [
+        {"name": "Forlì", "region": "Emilia-Romagna", "province": "FC", "lat": 44.22254, "lon": 12.04068,
+         "locality_type": "comune"},
+        {"name": "Aosta", "region": "Valle d'Aosta", "province": None, "lat": 45.73750, "lon": 7.32014,
+         "locality_type": "comune"},
+        {"name": "Lampedusa", "region": "Sicilia", "province": "AG", "lat": 35.50789, "lon": 12.60123,
+         "locality_type": "localita"},
+    ]
+
+    columnar = json.loads(cities_index.build_artifact(items, "columnar").identity)
+    binary = cities_index.build_artifact(items, "binary").identity
+
+    assert columnar["strings"] == ["Emilia-Romagna", "Valle d'Aosta", "Sicilia", "FC", "AG", "comune", "localita"]
+    assert columnar["province"] == [3, -1, 4]
+    assert columnar["lat"] == [4422254, 151496, -1022961]
+    assert len(binary) % 4 == 0
+    for decoded in (cities_index.decode_columnar(columnar), cities_index.decode_binary(binary)):
+        assert [{**item, "lat": round(item["lat"], 5), "lon": round(item["lon"], 5)} for item in decoded] == items
+
+
+def test_cities_index_serves_binary_format():
+    cities_index.clear()
+    app.dependency_overrides[get_db] = override_db([make_fake_city(), make_fake_city(city_id=2, name="Milano")])
+    try:
+        response = client.get("/api/cities/index?scope=comuni&format=binary")
+        json_response = client.get("/api/cities/index?scope=comuni")
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/octet-stream"
+    assert response.headers["X-Cities-Index-Format"] == "binary"
+    assert response.headers["ETag"] != json_response.headers["ETag"]
+    assert [item["name"] for item in cities_index.decode_binary(response.content)] == ["Roma", "Milano"]
+
+
 def test_cities_search_returns_list():
     fake_rows = [make_fake_city(name="Roma"), make_fake_city(city_id=2, name="Rovigo", region="Veneto", province="RO")]
     app.dependency_overrides[get_db] = override_db(fake_rows)
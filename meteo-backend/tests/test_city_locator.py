@@ -0,0 +1,202 @@
+"""Test ricerca della città più vicina a una coordinata."""
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import importlib
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import city_locator
+import geo_grid
+from database import Base, City, get_db
+from main import app
+
+
+client = TestClient(app)
+weather_module = importlib.import_module("routers.weather")
+
+
+def make_row(city_id, name, lat, lon, *, locality_type="comune", region="Lazio"):
+    return SimpleNamespace(
+        id=city_id,
+        name=name,
+        region=region,
+        province=None,
+        lat=lat,
+        lon=lon,
+        locality_type=locality_type,
+        grid_cell=geo_grid.cell_id(lat, lon),
+    )
+
+
+ROWS = [
+    make_row(1, "Roma", 41.9028, 12.4964),
+    make_row(2, "Fiumicino", 41.7713, 12.2279),
+    make_row(3, "Ostia", 41.7320, 12.2858, locality_type="localita"),
+    make_row(4, "Milano", 45.4642, 9.1900, region="Lombardia"),
+    make_row(5, "Roma Centro", 41.9028, 12.4964, locality_type="localita"),
+]
+
+
+def test_nearest_orders_by_great_circle_distance_within_max_km():
+    locator = city_locator.CityLocator(ROWS)
+
+    results = locator.nearest(41.74, 12.27, limit=3, max_km=50)
+    assert [city["name"] for city in results[:2]] == ["Ostia", "Fiumicino"]
+    assert results[0]["distance_km"] == round(city_locator.haversine_km(41.74, 12.27, 41.7320, 12.2858), 3)
+    assert [city["name"] for city in locator.nearest(41.74, 12.27, limit=3, max_km=50, scope="comuni")] == [
+        "Fiumicino", "Roma",
+    ]
+    assert locator.nearest(44.0, 11.0, limit=1, max_km=50) == []
+    assert locator.nearest(45.47, 9.19, limit=10, max_km=5) == [{
+        "id": 4, "name": "Milano", "region": "Lombardia", "province": None,
+        "lat": 45.4642, "lon": 9.19, "locality_type": "comune", "distance_km": 0.645,
+    }]
+
+
+def test_resolve_prefers_comune_on_equal_distance(monkeypatch):
+    monkeypatch.setattr(city_locator, "_locator", city_locator.CityLocator(list(reversed(ROWS))))
+
+    assert city_locator.resolve(None, 41.9028, 12.4964)["name"] == "Roma"
+    assert city_locator.resolve(None, 41.905, 12.49)["name"] == "Roma"
+    assert city_locator.resolve(None, 43.0, 10.0) is None
+
+
+def test_sql_fallback_matches_in_memory_locator(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'nearest.db'}")
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as db:
+        db.add_all([
+            City(id=row.id, name=row.name, name_lower=row.name.lower(), region=row.region,
+                 lat=row.lat, lon=row.lon, locality_type=row.locality_type)
+            for row in ROWS
+        ])
+        db.commit()
+
+    monkeypatch.setattr(city_locator, "_locator", None)
+    with session_factory() as db:
+        fallback = city_locator.nearest(db, 41.74, 12.27, limit=3, max_km=30)
+    monkeypatch.setattr(city_locator, "SessionLocal", session_factory)
+    assert city_locator.rebuild() == len(ROWS)
+    in_memory = city_locator.nearest(None, 41.74, 12.27, limit=3, max_km=30)
+
+    assert [city["id"] for city in fallback] == [city["id"] for city in in_memory]
+    assert [city["distance_km"] for city in fallback] == [city["distance_km"] for city in in_memory]
+
+
+def test_nearest_endpoint_returns_distance(monkeypatch):
+    monkeypatch.setattr(city_locator, "_locator", city_locator.CityLocator(ROWS))
+
+    response = client.get("/api/cities/nearest?lat=41.74&lon=12.27&limit=2&max_km=20&scope=comuni")
+
+    assert response.status_code == 200
+    assert [(city["name"], city["distance_km"] > 0) for city in response.json()] == [("Fiumicino", True)]
+    assert client.get("/api/cities/nearest?lat=91&lon=12").status_code == 422
+
+
+class FakeQuery:
+    """Filtri di uguaglianza su ROWS: `City.id == x`, `City.grid_cell == c`, `City.locality_type == t`."""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def filter(self, *criteria):
+        for criterion in criteria:
+            column, value = criterion.left.name, criterion.right.value
+            self.rows = [row for row in self.rows if getattr(row, column) == value]
+        return self
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+
+class FakeDb:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def query(self, *args, **kwargs):
+        return FakeQuery(self.rows)
+
+
+def test_weather_coordinates_resolve_to_nearest_city(monkeypatch):
+    monkeypatch.setattr(city_locator, "_locator", city_locator.CityLocator(ROWS))
+    lookups = []
+
+    def override_get_db():
+        yield FakeDb(ROWS)
+
+    async def fake_fetch_single_city(lat, lon):
+        return {
+            "latitude": lat,
+            "longitude": lon,
+            "current": {"temperature_2m": 18, "apparent_temperature": 18, "weather_code": 1},
+            "hourly": {"time": [], "temperature_2m": [], "weather_code": []},
+            "daily": {"time": [], "temperature_2m_min": [], "temperature_2m_max": [], "weather_code": []},
+        }
+
+    monkeypatch.setattr(weather_module, "fetch_single_city", fake_fetch_single_city)
+    monkeypatch.setattr(weather_module.forecast_snapshots, "lookup", lambda city_id: lookups.append(city_id))
+
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        near_fiumicino = client.get("/api/weather?lat=41.79&lon=12.25&include_ml=false")
+        far_away = client.get("/api/weather?lat=43.0&lon=10.0&include_ml=false")
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+    assert near_fiumicino.status_code == 200
+    assert near_fiumicino.json()["city"]["name"] == "Fiumicino"
+    assert near_fiumicino.json()["city"]["region"] == "Lazio"
+    # Fiumicino è a ~3 km ma in un'altra cella meteo: niente snapshot, si usa il percorso live
+    assert lookups == []
+    assert far_away.status_code == 200
+    assert "city" not in far_away.json()
+
+
+def test_localities_use_snapshot_of_comune_in_same_grid_cell(monkeypatch):
+    monkeypatch.setattr(geo_grid, "GRID_STEP_DEGREES", 0.05)
+    comune = make_row(10, "Castel Gandolfo", 41.7470, 12.6600)
+    localita = make_row(11, "Pavona", 41.7480, 12.6700, locality_type="localita")
+    other = make_row(12, "Cecchina", 41.7060, 12.6470, locality_type="localita")
+    rows = [comune, localita, other]
+    monkeypatch.setattr(city_locator, "_locator", city_locator.CityLocator(rows))
+    snapshot = {
+        "latitude": comune.lat,
+        "longitude": comune.lon,
+        "current": {"temperature_2m": 17, "apparent_temperature": 17, "weather_code": 2},
+        "hourly": {"time": [], "temperature_2m": [], "weather_code": []},
+        "daily": {"time": [], "temperature_2m_min": [], "temperature_2m_max": [], "weather_code": []},
+    }
+    lookups = []
+
+    def fake_lookup(city_id):
+        lookups.append(city_id)
+        return (snapshot, 120.0) if city_id == comune.id else None
+
+    async def fake_fetch_single_city(lat, lon):
+        return {**snapshot, "latitude": lat, "longitude": lon}
+
+    monkeypatch.setattr(weather_module.forecast_snapshots, "lookup", fake_lookup)
+    monkeypatch.setattr(weather_module, "fetch_single_city", fake_fetch_single_city)
+
+    def override_get_db():
+        yield FakeDb(rows)
+
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        same_cell = client.get(f"/api/weather?lat={localita.lat}&lon={localita.lon}&include_ml=false")
+        other_cell = client.get(f"/api/weather?lat={other.lat}&lon={other.lon}&include_ml=false")
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+    assert localita.grid_cell == comune.grid_cell != other.grid_cell
+    assert same_cell.json()["city"]["name"] == "Pavona"
+    assert same_cell.json()["freshness"]["source"] == "snapshot"
+    assert other_cell.json()["freshness"]["source"] == "live"
+    assert lookups == [comune.id]
@@ -0,0 +1,148 @@
+"""Test indice di ricerca città in memoria."""
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import city_search
+from database import Base, City, CityAlternateName, get_db
+from main import app
+
+
+client = TestClient(app)
+
+
+def make_row(city_id, name, *, population=None, locality_type="comune", region="Lazio"):
+    return SimpleNamespace(
+        id=city_id,
+        name=name,
+        name_lower=name.lower(),
+        region=region,
+        province=None,
+        lat=41.9,
+        lon=12.5,
+        population=population,
+        locality_type=locality_type,
+    )
+
+
+ROWS = [
+    make_row(1, "Roma", population=2_800_000),
+    make_row(2, "Rovigo", population=50_000, region="Veneto"),
+    make_row(3, "Roma Vecchia", locality_type="localita"),
+    make_row(4, "Rocca di Papa", population=16_000),
+    make_row(5, "Castel Romano", locality_type="localita"),
+    make_row(6, "Frosinone", population=45_000),
+    make_row(7, "Reggio nell'Emilia", population=170_000, region="Emilia-Romagna"),
+]
+
+
+def _names(results):
+    return [city["name"] for city in results]
+
+
+def test_prefix_matches_come_before_substring_matches_in_rank_order():
+    index = city_search.CitySearchIndex(ROWS)
+
+    assert _names(index.search("Ro", limit=8)) == [
+        "Roma", "Rovigo", "Rocca di Papa", "Roma Vecchia", "Frosinone", "Castel Romano",
+    ]
+    assert _names(index.search("ro", limit=2)) == ["Roma", "Rovigo"]
+    assert _names(index.search("  ROMA ", limit=8)) == ["Roma", "Roma Vecchia", "Castel Romano"]
+
+
+def test_scope_and_long_substring_queries():
+    index = city_search.CitySearchIndex(ROWS)
+
+    assert _names(index.search("ro", limit=8, scope="localita")) == ["Roma Vecchia", "Castel Romano"]
+    assert _names(index.search("ro", limit=8, scope="comuni")) == ["Roma", "Rovigo", "Rocca di Papa", "Frosinone"]
+    assert _names(index.search("nell'emil", limit=8)) == ["Reggio nell'Emilia"]
+    assert _names(index.search("romano", limit=1)) == ["Castel Romano"]
+    assert index.search("zzz", limit=8) == []
+    assert set(index.search("roma", limit=1)[0]) == {"id", "name", "region", "province", "lat", "lon", "locality_type"}
+
+
+def test_normalize_name_folds_accents_and_punctuation():
+    assert city_search.normalize_name("Forlì") == "forli"
+    assert city_search.normalize_name(" Sant'Angelo  a Cupolo ") == "sant angelo a cupolo"
+    assert city_search.normalize_name("Reggio nell’Emilia") == "reggio nell emilia"
+    assert city_search.normalize_name("Castelnuovo-Don Bosco") == "castelnuovo don bosco"
+    assert city_search.normalize_name("Рим") == ""
+
+
+def test_accent_alternate_name_and_typo_tolerant_matches():
+    rows = ROWS + [
+        make_row(8, "Forlì", population=118_000, region="Emilia-Romagna"),
+        make_row(9, "Sant'Angelo a Cupolo", population=4_000, region="Campania"),
+        make_row(10, "Bozen Süd", locality_type="localita", region="Trentino-Alto Adige"),
+    ]
+    index = city_search.CitySearchIndex(rows, alternate_names=[(1, "rome"), (1, "rom"), (8, "forli"), (99, "ghost")])
+
+    assert index.n_keys == len(rows) + 2
+    assert _names(index.search("forli")) == ["Forlì"]
+    assert _names(index.search("FORLÌ")) == ["Forlì"]
+    assert _names(index.search("sant angelo")) == ["Sant'Angelo a Cupolo"]
+    assert _names(index.search("bozen sud")) == ["Bozen Süd"]
+    assert _names(index.search("rome", limit=1)) == ["Roma"]
+    # Refusi e apostrofi omessi: solo ricerca fuzzy sui trigrammi
+    assert _names(index.search("frosinome", limit=1)) == ["Frosinone"]
+    assert _names(index.search("santangelo", limit=1)) == ["Sant'Angelo a Cupolo"]
+    assert _names(index.search("reggio emilia", limit=1)) == ["Reggio nell'Emilia"]
+    assert index.search("qwxyk") == []
+
+
+def test_rebuild_reads_cities_from_database(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'search.db'}")
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(city_search, "SessionLocal", session_factory)
+    monkeypatch.setattr(city_search, "_index", None)
+    with session_factory() as db:
+        db.add_all([
+            City(id=1, name="Milano", name_lower="milano", lat=45.46, lon=9.19, population=1_300_000,
+                 locality_type="comune"),
+            City(id=2, name="Milazzo", name_lower="milazzo", lat=38.22, lon=15.24, population=31_000,
+                 locality_type="comune"),
+            City(id=3, name="Cantù", name_lower="cantù", lat=45.74, lon=9.13, population=40_000,
+                 locality_type="comune", name_search="cantu"),
+            CityAlternateName(city_id=1, name="Mailand", name_search="mailand"),
+        ])
+        db.commit()
+
+    assert city_search.search("mil") is None
+    assert city_search.refresh_search_names() == 2
+    assert city_search.rebuild() == 3
+    assert _names(city_search.search("mil")) == ["Milano", "Milazzo"]
+    assert _names(city_search.search("mailand")) == ["Milano"]
+    assert city_search.get_stats()["keys"] == 4
+    with session_factory() as db:
+        assert dict(db.query(City.name, City.name_search).all())["Milazzo"] == "milazzo"
+
+
+def test_search_endpoint_uses_index_without_database(monkeypatch):
+    monkeypatch.setattr(city_search, "_index", city_search.CitySearchIndex(ROWS))
+
+    class NoQueryDb:
+        def query(self, *args, **kwargs):
+            raise AssertionError("la ricerca non deve interrogare il database")
+
+    def _override():
+        yield NoQueryDb()
+
+    app.dependency_overrides[get_db] = _override
+    try:
+        response = client.get("/api/cities?q=rov&limit=3")
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+    assert response.status_code == 200
+    assert response.json() == [{
+        "id": 2, "name": "Rovigo", "region": "Veneto", "province": None,
+        "lat": 41.9, "lon": 12.5, "locality_type": "comune",
+    }]
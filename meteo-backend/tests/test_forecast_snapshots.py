@@ -0,0 +1,176 @@
+"""Test snapshot previsioni pubbliche per comune dal batch orario."""
+import asyncio
+from datetime import datetime, timezone
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from sqlalchemy import create_engine
+
+import forecast_snapshots
+import scheduler
+import weather_service
+from database import PublicWeatherCacheEntry
+from weather_cache import SqlCacheBackend
+
+# 2026-04-04 10:00 UTC = 12:00 a Roma
+CYCLE_EPOCH = int(datetime(2026, 4, 4, 10, tzinfo=timezone.utc).timestamp())
+# Mezzanotte locale del 4 aprile (UTC+2)
+LOCAL_MIDNIGHT_EPOCH = int(datetime(2026, 4, 3, 22, tzinfo=timezone.utc).timestamp())
+
+
+def _unixtime_city_payload(temp: float) -> dict:
+    hours = [CYCLE_EPOCH + index * 3600 for index in range(26)]
+    days = [LOCAL_MIDNIGHT_EPOCH + index * 86400 for index in range(16)]
+    return {
+        "current": {
+            "time": CYCLE_EPOCH + 900,
+            "temperature_2m": temp,
+            "relative_humidity_2m": 60,
+            "apparent_temperature": temp - 1,
+            "cloud_cover": 20,
+            "wind_speed_10m": 10,
+            "wind_direction_10m": 180,
+            "surface_pressure": 1012,
+            "precipitation": 0.0,
+            "weather_code": 1,
+        },
+        "hourly": {
+            "time": hours,
+            "temperature_2m": [temp + index for index in range(26)],
+            "relative_humidity_2m": [60] * 26,
+            "cloud_cover": [20] * 26,
+            "wind_speed_10m": [10] * 26,
+            "wind_direction_10m": [180] * 26,
+            "precipitation_probability": [10] * 26,
+            "precipitation": [0.0] * 26,
+            "weather_code": [1] * 26,
+        },
+        "daily": {
+            "time": days,
+            "temperature_2m_max": [temp + 5] * 16,
+            "temperature_2m_min": [temp - 5] * 16,
+            "weather_code": [1] * 16,
+            "precipitation_probability_max": [10] * 16,
+            "wind_speed_10m_max": [15] * 16,
+            "wind_direction_10m_dominant": [180] * 16,
+        },
+    }
+
+
+def test_fetch_weather_batch_stores_snapshots_and_keeps_ml_rows(monkeypatch):
+    monkeypatch.setattr(forecast_snapshots, "_snapshots", {})
+    cities = [
+        {"id": 9001, "name": "Roma", "lat": 41.9, "lon": 12.5},
+        {"id": 9002, "name": "Milano", "lat": 45.46, "lon": 9.19},
+    ]
+    seen_params = []
+
+    class FakeResponse:
+        def raise_for_status(self):
+            return None
+
+        def json(self):
+            return [_unixtime_city_payload(18.0), _unixtime_city_payload(12.0)]
+
+    class FakeClient:
+        async def get(self, url, params, timeout):
+            seen_params.append(params)
+            return FakeResponse()
+
+    result = asyncio.run(weather_service.fetch_weather_batch(cities, FakeClient()))
+
+    assert seen_params[0]["timeformat"] == "unixtime"
+    assert seen_params[0]["daily"] == weather_service.SINGLE_CITY_DAILY_FIELDS
+    assert len(result["observations"]) == 2
+    assert len(result["predictions"]) == 2 * len(weather_service.ML_FORECAST_LEADS)
+    first = result["predictions"][0]
+    assert first["predicted_at"] == datetime(2026, 4, 4, 10, tzinfo=timezone.utc)
+    assert first["target_time"] == datetime(2026, 4, 4, 11, tzinfo=timezone.utc)
+    assert first["forecast_temp"] == 19.0
+    assert forecast_snapshots.get_stats()["cities"] == 2
+
+
+def test_lookup_realigns_hours_and_days_to_request_time(monkeypatch):
+    monkeypatch.setattr(forecast_snapshots, "_snapshots", {})
+    city = {"id": 9001, "name": "Roma", "lat": 41.9, "lon": 12.5}
+    forecast_snapshots.store_batch([city], [_unixtime_city_payload(18.0)], fetched_at=CYCLE_EPOCH + 900)
+
+    payload, age = forecast_snapshots.lookup(9001, now=CYCLE_EPOCH + 5400)
+
+    assert age == 4500
+    assert payload["hourly"]["time"][0] == "2026-04-04T13:00"
+    assert payload["hourly"]["temperature_2m"][0] == 19.0
+    assert len(payload["hourly"]["time"]) == forecast_snapshots.SNAPSHOT_HOURLY_HOURS
+    assert payload["daily"]["time"][0] == "2026-04-04"
+    assert payload["current"]["time"] == "2026-04-04T12:15"
+
+    formatted = weather_service.format_weather_for_frontend(payload, "Roma")
+    assert len(formatted["hourly"]) == 24 and len(formatted["daily"]) == 16
+    assert formatted["current"]["feels_like"] == 17.0
+    assert forecast_snapshots.freshness(age)["status"] == "stale"
+
+
+def test_lookup_drops_snapshots_older_than_max_age(monkeypatch):
+    monkeypatch.setattr(forecast_snapshots, "_snapshots", {})
+    city = {"id": 9001, "name": "Roma", "lat": 41.9, "lon": 12.5}
+    incomplete = {"current": {"temperature_2m": 18.0}, "hourly": {}, "daily": {}}
+    stored = forecast_snapshots.store_batch(
+        [city, {**city, "id": 9002}],
+        [_unixtime_city_payload(18.0), incomplete],
+        fetched_at=CYCLE_EPOCH,
+    )
+
+    assert stored == 1
+
+    assert forecast_snapshots.lookup(9002, now=CYCLE_EPOCH) is None
+    assert forecast_snapshots.lookup(9001, now=CYCLE_EPOCH + forecast_snapshots.SNAPSHOT_MAX_AGE_SECONDS) is None
+    assert forecast_snapshots.get_stats()["cities"] == 0
+
+
+def test_snapshots_are_shared_across_workers_and_restarts(tmp_path, monkeypatch):
+    now = [CYCLE_EPOCH + 900]
+    engine = create_engine(f"sqlite:///{tmp_path / 'shared.db'}")
+    PublicWeatherCacheEntry.__table__.create(engine)
+    monkeypatch.setattr(forecast_snapshots, "_snapshots", {})
+    monkeypatch.setattr(forecast_snapshots, "_shared_backend", SqlCacheBackend(engine, clock=lambda: now[0]))
+    city = {"id": 9001, "name": "Roma", "lat": 41.9, "lon": 12.5}
+
+    assert forecast_snapshots.store_batch([city], [_unixtime_city_payload(18.0)], fetched_at=now[0]) == 1
+
+    # Un altro worker (o lo stesso processo dopo un riavvio) parte senza snapshot in memoria
+    forecast_snapshots.clear()
+    now[0] = CYCLE_EPOCH + 1800
+    assert forecast_snapshots.has_recent_cycle(now=now[0])
+    now[0] = CYCLE_EPOCH + 5400
+    assert forecast_snapshots.lookup(9001, now=now[0]) is None
+    # Oltre un ciclo serve un nuovo batch, ma lo snapshot resta servibile fino a SNAPSHOT_MAX_AGE_SECONDS
+    assert not forecast_snapshots.has_recent_cycle(now=now[0])
+
+    payload, age = asyncio.run(forecast_snapshots.lookup_shared(9001, now=now[0]))
+    assert age == 4500
+    assert payload["hourly"]["time"][0] == "2026-04-04T13:00"
+    assert forecast_snapshots.lookup(9001, now=now[0])[1] == 4500
+    assert asyncio.run(forecast_snapshots.lookup_shared(9002, now=now[0])) is None
+    engine.dispose()
+
+
+def test_startup_refresh_runs_only_without_recent_snapshots(monkeypatch):
+    monkeypatch.setattr(forecast_snapshots, "_snapshots", {})
+    monkeypatch.setattr(forecast_snapshots, "_shared_backend", None)
+    cities = [{"id": 9001, "name": "Roma", "lat": 41.9, "lon": 12.5}]
+    fetched = []
+
+    async def fake_fetch_all(batch):
+        fetched.append(batch)
+        forecast_snapshots.store_batch(batch, [_unixtime_city_payload(18.0)])
+        return {"columns": weather_service._empty_batch_columns(), "stats": {"batches": 1, "completed_batches": 1}}
+
+    monkeypatch.setattr(scheduler, "_db_get_cities", lambda: cities)
+    monkeypatch.setattr(scheduler, "fetch_all_cities_weather", fake_fetch_all)
+
+    assert asyncio.run(scheduler.refresh_snapshots_at_startup()) == 1
+    assert asyncio.run(scheduler.refresh_snapshots_at_startup()) == 0
+    assert fetched == [cities]
@@ -0,0 +1,51 @@
+"""Test griglia di condivisione previsioni tra località vicine."""
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import geo_grid
+from database import Base, City
+
+
+def test_snap_returns_cell_center_and_is_idempotent():
+    center = geo_grid.snap(41.9028, 12.4964, 0.05)
+
+    assert center == (41.925, 12.475)
+    assert geo_grid.snap(*center, 0.05) == center
+    assert geo_grid.snap(-0.01, -0.01, 0.05) == (-0.025, -0.025)
+    assert geo_grid.snap(41.90284, 12.49637, 0) == (41.9028, 12.4964)
+    assert geo_grid.cell_id(41.9028, 12.4964, 0.05) == "0.05:838:249"
+    assert geo_grid.cell_id(41.889, 12.47, 0.05) == "0.05:837:249"
+
+
+def test_refresh_city_cells_fills_missing_and_recomputes_other_steps(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'grid.db'}")
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(geo_grid, "SessionLocal", session_factory)
+    with session_factory() as db:
+        db.add_all([
+            City(name="Roma", name_lower="roma", lat=41.9028, lon=12.4964, locality_type="comune"),
+            City(name="Parioli", name_lower="parioli", lat=41.92, lon=12.49, locality_type="localita"),
+            City(name="Milano", name_lower="milano", lat=45.4642, lon=9.19, locality_type="comune",
+                 grid_cell="0.1:454:91"),
+            City(name="Napoli", name_lower="napoli", lat=40.8518, lon=14.2681, locality_type="comune",
+                 grid_cell=geo_grid.cell_id(40.8518, 14.2681, 0.05)),
+        ])
+        db.commit()
+
+    assert geo_grid.refresh_city_cells(0.05) == 3
+    assert geo_grid.refresh_city_cells(0.05) == 0
+
+    with session_factory() as db:
+        cells = dict(db.query(City.name, City.grid_cell).all())
+        monkeypatch.setattr(geo_grid, "GRID_STEP_DEGREES", 0.05)
+        stats = geo_grid.get_grid_stats(db)
+
+    assert cells["Roma"] == cells["Parioli"] == "0.05:838:249"
+    assert cells["Milano"] == "0.05:909:183"
+    assert stats == {"step_degrees": 0.05, "cities": 4, "cells": 3, "cities_per_cell": 1.33}
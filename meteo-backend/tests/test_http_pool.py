@@ -0,0 +1,96 @@
+"""Test pool HTTP condiviso e metriche di riuso connessioni."""
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import httpx
+
+import http_pool
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_shared_client_reuses_connections_per_host():
+    http_pool.reset_pool_stats()
+    server = _serve()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    async def scenario():
+        await http_pool.start()
+        try:
+            for _ in range(3):
+                async with http_pool.borrow_client() as client:
+                    assert client is http_pool.get_client()
+                    response = await client.get(url)
+                    assert response.json() == {"ok": True}
+        finally:
+            await http_pool.close()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        server.shutdown()
+
+    stats = http_pool.get_pool_stats()
+    host = stats["hosts"]["127.0.0.1"]
+    assert stats["active"] is False
+    assert host["requests"] == 3
+    assert host["new_connections"] == 1 and host["reused_connections"] == 2
+    assert host["reuse_ratio"] == 0.667
+    assert host["http_versions"] == {"HTTP/1.1": 3}
+
+
+def test_borrow_client_without_pool_uses_temporary_client():
+    http_pool.reset_pool_stats()
+
+    async def scenario():
+        assert http_pool.get_client() is None
+        async with http_pool.borrow_client() as client:
+            assert isinstance(client, httpx.AsyncClient)
+            temporary = client
+        return temporary.is_closed
+
+    assert asyncio.run(scenario()) is True
+
+
+def test_metered_transport_counts_errors():
+    http_pool.reset_pool_stats()
+
+    def failing(request):
+        raise httpx.ConnectError("rifiutata", request=request)
+
+    async def scenario():
+        transport = http_pool._MeteredTransport(httpx.MockTransport(failing))
+        async with httpx.AsyncClient(transport=transport) as client:
+            try:
+                await client.get("https://api.met.no/x")
+            except httpx.ConnectError:
+                pass
+
+    asyncio.run(scenario())
+    host = http_pool.get_pool_stats()["hosts"]["api.met.no"]
+    assert host["requests"] == 1 and host["errors"] == 1
@@ -29,6 +29,9 @@ def test_alembic_upgrade_creates_expected_schema(tmp_path):
     assert "ml_model_store" in inspector.get_table_names()
     assert "supporters" in inspector.get_table_names()
     assert "supporter_tokens" in inspector.get_table_names()
+    assert "ml_error_stats" in inspector.get_table_names()
+    assert "public_weather_cache" in inspector.get_table_names()
+    assert "city_alternate_names" in inspector.get_table_names()
 
     prediction_columns = {column["name"] for column in inspector.get_columns("ml_predictions")}
     assert {"target_time", "lead_hours", "forecast_temp", "actual_precipitation"} <= prediction_columns
@@ -39,6 +42,9 @@ def test_alembic_upgrade_creates_expected_schema(tmp_path):
         "actual_wind_direction",
     } <= prediction_columns
 
+    city_columns = {column["name"] for column in inspector.get_columns("cities")}
+    assert {"grid_cell", "name_search"} <= city_columns
+
     observation_columns = {column["name"] for column in inspector.get_columns("weather_observations")}
     assert {"wind_direction"} <= observation_columns
 
@@ -47,3 +53,9 @@ def test_alembic_upgrade_creates_expected_schema(tmp_path):
 
     supporter_token_columns = {column["name"] for column in inspector.get_columns("supporter_tokens")}
     assert {"supporter_id", "token_hash", "last_seen_at"} <= supporter_token_columns
+
+    error_stat_columns = {column["name"] for column in inspector.get_columns("ml_error_stats")}
+    assert {"day", "region", "lead_hours", "n_verified", "sum_abs_error"} <= error_stat_columns
+
+    cache_columns = {column["name"] for column in inspector.get_columns("public_weather_cache")}
+    assert {"cache_key", "stored_at", "expires_at", "payload"} <= cache_columns
@@ -0,0 +1,79 @@
+"""Test aggiornamento incrementale dei modelli ML."""
+import sys
+import os
+
+import numpy as np
+from sklearn.linear_model import LogisticRegression, Ridge, SGDClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from ml_incremental import RidgeAccumulator, partial_fit_pipeline, supports_partial_fit
+from ml_scoring import compile_pipeline
+
+
+def _features(rng, n_rows):
+    X = rng.normal(size=(n_rows, 8)) * [5, 10, 6, 3, 1, 20, 2, 1] + [15, 60, 12, 6, 42, 50, 3, 1]
+    X[:, 7] = np.round(np.abs(X[:, 7]))
+    return X
+
+
+def test_ridge_accumulator_matches_full_refit():
+    rng = np.random.default_rng(5)
+    X = _features(rng, 900)
+    y = X @ rng.normal(size=8) + rng.normal(scale=0.3, size=900)
+
+    accumulator = RidgeAccumulator(8)
+    for start, end in ((0, 600), (600, 601), (601, 900)):
+        accumulator.update(X[start:end], y[start:end])
+    incremental = accumulator.to_pipeline(alpha=1.0)
+    reference = Pipeline([("scaler", StandardScaler()), ("ridge", Ridge(alpha=1.0))]).fit(X, y)
+
+    assert accumulator.n_samples == 900
+    np.testing.assert_allclose(incremental.predict(X), reference.predict(X), atol=1e-9)
+    assert compile_pipeline(incremental) is not None
+
+
+def test_partial_fit_pipeline_updates_a_copy_and_skips_unknown_labels():
+    rng = np.random.default_rng(6)
+    X = _features(rng, 300)
+    y = np.digitize(X[:, 0], [10.0, 15.0, 20.0])
+    pipeline = Pipeline([
+        ("scaler", StandardScaler()),
+        ("clf", SGDClassifier(loss="log_loss", random_state=0)),
+    ]).fit(X[y < 3], y[y < 3])
+    coef_before = pipeline.steps[1][1].coef_.copy()
+
+    updated = partial_fit_pipeline(pipeline, X[:50], y[:50])
+
+    assert updated is not pipeline
+    np.testing.assert_array_equal(pipeline.steps[1][1].coef_, coef_before)
+    assert not np.allclose(updated.steps[1][1].coef_, coef_before)
+    assert updated.steps[1][1].classes_.tolist() == [0, 1, 2]
+    assert partial_fit_pipeline(pipeline, X[y == 3], y[y == 3]) is None
+
+
+def test_partial_fit_requires_sgd_pipelines():
+    rng = np.random.default_rng(7)
+    X = _features(rng, 100)
+    y = (X[:, 0] > 15).astype(int)
+    logistic = Pipeline([("scaler", StandardScaler()), ("clf", LogisticRegression())]).fit(X, y)
+
+    assert supports_partial_fit(logistic) is False
+    assert supports_partial_fit(None) is False
+    assert partial_fit_pipeline(logistic, X, y) is None
+
+
+def test_sgd_pipelines_compile_to_matching_scorers():
+    rng = np.random.default_rng(8)
+    X = _features(rng, 400)
+    for y in ((X[:, 0] > 15).astype(int), np.digitize(X[:, 0], [10.0, 15.0, 20.0])):
+        pipeline = Pipeline([
+            ("scaler", StandardScaler()),
+            ("clf", SGDClassifier(loss="log_loss", random_state=0)),
+        ]).fit(X, y)
+        scorer = compile_pipeline(pipeline)
+
+        np.testing.assert_allclose(scorer.predict_proba(X), pipeline.predict_proba(X), atol=1e-9)
+        assert (scorer.predict(X) == pipeline.predict(X)).all()
@@ -0,0 +1,445 @@
+"""Test modelli ML e statistiche aggregate."""
+import pickle
+import sys
+import threading
+import os
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import numpy as np
+from sklearn.linear_model import LogisticRegression, Ridge
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import ml_model
+from database import Base, City, MlModelStore, MlPrediction
+from ml_scoring import compile_pipeline
+
+
+class CountingPipeline:
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.classes_ = getattr(pipeline, "classes_", None)
+        self.calls = 0
+
+    def predict(self, X):
+        self.calls += 1
+        return self.pipeline.predict(X)
+
+    def predict_proba(self, X):
+        self.calls += 1
+        return self.pipeline.predict_proba(X)
+
+
+def _install_models(monkeypatch):
+    rng = np.random.default_rng(7)
+    X = rng.normal(size=(200, 8)) * [5, 10, 6, 3, 1, 20, 2, 1] + [15, 60, 12, 6, 42, 50, 3, 1]
+    y_temp = 0.1 * X[:, 0] - 0.02 * X[:, 1] + rng.normal(scale=0.1, size=200)
+    y_rain = (X[:, 5] + rng.normal(scale=5, size=200) > 50).astype(int)
+    X_cond = rng.normal(size=(200, 13)) + np.arange(13)
+    y_cond = rng.integers(0, 4, size=200)
+
+    def fit(model, X_train, y_train):
+        return Pipeline([("scaler", StandardScaler()), ("model", model)]).fit(X_train, y_train)
+
+    pipelines = {
+        "_pipeline": CountingPipeline(fit(Ridge(alpha=1.0), X, y_temp)),
+        "_rain_pipeline": CountingPipeline(fit(LogisticRegression(max_iter=1000), X, y_rain)),
+        "_condition_pipeline": CountingPipeline(fit(LogisticRegression(max_iter=2000), X_cond, y_cond)),
+    }
+    for name, pipeline in pipelines.items():
+        monkeypatch.setattr(ml_model, name, pipeline)
+        monkeypatch.setattr(ml_model, name.replace("_pipeline", "_scorer"), None)
+    monkeypatch.setattr(ml_model, "_region_codebook", {"Lazio": 0, "Sconosciuta": 1})
+    return pipelines
+
+
+def _fake_days(count):
+    return [
+        {
+            "dt": f"2026-04-{day:02d}",
+            "temp": {"min": 10 + day % 3, "max": 20 + day % 5, "day": 15 + day % 4},
+            "humidity": 55,
+            "cloud_cover": 30 + day * 3,
+            "wind_speed": 5 + day,
+            "wind_deg": 180,
+            "pop": (day % 5) / 5,
+            "weather_code": 61 if day % 4 == 0 else 2,
+        }
+        for day in range(1, count + 1)
+    ]
+
+
+def test_get_stats_serves_snapshot_until_refreshed(monkeypatch):
+    loads = []
+
+    def fake_load_stats():
+        loads.append(1)
+        return {"verified_predictions": len(loads), "lead_time_error": []}
+
+    monkeypatch.setattr(ml_model, "_load_stats", fake_load_stats)
+    monkeypatch.setattr(ml_model, "_stats_snapshot", {"value": None, "loaded_at": None, "hits": 0, "misses": 0})
+
+    first = ml_model.get_stats()
+    second = ml_model.get_stats()
+    assert first["verified_predictions"] == second["verified_predictions"] == 1
+    assert "model_ready" in second
+
+    assert ml_model.refresh_stats()["verified_predictions"] == 2
+    assert ml_model.get_stats()["verified_predictions"] == 2
+
+    info = ml_model.get_stats_cache_info()
+    assert info["hits"] == 2
+    assert info["misses"] == 1
+    assert info["age_seconds"] is not None
+
+
+def test_get_stats_loads_outside_snapshot_lock_once(monkeypatch):
+    clock = [1000.0]
+    loads = []
+    seen_during_load = {}
+    monkeypatch.setattr(ml_model.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(ml_model, "_stats_snapshot", {"value": None, "loaded_at": None, "hits": 0, "misses": 0})
+
+    def slow_load_stats():
+        loads.append(1)
+        if len(loads) == 2:
+            # Durante il caricamento le letture concorrenti non si bloccano e non ricaricano
+            def read_concurrently():
+                seen_during_load["info"] = ml_model.get_stats_cache_info()
+                seen_during_load["stats"] = ml_model.get_stats()
+
+            reader = threading.Thread(target=read_concurrently)
+            reader.start()
+            reader.join(timeout=2)
+            assert not reader.is_alive()
+        return {"verified_predictions": len(loads)}
+
+    monkeypatch.setattr(ml_model, "_load_stats", slow_load_stats)
+
+    assert ml_model.get_stats()["verified_predictions"] == 1
+    clock[0] += ml_model.STATS_CACHE_TTL_SECONDS + 1
+    assert ml_model.get_stats()["verified_predictions"] == 2
+
+    assert seen_during_load["stats"]["verified_predictions"] == 1
+    assert seen_during_load["info"]["misses"] == 2
+    assert len(loads) == 2 and not ml_model._stats_loading
+
+
+def test_get_stats_reloads_after_ttl(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(ml_model.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(ml_model, "_load_stats", lambda: {"verified_predictions": clock[0]})
+    monkeypatch.setattr(ml_model, "_stats_snapshot", {"value": None, "loaded_at": None, "hits": 0, "misses": 0})
+
+    assert ml_model.get_stats()["verified_predictions"] == 1000.0
+    clock[0] += ml_model.STATS_CACHE_TTL_SECONDS - 1
+    assert ml_model.get_stats()["verified_predictions"] == 1000.0
+    clock[0] += 2
+    assert ml_model.get_stats()["verified_predictions"] == clock[0]
+
+
+def test_build_forecast_insights_uses_one_call_per_model(monkeypatch):
+    pipelines = _install_models(monkeypatch)
+    days = _fake_days(16)
+    lead_hours = [(index * 24) + 14 for index in range(16)]
+    current = {
+        "forecast_temp": 18.0,
+        "humidity": 60,
+        "hour": 10,
+        "month": 4,
+        "lat": 41.9,
+        "region": "Lazio",
+        "cloud_cover": 40,
+        "lead_hours": 0,
+    }
+
+    insights = ml_model.build_forecast_insights(
+        current=current, days=days, lat=41.9, region="Lazio", lead_hours=lead_hours
+    )
+
+    assert [pipeline.calls for pipeline in pipelines.values()] == [1, 1, 1]
+    assert len(insights["daily"]) == 16
+    assert insights["correction"] == ml_model.predict_correction(
+        temp=18.0, humidity=60, hour=10, month=4, lat=41.9, region="Lazio", cloud_cover=40, lead_hours=0
+    )
+    for day, lead, insight in zip(days, lead_hours, insights["daily"]):
+        assert insight == ml_model.build_daily_insight(day=day, lat=41.9, region="Lazio", lead_hours=lead)
+
+
+def test_predict_condition_outlooks_matches_pipeline_predict(monkeypatch):
+    pipelines = _install_models(monkeypatch)
+    items = [ml_model._daily_item(day, lat=41.9, region="Lazio", lead_hours=6) for day in _fake_days(10)]
+
+    outlooks = ml_model.predict_condition_outlooks(items)
+
+    providers = [ml_model._provider_condition(item) for item in items]
+    expected = pipelines["_condition_pipeline"].pipeline.predict(ml_model._condition_feature_matrix(items, providers))
+    assert [outlook["expected_condition"] for outlook in outlooks] == [
+        ml_model.CONDITION_LABELS[int(code)] for code in expected
+    ]
+    assert all(outlook["source"] == "ml" for outlook in outlooks)
+
+
+def test_compiled_scorers_match_sklearn_pipelines(monkeypatch):
+    pipelines = _install_models(monkeypatch)
+    rng = np.random.default_rng(3)
+    X = rng.normal(size=(50, 8)) * 5 + 10
+    X_cond = rng.normal(size=(50, 13)) + np.arange(13)
+
+    temp = compile_pipeline(pipelines["_pipeline"].pipeline)
+    rain = compile_pipeline(pipelines["_rain_pipeline"].pipeline)
+    condition = compile_pipeline(pipelines["_condition_pipeline"].pipeline)
+
+    assert temp.kind == "regression" and rain.kind == "binary" and condition.kind == "multinomial"
+    np.testing.assert_allclose(temp.predict(X), pipelines["_pipeline"].pipeline.predict(X), atol=1e-9)
+    np.testing.assert_allclose(
+        rain.predict_proba(X), pipelines["_rain_pipeline"].pipeline.predict_proba(X), atol=1e-9
+    )
+    np.testing.assert_allclose(
+        condition.predict_proba(X_cond), pipelines["_condition_pipeline"].pipeline.predict_proba(X_cond), atol=1e-9
+    )
+    assert (condition.predict(X_cond) == pipelines["_condition_pipeline"].pipeline.predict(X_cond)).all()
+
+
+def test_promote_models_routes_inference_through_scorers(monkeypatch):
+    pipelines = _install_models(monkeypatch)
+    days = _fake_days(5)
+    leads = [14, 38, 62, 86, 110]
+    expected = ml_model.build_forecast_insights(days=days, lat=41.9, region="Lazio", lead_hours=leads)
+
+    ml_model._promote_models(*(pipeline.pipeline for pipeline in pipelines.values()), ml_model._region_codebook)
+    try:
+        assert ml_model._scorer is not None and ml_model._condition_scorer is not None
+        actual = ml_model.build_forecast_insights(days=days, lat=41.9, region="Lazio", lead_hours=leads)
+    finally:
+        ml_model._promote_models(None, None, None)
+
+    assert actual == expected
+
+
+def test_compile_pipeline_rejects_unsupported_pipelines():
+    assert compile_pipeline(None) is None
+    assert compile_pipeline(Pipeline([("ridge", Ridge().fit(np.eye(3), [1, 2, 3]))])) is None
+
+
+def test_region_codebook_matches_label_encoder_column_wise():
+    regions = ["Toscana", "Lazio", "Toscana", "Molise", "Lazio"]
+    encoder, codebook = ml_model._encode_regions(np.array(regions, dtype=object))
+
+    encoded = ml_model._encode_region_column(regions + ["Atlantide"], codebook)
+
+    assert codebook == {"Lazio": 0, "Molise": 1, "Toscana": 2}
+    assert encoded[:-1].tolist() == encoder.transform(regions).tolist()
+    assert encoded[-1] == 0
+    assert ml_model._codebook_from_encoder(encoder) == codebook
+
+
+def test_load_latest_model_derives_codebook_for_legacy_models(monkeypatch):
+    encoder = LabelEncoder().fit(["Lazio", "Puglia"])
+    record = SimpleNamespace(
+        model_bytes=pickle.dumps({"pipeline": None, "le": encoder, "regions": ["Lazio", "Puglia"]}),
+        trained_at=datetime(2026, 4, 1, tzinfo=timezone.utc),
+        mae=0.5,
+        n_samples=100,
+    )
+
+    class FakeQuery:
+        def order_by(self, *args):
+            return self
+
+        def first(self):
+            return record
+
+    class FakeSession:
+        def query(self, *args):
+            return FakeQuery()
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(ml_model, "SessionLocal", FakeSession)
+    monkeypatch.setattr(ml_model, "_region_codebook", {})
+
+    assert ml_model.load_latest_model() is True
+    assert ml_model._region_code("Puglia") == 1
+    assert ml_model._region_code("Sicilia") == 0
+
+
+def _seed_training_db(tmp_path, monkeypatch, n_rows=400):
+    engine = create_engine(f"sqlite:///{tmp_path / 'train.db'}")
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+    monkeypatch.setattr(ml_model, "SessionLocal", session_factory)
+
+    regions = ("Lazio", "Toscana", "Puglia")
+    with session_factory() as db:
+        for city_id, region in enumerate(regions, start=1):
+            db.add(City(id=city_id, name=region, name_lower=region.lower(), region=region, lat=40.0 + city_id, lon=12.0))
+        db.commit()
+    _add_verified_predictions(session_factory, range(n_rows))
+    return session_factory
+
+
+def _add_verified_predictions(session_factory, indexes, seed=11):
+    rng = np.random.default_rng(seed)
+    anchor = datetime(2026, 4, 1, tzinfo=timezone.utc)
+    with session_factory() as db:
+        for index in indexes:
+            city_id = index % 3 + 1
+            forecast_temp = float(rng.normal(15, 5))
+            humidity = float(rng.uniform(30, 95))
+            precipitation = float(rng.choice([0.0, 0.0, 1.5]))
+            db.add(MlPrediction(
+                city_id=city_id,
+                predicted_at=anchor + timedelta(hours=index),
+                target_time=anchor + timedelta(hours=index + 3),
+                lead_hours=3,
+                predicted_temp=forecast_temp,
+                forecast_temp=forecast_temp,
+                humidity=humidity,
+                forecast_cloud_cover=80.0 if precipitation else 20.0,
+                forecast_precipitation=precipitation,
+                verified=True,
+                verified_at=anchor + timedelta(hours=index + 3, minutes=45),
+                actual_temp=forecast_temp + 0.8 * city_id,
+                error=0.8 * city_id + float(rng.normal(0, 0.2)),
+                actual_precipitation=precipitation if rng.random() > 0.1 else 0.0,
+                actual_cloud_cover=80.0 if precipitation else 20.0,
+            ))
+        db.commit()
+
+
+def _isolate_model_state(monkeypatch):
+    for name in ("_pipeline", "_rain_pipeline", "_condition_pipeline", "_scorer", "_rain_scorer", "_condition_scorer"):
+        monkeypatch.setattr(ml_model, name, None)
+    monkeypatch.setattr(ml_model, "_region_codebook", {})
+    monkeypatch.setattr(ml_model, "_incremental_state", None)
+    monkeypatch.setattr(ml_model, "_latest_summary", dict(ml_model._latest_summary))
+    monkeypatch.setattr(ml_model, "refresh_stats", lambda: {})
+
+
+def test_train_persists_region_codebook_with_the_model(tmp_path, monkeypatch):
+    session_factory = _seed_training_db(tmp_path, monkeypatch)
+    _isolate_model_state(monkeypatch)
+
+    result = ml_model.train(min_samples=100)
+
+    assert result["success"] is True
+    assert ml_model._region_codebook == {"Lazio": 0, "Puglia": 1, "Toscana": 2}
+    with session_factory() as db:
+        stored = pickle.loads(db.query(MlModelStore).one().model_bytes)
+    assert stored["region_codebook"] == ml_model._region_codebook
+    assert stored["regions"] == ["Lazio", "Puglia", "Toscana"]
+
+
+def test_training_loader_streams_sorted_columns_with_defaults(tmp_path, monkeypatch):
+    session_factory = _seed_training_db(tmp_path, monkeypatch, n_rows=30)
+    anchor = datetime(2026, 3, 1, tzinfo=timezone.utc)
+    with session_factory() as db:
+        db.add(City(id=9, name="Senza regione", name_lower="senza regione", lat=44.0, lon=11.0))
+        db.add(MlPrediction(
+            city_id=9,
+            predicted_at=anchor,
+            target_time=None,
+            lead_hours=None,
+            predicted_temp=9.0,
+            forecast_temp=None,
+            humidity=None,
+            forecast_cloud_cover=0.0,
+            forecast_wind_direction=370.0,
+            verified=True,
+            actual_temp=10.0,
+            error=1.0,
+        ))
+        db.commit()
+
+        columns = ml_model._load_training_columns(db, chunk_size=7)
+        rows = db.query(MlPrediction).filter(MlPrediction.verified.is_(True)).count()
+
+    assert len(columns["error"]) == rows == 31
+    assert columns["region"][0] == "Sconosciuta"
+    assert columns["forecast_temp"][0] == 9.0
+    assert columns["humidity"][0] == 50.0 and columns["cloud_cover"][0] == 50.0
+    assert columns["lead_hours"][0] == 0.0 and columns["forecast_wind_direction"][0] == 10.0
+    assert columns["hour"][0] == 0 and columns["month"][0] == 3
+    assert np.isnan(columns["actual_precipitation"][0])
+    assert columns["month"][1:].tolist() == [4.0] * 30
+    assert columns["hour"][1:].tolist() == [float((index + 3) % 24) for index in range(30)]
+
+
+def test_condition_codes_match_row_wise_rules():
+    cases = [
+        (None, None, None), (61, 10.0, 0.0), (None, 20.0, 0.2), (0, None, None), (2, None, 0.0),
+        (3, None, 0.1), (None, 25.0, None), (None, 60.0, 0.0), (1, 61.0, 0.15), (95, None, None),
+    ]
+    weather_code, cloud_cover, precipitation = (np.array(column, dtype=float) for column in zip(*cases))
+
+    codes = ml_model._condition_codes(weather_code, cloud_cover, precipitation)
+
+    expected = [
+        ml_model.CONDITION_TO_CODE[ml_model._condition_from_inputs(
+            weather_code=code, cloud_cover=cloud, precipitation=rain
+        )]
+        for code, cloud, rain in cases
+    ]
+    assert codes.tolist() == expected
+
+
+def test_train_incremental_absorbs_only_newly_verified_rows(tmp_path, monkeypatch):
+    session_factory = _seed_training_db(tmp_path, monkeypatch, n_rows=400)
+    _isolate_model_state(monkeypatch)
+
+    assert ml_model.train_incremental()["skipped"] is True
+    assert ml_model.train(min_samples=100)["success"] is True
+    assert ml_model.train_incremental()["skipped"] is True
+
+    # Troppo poche righe per un holdout: il cursore resta fermo e le righe si accumulano
+    _add_verified_predictions(session_factory, range(400, 405), seed=12)
+    assert ml_model.train_incremental()["skipped"] is True
+    _add_verified_predictions(session_factory, range(405, 460), seed=13)
+    result = ml_model.train_incremental()
+
+    # 48 righe aggiornano i modelli, le ultime 12 li valutano
+    assert result["success"] is True
+    assert result["n_new"] == 60 and result["n_holdout"] == 12 and result["n_samples"] == 448
+    assert ml_model._incremental_state["updates"] == 1
+    assert ml_model._scorer is not None
+    assert ml_model.train_incremental()["skipped"] is True
+
+    with session_factory() as db:
+        records = db.query(MlModelStore).order_by(MlModelStore.trained_at).all()
+        columns = ml_model._load_training_columns(db, verified_after=datetime(2026, 4, 17, 18, 45, tzinfo=timezone.utc))
+    assert len(records) == 2 and records[-1].n_samples == 448
+    assert len(columns["error"]) == 60
+
+    # Le metriche salvate sono quelle delle pipeline promosse, misurate sull'holdout
+    columns["region_code"] = ml_model._encode_region_column(columns["region"], ml_model._region_codebook)
+    _, holdout = ml_model._split_columns(columns)
+    X_hold, y_hold = ml_model._build_temperature_matrices(holdout)
+    assert records[-1].mae == result["mae"] == ml_model.get_public_summary()["model_mae"]
+    assert np.isclose(result["mae"], np.mean(np.abs(y_hold - ml_model._pipeline.predict(X_hold))))
+    X_rain, y_rain = ml_model._build_rain_matrices(holdout)
+    assert np.isclose(
+        ml_model.get_public_summary()["rain_accuracy"],
+        np.mean(ml_model._rain_pipeline.predict(X_rain) == y_rain),
+    )
+
+    # Gli aggiornamenti successivi riscrivono il record incrementale invece di accumularne
+    _add_verified_predictions(session_factory, range(460, 520), seed=14)
+    assert ml_model.train_incremental()["n_samples"] == 496
+    with session_factory() as db:
+        records = db.query(MlModelStore).order_by(MlModelStore.trained_at).all()
+    assert len(records) == 2 and records[-1].n_samples == 496
+    assert pickle.loads(records[-1].model_bytes)["incremental"]["updates"] == 2
+    assert pickle.loads(records[0].model_bytes)["incremental"]["updates"] == 0
+
+    full_trained_at = ml_model.last_full_training()
+    monkeypatch.setattr(ml_model, "_incremental_state", None)
+    assert ml_model.load_latest_model() is True
+    assert ml_model._incremental_state["ridge"].n_samples == 496
+    assert ml_model.last_full_training() == full_trained_at
@@ -0,0 +1,133 @@
+"""Test verifica previsioni del ciclo orario."""
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import scheduler
+import weather_service
+from database import Base, City, MlPrediction
+
+
+def _seed(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'verify.db'}")
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+    monkeypatch.setattr(scheduler, "SessionLocal", session_factory)
+
+    anchor = datetime(2026, 4, 4, 10, 0, tzinfo=timezone.utc)
+    with session_factory() as db:
+        for city_id in (1, 2, 3):
+            db.add(City(id=city_id, name=f"C{city_id}", name_lower=f"c{city_id}", lat=41.0, lon=12.0))
+            for lead in (1, 2):
+                db.add(MlPrediction(
+                    city_id=city_id,
+                    predicted_at=anchor,
+                    target_time=anchor + timedelta(hours=lead),
+                    lead_hours=lead,
+                    predicted_temp=15.0,
+                    forecast_temp=15.0,
+                    verified=False,
+                ))
+        db.commit()
+
+    observations = [
+        {"city_id": city_id, "observed_at": anchor + timedelta(hours=1, minutes=5), "temp": 16.5, "precipitation": 0.2}
+        for city_id in (1, 2)
+    ]
+    return session_factory, observations
+
+
+def test_bulk_and_row_verification_report_same_count(tmp_path, monkeypatch):
+    results = {}
+    for bulk in (True, False):
+        path = tmp_path / ("bulk" if bulk else "rows")
+        path.mkdir()
+        session_factory, observations = _seed(path, monkeypatch)
+        results[bulk] = scheduler._db_verify_predictions(observations, bulk=bulk)
+
+        with session_factory() as db:
+            verified = db.query(MlPrediction).filter(MlPrediction.verified.is_(True)).all()
+            assert {row.city_id for row in verified} == {1, 2}
+            assert all(row.error == 1.5 and row.actual_precipitation == 0.2 for row in verified)
+
+    assert results[True] == results[False] == (2, 1.5)
+
+
+def test_bulk_verification_is_idempotent(tmp_path, monkeypatch):
+    _, observations = _seed(tmp_path, monkeypatch)
+
+    assert scheduler._db_verify_predictions(observations)[0] == 2
+    assert scheduler._db_verify_predictions(observations)[0] == 0
+
+
+def test_verification_updates_materialized_error_stats(tmp_path, monkeypatch):
+    session_factory, observations = _seed(tmp_path, monkeypatch)
+    monkeypatch.setattr(scheduler.error_stats, "city_regions", lambda db, ids: {city_id: "Lazio" for city_id in ids})
+
+    scheduler._db_verify_predictions(observations)
+
+    with session_factory() as db:
+        summary = scheduler.error_stats.read_summary(db)
+    assert summary["verified_predictions"] == 2
+    assert summary["avg_error_celsius"] == 1.5
+    assert summary["lead_time_error"] == [{"lead_hours": 1, "avg_abs_error": 1.5}]
+    assert summary["region_error"] == [{"region": "Lazio", "avg_abs_error": 1.5}]
+
+
+def test_prune_drops_cutoff_day_bucket_whole(tmp_path, monkeypatch):
+    session_factory, _ = _seed(tmp_path, monkeypatch)
+    monkeypatch.setattr(scheduler.error_stats, "city_regions", lambda db, ids: {city_id: "Lazio" for city_id in ids})
+    day = datetime(2026, 4, 4, tzinfo=timezone.utc)
+
+    with session_factory() as db:
+        scheduler.error_stats.record_verifications(db, [
+            (1, day - timedelta(hours=1), 1, 2.0),
+            (1, day + timedelta(hours=20), 1, 1.0),
+            (1, day + timedelta(days=1, hours=2), 1, 3.0),
+        ])
+        db.commit()
+
+        # Cutoff a metà giornata: il bucket del 4 aprile esce intero, insieme ai giorni precedenti
+        assert scheduler.error_stats.prune(db, day + timedelta(hours=12)) == 2
+        db.commit()
+        summary = scheduler.error_stats.read_summary(db)
+    assert summary["verified_predictions"] == 1
+    assert summary["avg_error_celsius"] == 3.0
+
+
+def test_column_rows_match_record_rows():
+    cities = [{"id": 1, "name": "Roma"}, {"id": 2, "name": "Milano"}]
+    payload = [
+        {
+            "current": {"time": "2026-04-04T10:20", "temperature_2m": 18.0, "weather_code": 3},
+            "hourly": {
+                "time": [f"2026-04-04T{hour:02d}:00" for hour in range(10, 17)],
+                "temperature_2m": [18.0 + hour for hour in range(7)],
+                "weather_code": [1, 2, 2, None, 3, 3, 61],
+            },
+        },
+        {
+            "current": {"time": "2026-04-04T10:20", "temperature_2m": 11.5, "precipitation": None},
+            "hourly": {"time": ["2026-04-04T10:00", "2026-04-04T11:00"], "temperature_2m": [11.0, 12.0]},
+        },
+    ]
+    batch = weather_service._build_batch_results(cities, payload)
+    columns = batch["columns"]
+
+    observations = scheduler._observation_rows_from_columns(columns["observations"])
+    predictions = scheduler._prediction_rows_from_columns(columns["predictions"])
+    params = scheduler._verification_params_from_columns(columns["observations"])
+
+    assert [row["temp"] for row in observations] == [obs["temp"] for obs in batch["observations"]]
+    assert observations[1]["precipitation"] is None
+    assert [row["target_time"] for row in predictions] == [pred["target_time"] for pred in batch["predictions"]]
+    assert [row["weather_code"] for row in predictions] == [2, 2, None, 3, 3, 61, None]
+    assert all(type(row["weather_code"]) is int for row in predictions if row["weather_code"] is not None)
+    assert predictions[0]["hour"] == 11 and predictions[0]["forecast_source"] == "open-meteo"
+    assert params == [scheduler._verification_params(obs) for obs in batch["observations"]]
@@ -11,6 +11,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from main import app
 from database import get_db
+import weather_service
 
 
 client = TestClient(app)
@@ -85,19 +86,7 @@ def test_weather_includes_ml_block(monkeypatch):
         }
 
     monkeypatch.setattr(weather_module, "fetch_single_city", fake_fetch_single_city)
-    monkeypatch.setattr(weather_module.ml_model, "predict_correction", lambda **kwargs: {
-        "model_ready": True,
-        "correction": 0.4,
-        "corrected_temp": 20.4,
-        "confidence": "media",
-    })
-    monkeypatch.setattr(weather_module.ml_model, "predict_rain_probability", lambda **kwargs: {
-        "model_ready": True,
-        "rain_probability": 0.25,
-        "will_rain": False,
-        "confidence": "media",
-    })
-    monkeypatch.setattr(weather_module.ml_model, "build_daily_insight", lambda **kwargs: {
+    daily_insight = {
         "expected_condition": "sereno",
         "display_condition": "Cielo sereno",
         "condition_confidence": "alta",
@@ -108,7 +97,28 @@ def test_weather_includes_ml_block(monkeypatch):
         "adjusted_temp_range": {"min": 11.4, "max": 21.4},
         "summary": "Cielo sereno con basso rischio di pioggia.",
         "badge": "Scenario stabile",
-    })
+    }
+    insight_calls = []
+
+    def fake_build_forecast_insights(*, current, days, lat, region, lead_hours):
+        insight_calls.append((current, len(days), lead_hours))
+        return {
+            "correction": {
+                "model_ready": True,
+                "correction": 0.4,
+                "corrected_temp": 20.4,
+                "confidence": "media",
+            },
+            "rain_prediction": {
+                "model_ready": True,
+                "rain_probability": 0.25,
+                "will_rain": False,
+                "confidence": "media",
+            },
+            "daily": [dict(daily_insight) for _ in days],
+        }
+
+    monkeypatch.setattr(weather_module.ml_model, "build_forecast_insights", fake_build_forecast_insights)
     monkeypatch.setattr(weather_module.ml_model, "get_public_summary", lambda: {"model_ready": True})
     monkeypatch.setattr(weather_module.ml_model, "get_stats", lambda: {"verified_predictions": 12, "lead_time_error": []})
 
@@ -127,3 +137,94 @@ def test_weather_includes_ml_block(monkeypatch):
     assert data["daily"][0]["ml"]["adjusted_temp_range"]["max"] == 21.4
     assert len(data["daily"]) == 8
     assert data["daily"][-1]["ml"]["badge"] == "Scenario stabile"
+    assert data["freshness"]["status"] in {"fresh", "stale"}
+    assert response.headers["Cache-Control"].startswith("public, max-age=")
+    assert "stale-while-revalidate=" in response.headers["Cache-Control"]
+    assert len(insight_calls) == 1
+    current, n_days, lead_hours = insight_calls[0]
+    assert current["forecast_temp"] == 20
+    assert n_days == 8
+    assert lead_hours[:2] == [14, 38]
+
+
+def test_weather_serves_comuni_from_hourly_snapshot(monkeypatch):
+    fake_city = SimpleNamespace(
+        id=77,
+        name="Milano",
+        region="Lombardia",
+        province="MI",
+        lat=45.46,
+        lon=9.19,
+        locality_type="comune",
+        name_lower="milano",
+    )
+
+    class FakeQuery:
+        def filter(self, *args, **kwargs):
+            return self
+
+        def order_by(self, *args, **kwargs):
+            return self
+
+        def first(self):
+            return fake_city
+
+    class FakeDb:
+        def query(self, *args, **kwargs):
+            return FakeQuery()
+
+    def override_get_db():
+        yield FakeDb()
+
+    snapshot = {
+        "latitude": 45.46,
+        "longitude": 9.19,
+        "current": {"temperature_2m": 14, "apparent_temperature": 13, "weather_code": 3},
+        "hourly": {"time": ["2026-04-04T12:00"], "temperature_2m": [14], "weather_code": [3]},
+        "daily": {
+            "time": ["2026-04-04"],
+            "temperature_2m_min": [8],
+            "temperature_2m_max": [16],
+            "weather_code": [3],
+        },
+    }
+
+    async def unexpected_fetch(lat, lon):
+        raise AssertionError("i comuni non devono chiamare l'upstream")
+
+    monkeypatch.setattr(weather_module.forecast_snapshots, "lookup", lambda city_id: (snapshot, 600.0))
+    monkeypatch.setattr(weather_module, "fetch_single_city", unexpected_fetch)
+
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        response = client.get("/api/weather?city=Milano&include_ml=false")
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["current"]["temp"] == 14
+    assert data["freshness"] == {
+        "status": "fresh",
+        "age_seconds": 600,
+        "max_age_seconds": 3600,
+        "stale_while_revalidate_seconds": 3600,
+        "source": "snapshot",
+    }
+    assert response.headers["Age"] == "600"
+    assert "max-age=3000" in response.headers["Cache-Control"]
+
+
+def test_ready_reports_upstream_breakers(monkeypatch):
+    main_module = importlib.import_module("main")
+    breaker = weather_service.CircuitBreaker("open-meteo", min_calls=1)
+    breaker.record_failure()
+    monkeypatch.setitem(weather_service._breakers, "open-meteo", breaker)
+    monkeypatch.setattr(main_module, "db_healthcheck", lambda: True)
+    monkeypatch.setattr(main_module.ml_model, "get_public_summary", lambda: {"model_ready": False})
+
+    data = client.get("/ready").json()
+
+    assert data["status"] == "degraded"
+    assert data["upstreams"]["open-meteo"]["state"] == "open"
+    assert data["upstreams"]["met.no"]["state"] == "closed"
@@ -0,0 +1,228 @@
+"""Test cache LRU/TTL delle previsioni pubbliche e dei backend condivisi."""
+import socketserver
+import threading
+import sys
+import os
+
+import pytest
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from database import PublicWeatherCacheEntry
+from weather_cache import (
+    BoundedTTLCache,
+    RedisCacheBackend,
+    RequestFrequency,
+    SharedCacheBackend,
+    SqlCacheBackend,
+    decode_payload,
+    encode_payload,
+    payload_size,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_evicts_least_recently_used_entry():
+    cache = BoundedTTLCache(ttl_seconds=60, max_entries=2, clock=FakeClock())
+    cache.set("roma", {"t": 1})
+    cache.set("milano", {"t": 2})
+    assert cache.get("roma") == {"t": 1}
+
+    cache.set("napoli", {"t": 3})
+
+    assert cache.get("milano") is None
+    assert cache.get("roma") == {"t": 1} and cache.get("napoli") == {"t": 3}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_byte_budget_bounds_total_payload_size():
+    payload = {"hourly": list(range(100))}
+    size = payload_size(payload)
+    cache = BoundedTTLCache(ttl_seconds=60, max_entries=100, max_bytes=size * 3, clock=FakeClock())
+
+    for index in range(5):
+        cache.set(index, payload)
+    cache.set("enorme", {"hourly": list(range(1000))})
+
+    stats = cache.stats()
+    assert stats["entries"] == 3 and stats["bytes"] == size * 3
+    assert cache.get(0) is None and cache.get(4) == payload
+    assert cache.get("enorme") is None
+
+
+def test_expired_entries_are_swept_and_counted():
+    clock = FakeClock()
+    cache = BoundedTTLCache(ttl_seconds=60, clock=clock)
+    cache.set("roma", {"t": 1})
+    clock.now += 30
+    cache.set("milano", {"t": 2})
+    clock.now += 31
+
+    assert cache.sweep() == 1
+    assert cache.get("milano") == {"t": 2}
+    clock.now += 60
+    assert cache.get("milano") is None
+
+    stats = cache.stats()
+    assert stats["expirations"] == 2
+    assert stats["entries"] == 0 and stats["bytes"] == 0
+    assert stats["hits"] == 1 and stats["misses"] == 1 and stats["hit_ratio"] == 0.5
+
+
+def test_request_frequency_decays_and_ranks_recent_traffic():
+    clock = FakeClock()
+    tracker = RequestFrequency(half_life_seconds=100, max_keys=10, clock=clock)
+    for _ in range(8):
+        tracker.record("roma")
+    clock.now += 200
+    for _ in range(3):
+        tracker.record("milano")
+
+    ranked = tracker.top(2)
+
+    assert [key for key, _ in ranked] == ["milano", "roma"]
+    assert ranked[0][1] == 3 and ranked[1][1] == 2
+
+
+def test_request_frequency_prunes_coldest_keys():
+    clock = FakeClock()
+    tracker = RequestFrequency(half_life_seconds=100, max_keys=10, clock=clock)
+    tracker.record("caldo", weight=50)
+    for index in range(10):
+        tracker.record(f"freddo-{index}")
+
+    assert len(tracker) == 9
+    assert tracker.top(1)[0][0] == "caldo"
+
+
+def test_payload_format_roundtrip_is_compact():
+    payload = {"hourly": {"temperature_2m": [12.5] * 384, "time": ["2026-10-17T00:00"] * 384}}
+
+    blob = encode_payload(payload, 1234.5)
+
+    assert decode_payload(blob) == (payload, 1234.5)
+    assert len(blob) < payload_size(payload) / 5
+    with pytest.raises(ValueError):
+        decode_payload(b"\x09" + blob[1:])
+
+
+def test_set_with_age_keeps_original_freshness():
+    clock = FakeClock()
+    cache = BoundedTTLCache(ttl_seconds=60, stale_seconds=60, clock=clock)
+
+    cache.set("roma", {"t": 1}, age=90)
+
+    assert cache.get("roma") is None
+    assert cache.stats()["misses"] == 1 and cache.stats()["stale_hits"] == 0
+    assert cache.lookup("roma") == ({"t": 1}, 90)
+    assert cache.stats()["stale_hits"] == 1
+
+
+def test_sql_backend_shares_entries_and_sweeps_expired_rows():
+    clock = FakeClock()
+    engine = create_engine("sqlite://")
+    PublicWeatherCacheEntry.__table__.create(engine)
+    writer = SqlCacheBackend(engine, clock=clock)
+    reader = SqlCacheBackend(engine, clock=clock)
+
+    writer.set("41.9000,12.5000", {"t": 1}, ttl_seconds=60)
+    writer.set("41.9000,12.5000", {"t": 2}, ttl_seconds=60)
+    writer.set("45.4600,9.1900", {"t": 3}, ttl_seconds=10)
+    clock.now += 20
+
+    assert reader.get("41.9000,12.5000") == ({"t": 2}, 20)
+    assert reader.get("45.4600,9.1900") is None
+    assert reader.sweep() == 1
+    reader.delete("41.9000,12.5000")
+    assert reader.get("41.9000,12.5000") is None
+
+
+def test_shared_backend_without_required_methods_fails_at_construction():
+    class WriteOnlyBackend(SharedCacheBackend):
+        def set(self, key, payload, *, ttl_seconds):
+            pass
+
+    with pytest.raises(TypeError):
+        WriteOnlyBackend()
+
+
+class _RedisStandIn(socketserver.ThreadingTCPServer):
+    """Server RESP minimale in memoria: GET, SET [PX], DEL, PING."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _RedisHandler)
+        self.data = {}
+        self.commands = []
+
+
+class _RedisHandler(socketserver.StreamRequestHandler):
+    def _read_command(self):
+        header = self.rfile.readline()
+        if not header:
+            return None
+        args = []
+        for _ in range(int(header[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            name = args[0].decode().upper()
+            self.server.commands.append(name)
+            if name == "PING":
+                self.wfile.write(b"+PONG\r\n")
+            elif name == "SET":
+                self.server.data[args[1]] = args[2]
+                self.wfile.write(b"+OK\r\n")
+            elif name == "GET":
+                value = self.server.data.get(args[1])
+                self.wfile.write(b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value))
+            elif name == "DEL":
+                removed = self.server.data.pop(args[1], None) is not None
+                self.wfile.write(b":%d\r\n" % removed)
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+@pytest.fixture
+def redis_stand_in():
+    server = _RedisStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_redis_backend_roundtrip_against_local_stand_in(redis_stand_in):
+    clock = FakeClock()
+    host, port = redis_stand_in.server_address
+    writer = RedisCacheBackend(f"redis://{host}:{port}/0", clock=clock)
+    reader = RedisCacheBackend(f"redis://{host}:{port}/0", clock=clock)
+
+    assert writer.ping()
+    writer.set("41.9000,12.5000", {"current": {"temperature_2m": 18.2}}, ttl_seconds=1200)
+    clock.now += 30
+
+    assert reader.get("41.9000,12.5000") == ({"current": {"temperature_2m": 18.2}}, 30)
+    assert reader.get("45.4600,9.1900") is None
+    reader.delete("41.9000,12.5000")
+    assert writer.get("41.9000,12.5000") is None
+    assert list(redis_stand_in.data) == []
+    writer.close()
+    reader.close()
@@ -1,5 +1,7 @@
 """Test costruzione dataset forecast target-based."""
 import asyncio
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
 
 import sys
@@ -9,6 +11,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 import httpx
 
+import weather_cache
 import weather_service
 from weather_service import _build_batch_results, _fetch_open_meteo_payload
 
@@ -354,3 +357,709 @@ def test_format_weather_for_frontend_preserves_sixteen_daily_entries():
     assert result is not None
     assert len(result["daily"]) == weather_service.PUBLIC_FORECAST_DAYS
     assert result["daily"][-1]["dt"] == "2026-04-19"
+
+
+def _batch_payload(current_time: str, count: int) -> list[dict]:
+    return [
+        {
+            "current": {"time": current_time, "temperature_2m": 15.0 + index},
+            "hourly": {"time": [current_time], "temperature_2m": [15.0 + index]},
+        }
+        for index in range(count)
+    ]
+
+
+def test_fetch_all_cities_weather_requeues_rate_limited_batches(monkeypatch):
+    monkeypatch.setattr(weather_service, "BATCH_SIZE", 2)
+    cities = [{"id": index, "name": f"C{index}", "lat": 40 + index, "lon": 12.0} for index in range(6)]
+    calls = []
+
+    class FakeResponse:
+        def __init__(self, status_code, payload):
+            self.status_code = status_code
+            self._payload = payload
+
+        def raise_for_status(self):
+            if self.status_code >= 400:
+                raise httpx.HTTPStatusError(
+                    "rate limited",
+                    request=httpx.Request("GET", weather_service.OPEN_METEO_URL),
+                    response=self,
+                )
+
+        def json(self):
+            return self._payload
+
+    class FakeClient:
+        async def get(self, url, params, timeout):
+            calls.append(params["latitude"])
+            count = len(params["latitude"].split(","))
+            if len(calls) == 1:
+                return FakeResponse(429, None)
+            return FakeResponse(200, _batch_payload("2026-04-04T10:00", count))
+
+    async def no_sleep(_seconds):
+        return None
+
+    limiter = weather_service.AdaptiveRateLimiter(rate=100.0, max_rate=100.0, sleep=no_sleep)
+    result = asyncio.run(
+        weather_service.fetch_all_cities_weather(cities, client=FakeClient(), limiter=limiter, concurrency=2)
+    )
+
+    assert len(result["columns"]["observations"]["city_id"]) == 6
+    assert "observations" not in result
+    assert result["stats"]["completed_batches"] == 3
+    assert result["stats"]["requeued_batches"] == 1
+    assert result["stats"]["completion_ratio"] == 1.0
+    assert len(calls) == 4
+
+
+def test_fetch_all_cities_weather_requeues_failed_batches_without_raising_rate(monkeypatch):
+    monkeypatch.setattr(weather_service, "BATCH_SIZE", 2)
+    # Breaker che non scatta: qui si verifica solo la rimessa in coda
+    breaker = weather_service.CircuitBreaker("open-meteo", min_calls=100)
+    monkeypatch.setitem(weather_service._breakers, "open-meteo", breaker)
+    cities = [{"id": index, "name": f"C{index}", "lat": 40 + index, "lon": 12.0} for index in range(4)]
+    calls = []
+
+    class FakeResponse:
+        def __init__(self, status_code, payload):
+            self.status_code = status_code
+            self._payload = payload
+
+        def raise_for_status(self):
+            if self.status_code >= 400:
+                raise httpx.HTTPStatusError(
+                    "server error",
+                    request=httpx.Request("GET", weather_service.OPEN_METEO_URL),
+                    response=self,
+                )
+
+        def json(self):
+            return self._payload
+
+    class FakeClient:
+        async def get(self, url, params, timeout):
+            calls.append(params["latitude"])
+            if params["latitude"].startswith("40"):
+                return FakeResponse(503, None)
+            return FakeResponse(200, _batch_payload("2026-04-04T10:00", 2))
+
+    async def no_sleep(_seconds):
+        return None
+
+    limiter = weather_service.AdaptiveRateLimiter(rate=1.0, max_rate=100.0, increase=1.0, sleep=no_sleep)
+    result = asyncio.run(
+        weather_service.fetch_all_cities_weather(cities, client=FakeClient(), limiter=limiter, concurrency=1)
+    )
+
+    stats = result["stats"]
+    assert stats["completed_batches"] == 1
+    assert stats["failed_batches"] == 1
+    assert stats["requeued_batches"] == weather_service.BATCH_MAX_ATTEMPTS - 1
+    assert stats["completion_ratio"] == 0.5
+    assert len(calls) == weather_service.BATCH_MAX_ATTEMPTS + 1
+    # Solo il batch riuscito alza il rate
+    assert limiter.rate == 2.0
+
+
+def test_fetch_all_cities_weather_survives_unexpected_batch_errors(monkeypatch):
+    monkeypatch.setattr(weather_service, "BATCH_SIZE", 1)
+    monkeypatch.setitem(weather_service._breakers, "open-meteo", weather_service.CircuitBreaker("open-meteo"))
+    cities = [{"id": index, "name": f"C{index}", "lat": 40 + index, "lon": 12.0} for index in range(3)]
+
+    class FakeResponse:
+        def raise_for_status(self):
+            return None
+
+        def json(self):
+            return _batch_payload("2026-04-04T10:00", 1)
+
+    class FakeClient:
+        async def get(self, url, params, timeout):
+            return FakeResponse()
+
+    def broken_store_batch(batch, payload):
+        if batch[0]["id"] == 1:
+            raise RuntimeError("snapshot rotto")
+
+    async def no_sleep(_seconds):
+        return None
+
+    monkeypatch.setattr(weather_service.forecast_snapshots, "store_batch", broken_store_batch)
+    limiter = weather_service.AdaptiveRateLimiter(rate=100.0, max_rate=100.0, sleep=no_sleep)
+    result = asyncio.run(asyncio.wait_for(
+        weather_service.fetch_all_cities_weather(cities, client=FakeClient(), limiter=limiter, concurrency=1),
+        timeout=5,
+    ))
+
+    assert result["stats"]["completed_batches"] == 2
+    assert result["stats"]["failed_batches"] == 1
+    assert result["columns"]["observations"]["city_id"].tolist() == [0, 2]
+
+
+def test_adaptive_rate_limiter_applies_aimd():
+    limiter = weather_service.AdaptiveRateLimiter(
+        rate=2.0,
+        min_rate=0.5,
+        max_rate=3.0,
+        increase=0.5,
+        decrease_on_429=0.5,
+        latency_target=1.0,
+    )
+
+    limiter.record_success(0.2)
+    assert limiter.rate == 2.5
+    limiter.record_rate_limited()
+    assert limiter.rate == 1.25
+    limiter.record_success(5.0)
+    assert limiter.rate == 1.0
+    for _ in range(10):
+        limiter.record_success(0.1)
+    assert limiter.rate == 3.0
+
+
+def test_extract_batch_columns_uses_hour_offsets_and_skips_missing_values():
+    cities = [{"id": 7}, {"id": 8}]
+    payload = [
+        {
+            "current": {"time": "2026-04-04T10:15", "temperature_2m": 18.0, "weather_code": 3},
+            "hourly": {
+                "time": [f"2026-04-04T{hour:02d}:00" for hour in range(9, 17)],
+                "temperature_2m": [17, 18, 19, None, 21, 22, 23, 24],
+                "weather_code": [1, 1, 2, 2, 3, 61, 61, 61],
+            },
+        },
+        {
+            "current": {"time": "2026-04-04T10:00", "temperature_2m": None},
+            "hourly": {
+                "time": ["2026-04-04T10:00", "2026-04-04T11:00", "2026-04-04T13:00"],
+                "temperature_2m": [10, 11, 13],
+            },
+        },
+    ]
+
+    columns = weather_service._extract_batch_columns(cities, payload)
+    predictions = columns["predictions"]
+
+    assert predictions["city_id"].tolist() == [7, 7, 7, 7, 7, 8, 8]
+    assert predictions["lead_hours"].tolist() == [1, 3, 4, 5, 6, 1, 3]
+    assert predictions["forecast_temp"].tolist() == [19, 21, 22, 23, 24, 11, 13]
+    assert columns["observations"]["city_id"].tolist() == [7]
+
+    result = _build_batch_results(cities, payload)
+    first = result["predictions"][0]
+    assert first["target_time"] == datetime(2026, 4, 4, 11, 0, tzinfo=timezone.utc)
+    assert first["predicted_at"] == datetime(2026, 4, 4, 10, 0, tzinfo=timezone.utc)
+    assert first["forecast_weather_code"] == 2
+    assert first["forecast_cloud_cover"] is None
+    assert result["observations"][0]["precipitation"] == 0.0
+
+
+def test_concat_batch_columns_merges_batches():
+    payload = [{
+        "current": {"time": "2026-04-04T10:00", "temperature_2m": 12.0},
+        "hourly": {"time": ["2026-04-04T10:00", "2026-04-04T11:00"], "temperature_2m": [12, 13]},
+    }]
+    first = weather_service._extract_batch_columns([{"id": 1}], payload)
+    second = weather_service._extract_batch_columns([{"id": 2}], payload)
+
+    merged = weather_service.concat_batch_columns([first, weather_service._empty_batch_columns(), second])
+
+    assert merged["observations"]["city_id"].tolist() == [1, 2]
+    assert merged["predictions"]["city_id"].tolist() == [1, 2]
+
+
+def test_fetch_single_city_coalesces_concurrent_misses(monkeypatch):
+    weather_service._public_weather_cache.clear()
+    calls = []
+    expected = {"current": {}, "hourly": {}, "daily": {}}
+
+    async def fake_fetch(client, *, params, attempt_name):
+        calls.append(attempt_name)
+        await asyncio.sleep(0.01)
+        return expected
+
+    monkeypatch.setattr(weather_service, "_fetch_open_meteo_payload", fake_fetch)
+    monkeypatch.setattr(weather_service, "_single_flight_stats", {"leaders": 0, "coalesced": 0})
+
+    async def scenario():
+        return await asyncio.gather(*(
+            weather_service.fetch_single_city(41.9, 12.5 + offset)
+            for offset in (0.0, 0.0, 0.00001, 0.0, 1.0)
+        ))
+
+    results = asyncio.run(scenario())
+
+    assert results == [expected] * 5
+    assert calls == ["rich", "rich"]
+    assert weather_service.get_single_flight_stats() == {"leaders": 2, "coalesced": 3, "inflight": 0}
+
+
+def test_cancelled_waiter_does_not_cancel_shared_fetch(monkeypatch):
+    weather_service._public_weather_cache.clear()
+    expected = {"current": {}, "hourly": {}, "daily": {}}
+
+    async def fake_fetch(client, *, params, attempt_name):
+        await asyncio.sleep(0.02)
+        return expected
+
+    monkeypatch.setattr(weather_service, "_fetch_open_meteo_payload", fake_fetch)
+
+    async def scenario():
+        leader = asyncio.create_task(weather_service.fetch_single_city(41.9, 12.5))
+        follower = asyncio.create_task(weather_service.fetch_single_city(41.9, 12.5))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(scenario()) == expected
+    assert weather_service._get_cached_public_weather(41.9, 12.5) == expected
+
+
+def test_fetch_single_city_serves_stale_and_refreshes_in_background(monkeypatch):
+    clock = [0.0]
+    cache = weather_service.BoundedTTLCache(
+        ttl_seconds=weather_service.PUBLIC_CACHE_TTL_SECONDS,
+        stale_seconds=weather_service.PUBLIC_CACHE_STALE_SECONDS,
+        clock=lambda: clock[0],
+    )
+    monkeypatch.setattr(weather_service, "_public_weather_cache", cache)
+    old = {"current": {"temperature_2m": 10}, "hourly": {}, "daily": {}}
+    new = {"current": {"temperature_2m": 12}, "hourly": {}, "daily": {}}
+    calls = []
+
+    async def fake_fetch(client, *, params, attempt_name):
+        calls.append(attempt_name)
+        await asyncio.sleep(0.01)
+        return new
+
+    monkeypatch.setattr(weather_service, "_fetch_open_meteo_payload", fake_fetch)
+    weather_service._set_cached_public_weather(41.9, 12.5, old)
+    clock[0] = weather_service.PUBLIC_CACHE_TTL_SECONDS + 60
+
+    async def scenario():
+        served = await weather_service.fetch_single_city(41.9, 12.5)
+        freshness = weather_service.get_public_freshness(41.9, 12.5)
+        assert calls == []
+        await asyncio.gather(*weather_service._inflight_fetches.values())
+        return served, freshness
+
+    served, freshness = asyncio.run(scenario())
+
+    assert served == old
+    assert freshness["status"] == "stale" and freshness["age_seconds"] == weather_service.PUBLIC_CACHE_TTL_SECONDS + 60
+    assert calls == ["rich"]
+    assert weather_service._get_cached_public_weather(41.9, 12.5) == new
+    assert weather_service.get_public_freshness(41.9, 12.5)["status"] == "fresh"
+
+
+def test_fetch_single_city_blocks_once_stale_window_is_over(monkeypatch):
+    clock = [0.0]
+    cache = weather_service.BoundedTTLCache(ttl_seconds=300, stale_seconds=900, clock=lambda: clock[0])
+    monkeypatch.setattr(weather_service, "_public_weather_cache", cache)
+    expected = {"current": {}, "hourly": {}, "daily": {}}
+
+    async def fake_fetch(client, *, params, attempt_name):
+        return expected
+
+    monkeypatch.setattr(weather_service, "_fetch_open_meteo_payload", fake_fetch)
+    weather_service._set_cached_public_weather(41.9, 12.5, {"vecchio": True})
+    clock[0] = 1200
+
+    assert asyncio.run(weather_service.fetch_single_city(41.9, 12.5)) == expected
+
+
+def test_fetch_single_city_reads_entries_written_by_another_worker(monkeypatch):
+    class FakeSharedBackend(weather_service.SharedCacheBackend):
+        name = "fake"
+
+        def __init__(self):
+            self.blobs = {}
+
+        def get(self, key):
+            if key not in self.blobs:
+                return None
+            payload, _ = weather_cache.decode_payload(self.blobs[key])
+            return payload, 120.0
+
+        def set(self, key, payload, *, ttl_seconds):
+            self.blobs[key] = weather_cache.encode_payload(payload, 0.0)
+
+        def delete(self, key):
+            self.blobs.pop(key, None)
+
+    shared = FakeSharedBackend()
+    monkeypatch.setattr(weather_service, "_shared_public_cache", shared)
+    weather_service._public_weather_cache.clear()
+    expected = {"current": {"temperature_2m": 18}, "hourly": {}, "daily": {}}
+    calls = []
+
+    async def fake_fetch(client, *, params, attempt_name):
+        calls.append(attempt_name)
+        return expected
+
+    monkeypatch.setattr(weather_service, "_fetch_open_meteo_payload", fake_fetch)
+
+    # Worker A scarica e pubblica nel livello condiviso; worker B parte con la LRU vuota
+    assert asyncio.run(weather_service.fetch_single_city(41.9, 12.5)) == expected
+    weather_service._public_weather_cache.clear()
+
+    assert asyncio.run(weather_service.fetch_single_city(41.9, 12.5)) == expected
+    assert calls == ["rich"]
+    assert list(shared.blobs) == [weather_service._shared_cache_key(weather_service._cache_key(41.9, 12.5))]
+    assert weather_service.get_public_freshness(41.9, 12.5)["age_seconds"] == 120
+    stats = weather_service.get_public_cache_stats()["shared"]
+    assert stats["backend"] == "fake" and stats["hits"] >= 1 and stats["writes"] >= 1
+
+
+def test_warm_public_cache_refreshes_hot_keys_in_one_batch(monkeypatch):
+    clock = [0.0]
+    cache = weather_service.BoundedTTLCache(ttl_seconds=300, stale_seconds=900, clock=lambda: clock[0])
+    monkeypatch.setattr(weather_service, "_public_weather_cache", cache)
+    monkeypatch.setattr(weather_service, "_public_request_frequency", weather_cache.RequestFrequency())
+    monkeypatch.setattr(weather_service, "_shared_public_cache", None)
+
+    for _ in range(5):
+        weather_service.record_public_request(41.9, 12.5)
+        weather_service.record_public_request(45.46, 9.19)
+        weather_service.record_public_request(40.85, 14.27)
+    weather_service.record_public_request(44.49, 11.34)
+
+    weather_service._set_cached_public_weather(41.9, 12.5, {"vecchio": True})
+    clock[0] = 250
+    weather_service._set_cached_public_weather(45.46, 9.19, {"fresco": True})
+    requests = []
+
+    class FakeResponse:
+        def raise_for_status(self):
+            return None
+
+        def json(self):
+            count = len(requests[-1]["latitude"].split(","))
+            return [{"current": {"temperature_2m": index}, "hourly": {}, "daily": {}} for index in range(count)]
+
+    class FakeClient:
+        async def get(self, url, params, timeout, headers):
+            requests.append(params)
+            return FakeResponse()
+
+    @asynccontextmanager
+    async def fake_borrow():
+        yield FakeClient()
+
+    monkeypatch.setattr(weather_service.http_pool, "borrow_client", fake_borrow)
+
+    result = asyncio.run(weather_service.warm_public_cache())
+
+    # Roma è vicina alla scadenza, Napoli non è in cache, Milano è fresca, Bologna è fredda
+    assert result == {"due": 2, "refreshed": 2, "batches": 1}
+    assert len(requests) == 1
+    # Coordinate del centro cella, non quelle richieste
+    assert sorted(requests[0]["latitude"].split(",")) == ["40.875", "41.875"]
+    assert requests[0]["daily"] == weather_service.SINGLE_CITY_DAILY_FIELDS
+    assert weather_service._get_cached_public_weather(41.9, 12.5)["current"] is not None
+    assert weather_service._get_cached_public_weather(40.85, 14.27) is not None
+    assert weather_service._get_cached_public_weather(45.46, 9.19) == {"fresco": True}
+
+
+def _fresh_breakers(monkeypatch):
+    for provider in ("open-meteo", "met.no"):
+        monkeypatch.setitem(weather_service._breakers, provider, weather_service.CircuitBreaker(provider))
+
+
+def test_fetch_single_city_hedges_slow_source_and_cancels_it(monkeypatch):
+    weather_service._public_weather_cache.clear()
+    _fresh_breakers(monkeypatch)
+    monkeypatch.setattr(weather_service, "PUBLIC_HEDGE_DELAY_SECONDS", 0.02)
+    expected = {"current": {"temperature_2m": 15}, "hourly": {}, "daily": {}}
+    cancelled = []
+
+    async def fake_fetch(client, *, params, attempt_name):
+        if attempt_name == "rich":
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(attempt_name)
+                raise
+        return expected
+
+    monkeypatch.setattr(weather_service, "_fetch_open_meteo_payload", fake_fetch)
+
+    started = time.monotonic()
+    result = asyncio.run(weather_service.fetch_single_city(41.9, 12.5))
+
+    assert result == expected
+    assert time.monotonic() - started < 1
+    assert cancelled == ["rich"]
+    assert weather_service.get_hedge_stats()["winners"]["compat"] >= 1
+    # La fonte lenta è dello stesso provider che ha risposto: nessun errore sul breaker
+    assert weather_service.get_breaker_states()["open-meteo"]["failures"] == 0
+
+
+def test_fetch_single_city_moves_on_after_stage_deadline(monkeypatch):
+    weather_service._public_weather_cache.clear()
+    _fresh_breakers(monkeypatch)
+    monkeypatch.setattr(weather_service, "PUBLIC_HEDGE_DELAY_SECONDS", 10)
+    monkeypatch.setitem(weather_service.PUBLIC_STAGE_DEADLINES_SECONDS, "rich", 0.02)
+    expected = {"current": {}, "hourly": {}, "daily": {}}
+    calls = []
+
+    async def fake_fetch(client, *, params, attempt_name):
+        calls.append(attempt_name)
+        if attempt_name == "rich":
+            await asyncio.sleep(5)
+        return expected
+
+    monkeypatch.setattr(weather_service, "_fetch_open_meteo_payload", fake_fetch)
+
+    assert asyncio.run(weather_service.fetch_single_city(41.9, 12.5)) == expected
+    assert calls == ["rich", "compat"]
+    assert weather_service.get_breaker_states()["open-meteo"]["failures"] == 1
+
+
+def test_fetch_single_city_respects_overall_deadline(monkeypatch):
+    weather_service._public_weather_cache.clear()
+    _fresh_breakers(monkeypatch)
+    monkeypatch.setattr(weather_service, "PUBLIC_HEDGE_DELAY_SECONDS", 0.01)
+    monkeypatch.setattr(weather_service, "PUBLIC_REQUEST_DEADLINE_SECONDS", 0.1)
+    calls = []
+
+    async def hanging_fetch(client, *, params, attempt_name):
+        calls.append(attempt_name)
+        await asyncio.sleep(5)
+
+    def hanging_urllib_fetch(*, params, attempt_name):
+        calls.append(attempt_name)
+        time.sleep(0.3)
+
+    async def hanging_metno_fetch(lat, lon):
+        calls.append("metno")
+        await asyncio.sleep(5)
+
+    monkeypatch.setattr(weather_service, "_fetch_open_meteo_payload", hanging_fetch)
+    monkeypatch.setattr(weather_service, "_fetch_open_meteo_payload_via_urllib", hanging_urllib_fetch)
+    monkeypatch.setattr(weather_service, "_fetch_metno_payload", hanging_metno_fetch)
+
+    started = time.monotonic()
+    result = asyncio.run(weather_service.fetch_single_city(41.9, 12.5))
+
+    assert result is None
+    assert time.monotonic() - started < 1
+    assert calls == ["rich", "compat", "compat-urllib", "metno"]
+    # Tre fonti Open-Meteo bloccate nella stessa richiesta contano un solo errore
+    breakers = weather_service.get_breaker_states()
+    assert breakers["open-meteo"]["failures"] == 1 and breakers["met.no"]["failures"] == 1
+
+
+def test_hanging_open_meteo_opens_breaker_through_hedging(monkeypatch):
+    weather_service._public_weather_cache.clear()
+    _fresh_breakers(monkeypatch)
+    monkeypatch.setattr(weather_service, "PUBLIC_HEDGE_DELAY_SECONDS", 0.01)
+    expected = {"current": {"temperature_2m": 14}, "hourly": {}, "daily": {}}
+    calls = []
+
+    async def hanging_fetch(client, *, params, attempt_name):
+        calls.append(attempt_name)
+        await asyncio.sleep(5)
+
+    def hanging_urllib_fetch(*, params, attempt_name):
+        calls.append(attempt_name)
+        time.sleep(0.05)
+
+    async def metno_fetch(lat, lon):
+        calls.append("metno")
+        return expected
+
+    monkeypatch.setattr(weather_service, "_fetch_open_meteo_payload", hanging_fetch)
+    monkeypatch.setattr(weather_service, "_fetch_open_meteo_payload_via_urllib", hanging_urllib_fetch)
+    monkeypatch.setattr(weather_service, "_fetch_metno_payload", metno_fetch)
+
+    # Ogni richiesta abbandona le fonti Open-Meteo bloccate e registra un errore: il circuito
+    # si apre dopo BREAKER_MIN_CALLS richieste, non dopo la prima richiesta lenta
+    for index in range(weather_service.BREAKER_MIN_CALLS):
+        assert weather_service.get_breaker_states()["open-meteo"]["state"] == "closed"
+        assert asyncio.run(weather_service.fetch_single_city(40.0 + index, 12.5)) == expected
+    assert weather_service.get_breaker_states()["open-meteo"]["failures"] == weather_service.BREAKER_MIN_CALLS
+    assert weather_service.get_breaker_states()["open-meteo"]["state"] == "open"
+
+    calls.clear()
+    assert asyncio.run(weather_service.fetch_single_city(46.4, 12.5)) == expected
+    assert calls == ["metno"]
+
+
+def test_circuit_breaker_opens_half_opens_and_closes():
+    clock = [0.0]
+    breaker = weather_service.CircuitBreaker(
+        "test", window=10, min_calls=4, failure_rate=0.5, cooldown_seconds=30, clock=lambda: clock[0]
+    )
+    for outcome in (True, False, True, False):
+        breaker.record_success() if outcome else breaker.record_failure()
+
+    assert breaker.state == "open"
+    assert breaker.allow() is False
+
+    clock[0] = 31
+    assert breaker.state == "half_open"
+    assert breaker.allow() is True
+    assert breaker.allow() is False
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.retry_in_seconds() == 30
+
+    clock[0] = 62
+    assert breaker.allow() is True
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.snapshot()["opened"] == 2
+
+
+def test_fetch_single_city_skips_open_meteo_while_breaker_is_open(monkeypatch):
+    weather_service._public_weather_cache.clear()
+    breaker = weather_service.CircuitBreaker("open-meteo", min_calls=1)
+    breaker.record_failure()
+    monkeypatch.setitem(weather_service._breakers, "open-meteo", breaker)
+    monkeypatch.setitem(weather_service._breakers, "met.no", weather_service.CircuitBreaker("met.no"))
+    expected = {"current": {}, "hourly": {}, "daily": {}}
+    calls = []
+
+    async def fake_fetch(client, *, params, attempt_name):
+        calls.append(attempt_name)
+        return expected
+
+    async def fake_metno_fetch(lat, lon):
+        calls.append("metno")
+        return expected
+
+    monkeypatch.setattr(weather_service, "_fetch_open_meteo_payload", fake_fetch)
+    monkeypatch.setattr(weather_service, "_fetch_metno_payload", fake_metno_fetch)
+
+    assert asyncio.run(weather_service.fetch_single_city(41.9, 12.5)) == expected
+    assert calls == ["metno"]
+
+
+def test_stage_timeout_and_own_error_count_once_per_request(monkeypatch):
+    weather_service._public_weather_cache.clear()
+    _fresh_breakers(monkeypatch)
+    monkeypatch.setattr(weather_service, "PUBLIC_HEDGE_DELAY_SECONDS", 10)
+    monkeypatch.setitem(weather_service.PUBLIC_STAGE_DEADLINES_SECONDS, "rich", 0.02)
+    expected = {"current": {}, "hourly": {}, "daily": {}}
+
+    async def failing_fetch(client, *, params, attempt_name):
+        if attempt_name == "rich":
+            await asyncio.sleep(5)
+        weather_service._record_upstream("open-meteo", httpx.ConnectError("connessione rifiutata"))
+        return None
+
+    def failing_urllib_fetch(*, params, attempt_name):
+        weather_service._record_upstream("open-meteo", TimeoutError("timeout"))
+        return None
+
+    async def metno_fetch(lat, lon):
+        weather_service._record_upstream("met.no")
+        return expected
+
+    monkeypatch.setattr(weather_service, "_fetch_open_meteo_payload", failing_fetch)
+    monkeypatch.setattr(weather_service, "_fetch_open_meteo_payload_via_urllib", failing_urllib_fetch)
+    monkeypatch.setattr(weather_service, "_fetch_metno_payload", metno_fetch)
+
+    assert asyncio.run(weather_service.fetch_single_city(41.9, 12.5)) == expected
+    breakers = weather_service.get_breaker_states()
+    assert breakers["open-meteo"]["failures"] == 1
+    assert breakers["met.no"]["successes"] == 1 and breakers["met.no"]["failures"] == 0
+    # Fuori dall'hedging ogni esito continua a contare
+    weather_service._record_upstream("open-meteo", httpx.ConnectError("connessione rifiutata"))
+    assert weather_service.get_breaker_states()["open-meteo"]["failures"] == 2
+
+
+def test_hedging_claims_half_open_probe_only_for_stages_that_start(monkeypatch):
+    weather_service._public_weather_cache.clear()
+    clock = [0.0]
+
+    def half_open_breaker(name):
+        breaker = weather_service.CircuitBreaker(name, min_calls=1, cooldown_seconds=30, clock=lambda: clock[0])
+        breaker.record_failure()
+        return breaker
+
+    monkeypatch.setitem(weather_service._breakers, "open-meteo", weather_service.CircuitBreaker("open-meteo"))
+    monkeypatch.setitem(weather_service._breakers, "met.no", half_open_breaker("met.no"))
+    clock[0] = 31
+    expected = {"current": {}, "hourly": {}, "daily": {}}
+    calls = []
+
+    async def fake_fetch(client, *, params, attempt_name):
+        calls.append(attempt_name)
+        return None if weather_service._breakers["open-meteo"].state == "half_open" else expected
+
+    async def fake_metno_fetch(lat, lon):
+        calls.append("metno")
+        return expected
+
+    monkeypatch.setattr(weather_service, "_fetch_open_meteo_payload", fake_fetch)
+    monkeypatch.setattr(weather_service, "_fetch_metno_payload", fake_metno_fetch)
+
+    # rich risponde subito: met.no non parte e la sua prova half-open resta libera
+    assert asyncio.run(weather_service.fetch_single_city(41.9, 12.5)) == expected
+    assert calls == ["rich"]
+    assert weather_service._breakers["met.no"].allow() is True
+
+    # Open-Meteo half-open: una sola fonte fa da prova, poi si passa a met.no
+    clock[0] = 0.0
+    monkeypatch.setitem(weather_service._breakers, "open-meteo", half_open_breaker("open-meteo"))
+    monkeypatch.setitem(weather_service._breakers, "met.no", weather_service.CircuitBreaker("met.no"))
+    clock[0] = 31
+    calls.clear()
+    assert asyncio.run(weather_service.fetch_single_city(43.7, 11.2)) == expected
+    assert calls == ["rich", "metno"]
+
+
+def test_fetch_all_cities_weather_pauses_when_breaker_opens(monkeypatch):
+    monkeypatch.setattr(weather_service, "BATCH_SIZE", 1)
+    breaker = weather_service.CircuitBreaker("open-meteo", min_calls=2, failure_rate=0.5)
+    monkeypatch.setitem(weather_service._breakers, "open-meteo", breaker)
+    cities = [{"id": index, "name": f"C{index}", "lat": 40 + index, "lon": 12.0} for index in range(6)]
+    calls = []
+
+    class FakeClient:
+        async def get(self, url, params, timeout):
+            calls.append(params["latitude"])
+            raise httpx.ConnectError("connessione rifiutata")
+
+    async def no_sleep(_seconds):
+        return None
+
+    limiter = weather_service.AdaptiveRateLimiter(rate=100.0, max_rate=100.0, sleep=no_sleep)
+    result = asyncio.run(
+        weather_service.fetch_all_cities_weather(cities, client=FakeClient(), limiter=limiter, concurrency=1)
+    )
+
+    assert len(calls) == 2
+    # I due batch falliti tornano in coda e vengono sospesi insieme agli altri quattro
+    assert result["stats"]["paused_batches"] == 6
+    assert result["stats"]["completed_batches"] == 0
+    assert weather_service.get_breaker_states()["open-meteo"]["state"] == "open"
+
+
+def test_nearby_localities_share_one_cell_fetch_and_cache_entry(monkeypatch):
+    weather_service._public_weather_cache.clear()
+    monkeypatch.setattr(weather_service.geo_grid, "GRID_STEP_DEGREES", 0.05)
+    expected = {"current": {"temperature_2m": 16}, "hourly": {}, "daily": {}}
+    fetched = []
+
+    async def fake_fetch(client, *, params, attempt_name):
+        fetched.append((params["latitude"], params["longitude"]))
+        return expected
+
+    monkeypatch.setattr(weather_service, "_fetch_open_meteo_payload", fake_fetch)
+
+    async def scenario():
+        # Roma centro, Parioli, Villa Ada: stessa cella di 0.05°
+        return await asyncio.gather(
+            weather_service.fetch_single_city(41.9028, 12.4964),
+            weather_service.fetch_single_city(41.9200, 12.4900),
+            weather_service.fetch_single_city(41.9330, 12.4960),
+        )
+
+    assert asyncio.run(scenario()) == [expected] * 3
+    assert fetched == [(41.925, 12.475)]
+    assert len(weather_service._public_weather_cache) == 1
+    assert weather_service._get_cached_public_weather(41.9499, 12.4501) == expected
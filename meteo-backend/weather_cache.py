@@ -0,0 +1,438 @@
+"""
+weather_cache.py — cache delle previsioni pubbliche.
+
+LRU in memoria con TTL, limite sul numero di voci e budget approssimativo in byte
+(dimensione del payload serializzato in JSON compatto). Dopo il TTL una voce
+resta servibile come "stale" per `stale_seconds` (stale-while-revalidate);
+oltre viene rimossa alla lettura o dallo sweep periodico del scheduler.
+
+Sopra la LRU locale può esserci un livello condiviso tra worker e istanze
+(tabella SQL o server Redis) che conserva i payload in formato compatto:
+versione + istante di scrittura (epoch) + JSON compresso con zlib.
+"""
+from __future__ import annotations
+
+import abc
+import heapq
+import json
+import socket
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+from urllib.parse import unquote, urlparse
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+DEFAULT_MAX_ENTRIES = 2000
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+# Formato condiviso: byte di versione + float64 big-endian con l'istante di scrittura
+PAYLOAD_FORMAT_VERSION = 1
+_PAYLOAD_HEADER = struct.Struct("!Bd")
+
+
+def _compact_json(payload: dict) -> bytes:
+    return json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def payload_size(payload: dict) -> int:
+    return len(_compact_json(payload))
+
+
+def encode_payload(payload: dict, stored_at: float) -> bytes:
+    return _PAYLOAD_HEADER.pack(PAYLOAD_FORMAT_VERSION, stored_at) + zlib.compress(_compact_json(payload), 6)
+
+
+def decode_payload(blob: bytes) -> tuple[dict, float]:
+    """(payload, istante di scrittura); ValueError se il blob non è nel formato atteso."""
+    if len(blob) < _PAYLOAD_HEADER.size:
+        raise ValueError("payload cache troncato")
+    version, stored_at = _PAYLOAD_HEADER.unpack_from(blob)
+    if version != PAYLOAD_FORMAT_VERSION:
+        raise ValueError(f"versione payload cache non supportata: {version}")
+    try:
+        return json.loads(zlib.decompress(blob[_PAYLOAD_HEADER.size:])), stored_at
+    except (zlib.error, json.JSONDecodeError) as exc:
+        raise ValueError(f"payload cache non leggibile: {exc}") from exc
+
+
+class BoundedTTLCache:
+    """LRU limitata per voci e byte; ogni voce è fresca per `ttl_seconds`, poi stale per `stale_seconds`."""
+
+    def __init__(
+        self,
+        *,
+        ttl_seconds: float,
+        stale_seconds: float = 0.0,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._clock = clock
+        # chiave -> (istante di inserimento, dimensione, payload), dalla meno alla più recente
+        self._entries: OrderedDict[Hashable, tuple[float, int, dict]] = OrderedDict()
+        self._bytes = 0
+        self._counters = {"hits": 0, "stale_hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def lookup(self, key: Hashable) -> Optional[tuple[dict, float]]:
+        """(payload, età in secondi) se la voce è fresca o ancora nella finestra stale, altrimenti None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self._counters["misses"] += 1
+            return None
+        stored_at, _, payload = entry
+        age = self._clock() - stored_at
+        if age >= self.ttl_seconds + self.stale_seconds:
+            self._remove(key)
+            self._counters["expirations"] += 1
+            self._counters["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._counters["hits" if age < self.ttl_seconds else "stale_hits"] += 1
+        return payload, age
+
+    def get(self, key: Hashable) -> Optional[dict]:
+        """Solo payload freschi; una voce stale conta come miss e resta per chi usa `lookup`."""
+        entry = self._entries.get(key)
+        age = None if entry is None else self._clock() - entry[0]
+        if age is None or age >= self.ttl_seconds:
+            if age is not None and age >= self.ttl_seconds + self.stale_seconds:
+                self._remove(key)
+                self._counters["expirations"] += 1
+            self._counters["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._counters["hits"] += 1
+        return entry[2]
+
+    def peek_age(self, key: Hashable) -> Optional[float]:
+        """Età della voce senza toccare ordine LRU e contatori."""
+        entry = self._entries.get(key)
+        return None if entry is None else self._clock() - entry[0]
+
+    def set(self, key: Hashable, payload: dict, *, age: float = 0.0):
+        """Inserisce la voce; `age` > 0 per payload già vecchi (es. letti dal livello condiviso)."""
+        size = payload_size(payload)
+        if key in self._entries:
+            self._remove(key)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (self._clock() - age, size, payload)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._counters["evictions"] += 1
+
+    def pop(self, key: Hashable):
+        if key in self._entries:
+            self._remove(key)
+
+    def sweep(self) -> int:
+        """Rimuove le voci oltre TTL + finestra stale; ritorna quante ne ha tolte."""
+        cutoff = self._clock() - self.ttl_seconds - self.stale_seconds
+        expired = [key for key, (stored_at, _, _) in self._entries.items() if stored_at <= cutoff]
+        for key in expired:
+            self._remove(key)
+        self._counters["expirations"] += len(expired)
+        return len(expired)
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        served = self._counters["hits"] + self._counters["stale_hits"]
+        lookups = served + self._counters["misses"]
+        return {
+            **self._counters,
+            "hit_ratio": round(served / lookups, 3) if lookups else None,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "stale_seconds": self.stale_seconds,
+        }
+
+
+class RequestFrequency:
+    """
+    Conteggio richieste per chiave con decadimento esponenziale (emivita `half_life_seconds`):
+    il punteggio riflette il traffico recente. Oltre `max_keys` vengono scartate le chiavi più fredde.
+    """
+
+    def __init__(
+        self,
+        *,
+        half_life_seconds: float = 3600.0,
+        max_keys: int = 5000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.half_life_seconds = half_life_seconds
+        self.max_keys = max_keys
+        self._clock = clock
+        # chiave -> (punteggio, istante dell'ultimo aggiornamento)
+        self._scores: dict[Hashable, tuple[float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def _decayed(self, score: float, updated_at: float, now: float) -> float:
+        return score * 0.5 ** ((now - updated_at) / self.half_life_seconds)
+
+    def record(self, key: Hashable, weight: float = 1.0):
+        now = self._clock()
+        score, updated_at = self._scores.get(key, (0.0, now))
+        self._scores[key] = (self._decayed(score, updated_at, now) + weight, now)
+        if len(self._scores) > self.max_keys:
+            self._prune(now)
+
+    def _prune(self, now: float):
+        keep = int(self.max_keys * 0.9)
+        ranked = sorted(self._scores.items(), key=lambda item: self._decayed(*item[1], now), reverse=True)
+        self._scores = dict(ranked[:keep])
+
+    def top(self, n: int) -> list[tuple[Hashable, float]]:
+        """Le `n` chiavi più richieste con il punteggio attuale, in ordine decrescente."""
+        now = self._clock()
+        return heapq.nlargest(
+            n,
+            ((key, self._decayed(score, updated_at, now)) for key, (score, updated_at) in self._scores.items()),
+            key=lambda item: item[1],
+        )
+
+    def clear(self):
+        self._scores.clear()
+
+
+class SharedCacheBackend(abc.ABC):
+    """
+    Livello condiviso tra processi. Le chiavi sono stringhe, i valori blob di `encode_payload`.
+    Le implementazioni sono sincrone: dal codice async vanno chiamate con asyncio.to_thread.
+    Un backend che non implementa get/set/delete fallisce già alla costruzione.
+    """
+
+    name = "base"
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[tuple[dict, float]]:
+        """(payload, età in secondi) oppure None."""
+
+    @abc.abstractmethod
+    def set(self, key: str, payload: dict, *, ttl_seconds: float):
+        """Scrive il payload con scadenza a `ttl_seconds`."""
+
+    def set_many(self, items: list[tuple[str, dict]], *, ttl_seconds: float):
+        for key, payload in items:
+            self.set(key, payload, ttl_seconds=ttl_seconds)
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        """Rimuove la voce, se presente."""
+
+    def sweep(self) -> int:
+        """Rimuove le voci scadute; ritorna quante ne ha tolte (0 se il backend scade da solo)."""
+        return 0
+
+    def close(self):
+        pass
+
+
+class SqlCacheBackend(SharedCacheBackend):
+    """Tabella `public_weather_cache` su SQLite/PostgreSQL: upsert per chiave, sweep per expires_at."""
+
+    name = "sql"
+
+    def __init__(self, engine, *, clock: Callable[[], float] = time.time):
+        from database import PublicWeatherCacheEntry
+
+        self._engine = engine
+        self._table = PublicWeatherCacheEntry.__table__
+        self._clock = clock
+
+    def get(self, key: str) -> Optional[tuple[dict, float]]:
+        now = self._clock()
+        with self._engine.connect() as conn:
+            blob = conn.execute(
+                select(self._table.c.payload).where(
+                    self._table.c.cache_key == key,
+                    self._table.c.expires_at > now,
+                )
+            ).scalar()
+        if blob is None:
+            return None
+        payload, stored_at = decode_payload(bytes(blob))
+        return payload, max(0.0, now - stored_at)
+
+    def set(self, key: str, payload: dict, *, ttl_seconds: float):
+        self.set_many([(key, payload)], ttl_seconds=ttl_seconds)
+
+    def set_many(self, items: list[tuple[str, dict]], *, ttl_seconds: float):
+        """Upsert di più voci in una sola transazione (executemany)."""
+        if not items:
+            return
+        now = self._clock()
+        rows = [
+            {
+                "cache_key": key,
+                "stored_at": now,
+                "expires_at": now + ttl_seconds,
+                "payload": encode_payload(payload, now),
+            }
+            for key, payload in items
+        ]
+        with self._engine.begin() as conn:
+            dialect = conn.dialect.name
+            if dialect in {"postgresql", "sqlite"}:
+                insert = pg_insert if dialect == "postgresql" else sqlite_insert
+                stmt = insert(self._table)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[self._table.c.cache_key],
+                    set_={name: stmt.excluded[name] for name in ("stored_at", "expires_at", "payload")},
+                )
+                conn.execute(stmt, rows)
+                return
+            conn.execute(self._table.delete().where(self._table.c.cache_key.in_([row["cache_key"] for row in rows])))
+            conn.execute(self._table.insert(), rows)
+
+    def delete(self, key: str):
+        with self._engine.begin() as conn:
+            conn.execute(self._table.delete().where(self._table.c.cache_key == key))
+
+    def sweep(self) -> int:
+        with self._engine.begin() as conn:
+            return conn.execute(self._table.delete().where(self._table.c.expires_at <= self._clock())).rowcount or 0
+
+
+class RedisProtocolError(RuntimeError):
+    pass
+
+
+class RedisCacheBackend(SharedCacheBackend):
+    """
+    Client RESP minimale (GET, SET PX, DEL, PING, AUTH, SELECT) senza dipendenze esterne.
+    Una connessione per processo protetta da lock, riaperta dopo un errore di rete;
+    la scadenza delle voci è affidata a Redis tramite PX.
+    """
+
+    name = "redis"
+    KEY_PREFIX = "meteo:weather:"
+
+    def __init__(self, url: str, *, timeout: float = 2.0, clock: Callable[[], float] = time.time):
+        parsed = urlparse(url)
+        if parsed.scheme not in {"redis", ""}:
+            raise ValueError(f"schema URL Redis non supportato: {parsed.scheme}")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._clock = clock
+        self._sock: Optional[socket.socket] = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._reader = self._sock.makefile("rb")
+        if self.password:
+            self._roundtrip("AUTH", self.password)
+        if self.db:
+            self._roundtrip("SELECT", str(self.db))
+
+    def _disconnect(self):
+        for resource in (self._reader, self._sock):
+            if resource is not None:
+                try:
+                    resource.close()
+                except OSError:
+                    pass
+        self._sock = None
+        self._reader = None
+
+    @staticmethod
+    def _encode_command(*args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("connessione Redis chiusa")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode("utf-8")
+        if kind == b"-":
+            raise RedisProtocolError(body.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("risposta Redis troncata")
+            return data[:-2]
+        if kind == b"*":
+            length = int(body)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise RedisProtocolError(f"risposta Redis non valida: {line!r}")
+
+    def _roundtrip(self, *args):
+        self._sock.sendall(self._encode_command(*args))
+        return self._read_reply()
+
+    def execute(self, *args):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._roundtrip(*args)
+                except (OSError, ConnectionError):
+                    self._disconnect()
+                    if attempt:
+                        raise
+
+    def ping(self) -> bool:
+        return self.execute("PING") == "PONG"
+
+    def get(self, key: str) -> Optional[tuple[dict, float]]:
+        blob = self.execute("GET", self.KEY_PREFIX + key)
+        if blob is None:
+            return None
+        payload, stored_at = decode_payload(blob)
+        return payload, max(0.0, self._clock() - stored_at)
+
+    def set(self, key: str, payload: dict, *, ttl_seconds: float):
+        blob = encode_payload(payload, self._clock())
+        self.execute("SET", self.KEY_PREFIX + key, blob, "PX", max(1, int(ttl_seconds * 1000)))
+
+    def delete(self, key: str):
+        self.execute("DEL", self.KEY_PREFIX + key)
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
@@ -6,30 +6,82 @@ from __future__ import annotations
 import asyncio
 import json
 import logging
-from collections import Counter
-from datetime import datetime, timedelta, timezone
-from typing import Optional
+import time
+from collections import Counter, deque
+from contextlib import AsyncExitStack
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
 from urllib.error import HTTPError, URLError
 from urllib.parse import urlencode
 from urllib.request import Request, urlopen
 from zoneinfo import ZoneInfo
 
 import httpx
+import numpy as np
+
+import forecast_snapshots
+import geo_grid
+import http_pool
+from config import settings
+from weather_cache import (
+    BoundedTTLCache,
+    RedisCacheBackend,
+    RequestFrequency,
+    SharedCacheBackend,
+    SqlCacheBackend,
+)
 
 OPEN_METEO_URL = "https://api.open-meteo.com/v1/forecast"
 METNO_URL = "https://api.met.no/weatherapi/locationforecast/2.0/compact"
 BATCH_SIZE = 100
-MAX_CONCURRENCY = 1
+MAX_CONCURRENCY = 4
 TIMEOUT = 30
 ML_FORECAST_LEADS = (1, 2, 3, 4, 5, 6)
-BATCH_DELAY_SECONDS = 0.75
 BATCH_RETRY_DELAYS = (5, 15)
-PUBLIC_CACHE_TTL_SECONDS = 300
+# Token bucket AIMD per il ciclo orario: batch/secondo, aumento additivo, riduzione moltiplicativa.
+BATCH_RATE_INITIAL = 1.5
+BATCH_RATE_MIN = 0.1
+BATCH_RATE_MAX = 6.0
+BATCH_RATE_BURST = 2.0
+BATCH_RATE_INCREASE = 0.25
+BATCH_RATE_DECREASE_ON_429 = 0.5
+BATCH_RATE_DECREASE_ON_SLOW = 0.8
+BATCH_LATENCY_TARGET_SECONDS = 4.0
+BATCH_MAX_ATTEMPTS = 5
+# Circuit breaker per provider: si apre se almeno metà delle ultime chiamate (minimo 5) fallisce
+BREAKER_WINDOW = 20
+BREAKER_MIN_CALLS = 5
+BREAKER_FAILURE_RATE = 0.5
+BREAKER_COOLDOWN_SECONDS = 60.0
+BREAKER_PROBE_WAIT_SECONDS = 1.0
+PUBLIC_CACHE_TTL_SECONDS = settings.public_cache_ttl_seconds
+# Finestra stale-while-revalidate oltre il TTL
+PUBLIC_CACHE_STALE_SECONDS = 900
+PUBLIC_CACHE_MAX_ENTRIES = 2000
+PUBLIC_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# Pre-riscaldamento: città più richieste (punteggio con emivita di un'ora) aggiornate
+# in batch quando mancano meno di PUBLIC_WARMUP_LEAD_SECONDS alla scadenza del TTL
+PUBLIC_WARMUP_TOP_N = 300
+PUBLIC_WARMUP_LEAD_SECONDS = 90
+PUBLIC_WARMUP_MIN_SCORE = 2.0
+PUBLIC_REQUEST_HALF_LIFE_SECONDS = 3600
+# Fallback single-city in parallelo (hedging): fonti in ordine di preferenza, ognuna con la sua deadline
+PUBLIC_HEDGE_DELAY_SECONDS = settings.public_hedge_delay_seconds
+PUBLIC_REQUEST_DEADLINE_SECONDS = settings.public_request_deadline_seconds
+PUBLIC_STAGE_DEADLINES_SECONDS = {
+    stage: settings.public_stage_deadline_seconds
+    for stage in ("rich", "compat", "compat-urllib", "metno")
+}
+# Provider di ogni fonte: le fonti scadute o abbandonate contano come errore sul suo circuit breaker
+PUBLIC_STAGE_PROVIDERS = {"rich": "open-meteo", "compat": "open-meteo", "compat-urllib": "open-meteo", "metno": "met.no"}
 ROME_TZ = ZoneInfo("Europe/Rome")
 METNO_USER_AGENT = "MeteoAI/2.1 https://leprevisioni.netlify.app"
 PUBLIC_FORECAST_DAYS = 16
 PUBLIC_FALLBACK_FORECAST_DAYS = 9
 PUBLIC_HOURLY_FORECAST_HOURS = 24
+# Ore in più nel batch: lo snapshot resta servibile per 24 ore piene fino al ciclo successivo
+BATCH_SNAPSHOT_EXTRA_HOURS = 2
 SINGLE_CITY_CURRENT_FIELDS = (
     "temperature_2m,relative_humidity_2m,apparent_temperature,cloud_cover,"
     "wind_speed_10m,wind_direction_10m,surface_pressure,precipitation,weather_code"
@@ -48,13 +100,229 @@ SINGLE_CITY_HOURLY_COMPAT_FIELDS = (
 )
 
 logger = logging.getLogger(__name__)
-_public_weather_cache: dict[tuple[float, float], tuple[datetime, dict]] = {}
+_public_weather_cache = BoundedTTLCache(
+    ttl_seconds=PUBLIC_CACHE_TTL_SECONDS,
+    stale_seconds=PUBLIC_CACHE_STALE_SECONDS,
+    max_entries=PUBLIC_CACHE_MAX_ENTRIES,
+    max_bytes=PUBLIC_CACHE_MAX_BYTES,
+)
+_public_request_frequency = RequestFrequency(half_life_seconds=PUBLIC_REQUEST_HALF_LIFE_SECONDS)
+_warmup_stats = {"runs": 0, "refreshed": 0, "failed": 0, "batches": 0}
+# Livello condiviso tra worker/istanze (None con backend "memory")
+_shared_public_cache: Optional[SharedCacheBackend] = None
+_shared_cache_stats = {"hits": 0, "misses": 0, "writes": 0, "errors": 0}
+# Fetch upstream in corso per chiave cache: le richieste concorrenti attendono lo stesso task
+_inflight_fetches: dict[tuple[float, float], asyncio.Task] = {}
+_single_flight_stats = {"leaders": 0, "coalesced": 0, "background_refreshes": 0}
+_hedge_stats = {
+    "hedged_launches": 0, "stage_timeouts": 0, "abandoned": 0, "deadline_exceeded": 0, "winners": Counter(),
+}
 
 
 class OpenMeteoRateLimited(Exception):
     """Raised when Open-Meteo returns HTTP 429 and the caller should back off."""
 
 
+class OpenMeteoBatchFailed(Exception):
+    """Raised when a batch fetch fails for reasons other than rate limiting (5xx, rete, payload)."""
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket con controllo AIMD per i batch verso Open-Meteo.
+    Il rate cresce di un passo fisso dopo ogni batch rapido e si riduce
+    moltiplicativamente su 429 o latenza oltre soglia.
+    """
+
+    def __init__(
+        self,
+        *,
+        rate: float = BATCH_RATE_INITIAL,
+        min_rate: float = BATCH_RATE_MIN,
+        max_rate: float = BATCH_RATE_MAX,
+        burst: float = BATCH_RATE_BURST,
+        increase: float = BATCH_RATE_INCREASE,
+        decrease_on_429: float = BATCH_RATE_DECREASE_ON_429,
+        decrease_on_slow: float = BATCH_RATE_DECREASE_ON_SLOW,
+        latency_target: float = BATCH_LATENCY_TARGET_SECONDS,
+        clock=time.monotonic,
+        sleep=asyncio.sleep,
+    ):
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease_on_429 = decrease_on_429
+        self.decrease_on_slow = decrease_on_slow
+        self.latency_target = latency_target
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = 1.0
+        self._updated_at = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                await self._sleep((1.0 - self._tokens) / self.rate)
+
+    def record_success(self, latency_seconds: float):
+        if latency_seconds > self.latency_target:
+            self.rate = max(self.min_rate, self.rate * self.decrease_on_slow)
+        else:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def record_rate_limited(self):
+        self._refill()
+        self.rate = max(self.min_rate, self.rate * self.decrease_on_429)
+        # Svuota il bucket: il prossimo batch parte solo dopo un intervallo pieno al nuovo rate.
+        self._tokens = min(self._tokens, 0.0)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker a finestra mobile per un provider upstream.
+    closed: le chiamate passano e si registra l'esito delle ultime `window`.
+    open: oltre `failure_rate` di errori si rifiutano le chiamate per `cooldown_seconds`.
+    half_open: finito il cool-down passa una sola chiamata di prova; il suo esito
+    richiude il circuito o lo riapre per un altro cool-down.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        window: int = BREAKER_WINDOW,
+        min_calls: int = BREAKER_MIN_CALLS,
+        failure_rate: float = BREAKER_FAILURE_RATE,
+        cooldown_seconds: float = BREAKER_COOLDOWN_SECONDS,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown_seconds = cooldown_seconds
+        self._clock = clock
+        self._outcomes: deque[bool] = deque(maxlen=window)
+        self._opened_at: float | None = None
+        self._probe_in_flight = False
+        self._probe_started_at = 0.0
+        self._counters = {"opened": 0, "rejected": 0, "failures": 0, "successes": 0}
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if self._clock() - self._opened_at < self.cooldown_seconds:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        # Una prova senza esito (es. annullata) non blocca il circuito oltre un altro cool-down
+        probe_stale = self._clock() - self._probe_started_at >= self.cooldown_seconds
+        if state == "half_open" and (not self._probe_in_flight or probe_stale):
+            self._probe_in_flight = True
+            self._probe_started_at = self._clock()
+            return True
+        self._counters["rejected"] += 1
+        return False
+
+    def _open(self):
+        self._opened_at = self._clock()
+        self._probe_in_flight = False
+        self._counters["opened"] += 1
+        _warn(f"Circuit breaker {self.name} aperto per {self.cooldown_seconds:.0f}s")
+
+    def record_success(self):
+        self._counters["successes"] += 1
+        if self._opened_at is not None:
+            print(f"[OK] Circuit breaker {self.name} richiuso")
+            self._opened_at = None
+            self._probe_in_flight = False
+            self._outcomes.clear()
+        self._outcomes.append(True)
+
+    def record_failure(self):
+        self._counters["failures"] += 1
+        if self._opened_at is not None:
+            # Prova fallita in half-open: nuovo cool-down. Gli errori a circuito già aperto non contano.
+            if self._probe_in_flight:
+                self._open()
+            return
+        self._outcomes.append(False)
+        failures = self._outcomes.count(False)
+        if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+            self._open()
+
+    def retry_in_seconds(self) -> float:
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self.cooldown_seconds - (self._clock() - self._opened_at))
+
+    def snapshot(self) -> dict:
+        failures = self._outcomes.count(False)
+        return {
+            "state": self.state,
+            "failure_rate": round(failures / len(self._outcomes), 3) if self._outcomes else 0.0,
+            "recent_calls": len(self._outcomes),
+            "retry_in_seconds": round(self.retry_in_seconds(), 1),
+            **self._counters,
+        }
+
+    def reset(self):
+        self._outcomes.clear()
+        self._opened_at = None
+        self._probe_in_flight = False
+
+
+_breakers = {"open-meteo": CircuitBreaker("open-meteo"), "met.no": CircuitBreaker("met.no")}
+
+
+def _is_upstream_failure(exc: BaseException) -> bool:
+    """Errori che indicano un provider giù o degradato; 429 e altri 4xx significano che risponde."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response is not None and exc.response.status_code >= 500
+    if isinstance(exc, HTTPError):
+        return exc.code >= 500
+    return isinstance(exc, (httpx.TransportError, URLError, TimeoutError, OSError, ValueError))
+
+
+# Provider con un esito già registrato nella richiesta in hedging corrente (None fuori dall'hedging)
+_hedged_outcomes: ContextVar[Optional[set]] = ContextVar("hedged_outcomes", default=None)
+
+
+def _record_upstream(provider: str, exc: BaseException | None = None):
+    breaker = _breakers[provider]
+    failed = exc is not None and _is_upstream_failure(exc)
+    outcomes = _hedged_outcomes.get()
+    if outcomes is not None:
+        # Le fonti parallele dello stesso provider non moltiplicano gli errori di una richiesta
+        if failed and provider in outcomes:
+            return
+        outcomes.add(provider)
+    if failed:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+def get_breaker_states() -> dict:
+    return {name: breaker.snapshot() for name, breaker in _breakers.items()}
+
+
 def parse_utc_timestamp(value: str) -> datetime:
     parsed = datetime.fromisoformat(value)
     if parsed.tzinfo is None:
@@ -68,170 +336,479 @@ def _warn(message: str):
 
 
 def _cache_key(lat: float, lon: float) -> tuple[float, float]:
-    return (round(lat, 4), round(lon, 4))
+    """Centro della cella geo_grid: località vicine condividono voce di cache e fetch upstream."""
+    return geo_grid.snap(lat, lon)
 
 
 def _get_cached_public_weather(lat: float, lon: float) -> Optional[dict]:
-    entry = _public_weather_cache.get(_cache_key(lat, lon))
-    if not entry:
+    return _public_weather_cache.get(_cache_key(lat, lon))
+
+
+def _set_cached_public_weather(lat: float, lon: float, payload: dict):
+    _public_weather_cache.set(_cache_key(lat, lon), payload)
+
+
+def _build_shared_public_cache() -> Optional[SharedCacheBackend]:
+    backend = settings.public_cache_backend
+    if backend == "memory":
         return None
-    expires_at, payload = entry
-    if expires_at <= datetime.now(timezone.utc):
-        _public_weather_cache.pop(_cache_key(lat, lon), None)
+    if backend == "sql":
+        from database import engine
+
+        return SqlCacheBackend(engine)
+    if backend == "redis":
+        if not settings.public_cache_url:
+            _warn("PUBLIC_CACHE_BACKEND=redis senza PUBLIC_CACHE_URL: cache solo in memoria")
+            return None
+        return RedisCacheBackend(settings.public_cache_url)
+    _warn(f"PUBLIC_CACHE_BACKEND sconosciuto '{backend}': cache solo in memoria")
+    return None
+
+
+def start_shared_public_cache():
+    """Attiva il livello condiviso configurato (idempotente): chiamato allo startup dell'app."""
+    global _shared_public_cache
+    if _shared_public_cache is None:
+        _shared_public_cache = _build_shared_public_cache()
+        forecast_snapshots.set_shared_backend(_shared_public_cache)
+        if _shared_public_cache is not None:
+            print(f"[CACHE] Cache meteo pubblica condivisa attiva ({_shared_public_cache.name})")
+
+
+def close_shared_public_cache():
+    global _shared_public_cache
+    if _shared_public_cache is not None:
+        forecast_snapshots.set_shared_backend(None)
+        _shared_public_cache.close()
+        _shared_public_cache = None
+
+
+def _shared_cache_key(key: tuple[float, float]) -> str:
+    return f"{key[0]:.4f},{key[1]:.4f}"
+
+
+async def _lookup_shared_public_weather(key: tuple[float, float]) -> Optional[tuple[dict, float]]:
+    """Legge dal livello condiviso e, se servibile, ricopia la voce nella LRU locale con la sua età."""
+    backend = _shared_public_cache
+    if backend is None:
+        return None
+    try:
+        found = await asyncio.to_thread(backend.get, _shared_cache_key(key))
+    except Exception as exc:
+        _shared_cache_stats["errors"] += 1
+        _warn(f"Cache condivisa {backend.name} non disponibile in lettura: {exc}")
+        return None
+    if found is None or found[1] >= PUBLIC_CACHE_TTL_SECONDS + PUBLIC_CACHE_STALE_SECONDS:
+        _shared_cache_stats["misses"] += 1
         return None
-    return payload
 
+    _shared_cache_stats["hits"] += 1
+    payload, age = found
+    _public_weather_cache.set(key, payload, age=age)
+    return payload, age
 
-def _set_cached_public_weather(lat: float, lon: float, payload: dict):
-    _public_weather_cache[_cache_key(lat, lon)] = (
-        datetime.now(timezone.utc) + timedelta(seconds=PUBLIC_CACHE_TTL_SECONDS),
-        payload,
-    )
 
+async def _store_public_weather(lat: float, lon: float, payload: dict):
+    _set_cached_public_weather(lat, lon, payload)
+    backend = _shared_public_cache
+    if backend is None:
+        return
+    try:
+        await asyncio.to_thread(
+            backend.set,
+            _shared_cache_key(_cache_key(lat, lon)),
+            payload,
+            ttl_seconds=PUBLIC_CACHE_TTL_SECONDS + PUBLIC_CACHE_STALE_SECONDS,
+        )
+        _shared_cache_stats["writes"] += 1
+    except Exception as exc:
+        _shared_cache_stats["errors"] += 1
+        _warn(f"Cache condivisa {backend.name} non disponibile in scrittura: {exc}")
 
-def _build_batch_results(cities: list[dict], payload: list[dict]) -> dict:
-    observations: list[dict] = []
-    predictions: list[dict] = []
 
-    for i, city_data in enumerate(payload):
-        if i >= len(cities):
-            break
+def sweep_public_weather_cache() -> int:
+    return _public_weather_cache.sweep()
 
-        city = cities[i]
-        current = city_data.get("current", {})
-        current_time_raw = current.get("time")
-        if current_time_raw and current.get("temperature_2m") is not None:
-            current_time = parse_utc_timestamp(current_time_raw)
-            observations.append({
-                "city_id": city["id"],
-                "observed_at": current_time,
-                "temp": current.get("temperature_2m"),
-                "humidity": current.get("relative_humidity_2m"),
-                "cloud_cover": current.get("cloud_cover"),
-                "wind_speed": current.get("wind_speed_10m"),
-                "wind_direction": current.get("wind_direction_10m"),
-                "precipitation": current.get("precipitation", 0.0),
-                "weather_code": current.get("weather_code"),
-            })
-
-        hourly = city_data.get("hourly", {})
-        hourly_times = hourly.get("time", [])
-        if not hourly_times:
-            continue
 
-        hourly_map = {}
-        for idx, raw_time in enumerate(hourly_times):
-            hourly_map[parse_utc_timestamp(raw_time)] = idx
+async def sweep_shared_public_weather_cache() -> int:
+    backend = _shared_public_cache
+    if backend is None:
+        return 0
+    try:
+        return await asyncio.to_thread(backend.sweep)
+    except Exception as exc:
+        _shared_cache_stats["errors"] += 1
+        _warn(f"Pulizia cache condivisa {backend.name} fallita: {exc}")
+        return 0
 
-        forecast_anchor = parse_utc_timestamp(current_time_raw).replace(minute=0, second=0, microsecond=0)
-        for lead_hours in ML_FORECAST_LEADS:
-            target_time = forecast_anchor + timedelta(hours=lead_hours)
-            idx = hourly_map.get(target_time)
-            if idx is None:
-                continue
 
-            temperatures = hourly.get("temperature_2m", [])
-            forecast_temp = temperatures[idx] if idx < len(temperatures) else None
-            if forecast_temp is None:
-                continue
+def get_public_cache_stats() -> dict:
+    backend = _shared_public_cache
+    return {
+        **_public_weather_cache.stats(),
+        "shared": {"backend": backend.name if backend is not None else "memory", **_shared_cache_stats},
+        "single_flight": get_single_flight_stats(),
+        "hedging": get_hedge_stats(),
+        "warmup": {**_warmup_stats, "tracked_keys": len(_public_request_frequency)},
+    }
+
+
+_HOUR_SECONDS = 3600
+# (colonna di output, campo Open-Meteo) per osservazioni correnti e previsioni orarie
+BATCH_OBSERVATION_FIELDS = (
+    ("temp", "temperature_2m"),
+    ("humidity", "relative_humidity_2m"),
+    ("cloud_cover", "cloud_cover"),
+    ("wind_speed", "wind_speed_10m"),
+    ("wind_direction", "wind_direction_10m"),
+    ("precipitation", "precipitation"),
+    ("weather_code", "weather_code"),
+)
+BATCH_FORECAST_FIELDS = (
+    ("forecast_temp", "temperature_2m"),
+    ("humidity", "relative_humidity_2m"),
+    ("forecast_precipitation", "precipitation"),
+    ("forecast_weather_code", "weather_code"),
+    ("forecast_cloud_cover", "cloud_cover"),
+    ("forecast_wind_speed", "wind_speed_10m"),
+    ("forecast_wind_direction", "wind_direction_10m"),
+)
+_INTEGER_COLUMNS = {"weather_code", "forecast_weather_code"}
+_TIMESTAMP_COLUMNS = {"observed_at", "predicted_at", "target_time"}
 
-            humidities = hourly.get("relative_humidity_2m", [])
-            precipitations = hourly.get("precipitation", [])
-            weather_codes = hourly.get("weather_code", [])
-            cloud_covers = hourly.get("cloud_cover", [])
-            wind_speeds = hourly.get("wind_speed_10m", [])
-            wind_directions = hourly.get("wind_direction_10m", [])
-
-            predictions.append({
-                "city_id": city["id"],
-                "predicted_at": forecast_anchor,
-                "target_time": target_time,
-                "lead_hours": lead_hours,
-                "forecast_source": "open-meteo",
-                "forecast_temp": forecast_temp,
-                "humidity": humidities[idx] if idx < len(humidities) else None,
-                "forecast_precipitation": precipitations[idx] if idx < len(precipitations) else None,
-                "forecast_weather_code": weather_codes[idx] if idx < len(weather_codes) else None,
-                "forecast_cloud_cover": cloud_covers[idx] if idx < len(cloud_covers) else None,
-                "forecast_wind_speed": wind_speeds[idx] if idx < len(wind_speeds) else None,
-                "forecast_wind_direction": wind_directions[idx] if idx < len(wind_directions) else None,
-            })
 
+def _epoch_seconds(value: str | int) -> int:
+    # Il batch chiede timeformat=unixtime; le stringhe ISO restano supportate
+    if isinstance(value, (int, float)):
+        return int(value)
+    return int(parse_utc_timestamp(value).timestamp())
+
+
+def _empty_batch_columns() -> dict:
+    observations = {"city_id": np.empty(0, dtype=np.int64), "observed_at": np.empty(0, dtype=np.int64)}
+    observations.update({key: np.empty(0, dtype=np.float64) for key, _ in BATCH_OBSERVATION_FIELDS})
+    predictions = {
+        "city_id": np.empty(0, dtype=np.int64),
+        "predicted_at": np.empty(0, dtype=np.int64),
+        "target_time": np.empty(0, dtype=np.int64),
+        "lead_hours": np.empty(0, dtype=np.int64),
+    }
+    predictions.update({key: np.empty(0, dtype=np.float64) for key, _ in BATCH_FORECAST_FIELDS})
     return {"observations": observations, "predictions": predictions}
 
 
-async def fetch_weather_batch(cities: list[dict], client: httpx.AsyncClient) -> dict:
+def _extract_batch_columns(cities: list[dict], payload: list[dict]) -> dict:
     """
-    Scarica osservazioni correnti e previsioni orarie per un batch di città.
+    Converte un payload batch Open-Meteo in colonne NumPy tipizzate.
+    I timestamp sono secondi epoch UTC, i valori mancanti sono NaN.
+    L'indice orario di ogni lead è calcolato per offset dal primo timestamp orario.
     """
-    if not cities:
-        return {"observations": [], "predictions": []}
+    n_cities = min(len(cities), len(payload))
+    if n_cities == 0:
+        return _empty_batch_columns()
+
+    city_ids = np.fromiter((cities[i]["id"] for i in range(n_cities)), dtype=np.int64, count=n_cities)
+    current_epoch = np.full(n_cities, np.nan)
+    first_epoch = np.full(n_cities, np.nan)
+    hour_counts = np.zeros(n_cities, dtype=np.int64)
+    current_values = {key: np.full(n_cities, np.nan) for key, _ in BATCH_OBSERVATION_FIELDS}
+    hourly_rows: list[dict] = []
+    irregular: dict[int, dict[int, int]] = {}
+
+    for i in range(n_cities):
+        city_data = payload[i] or {}
+        current = city_data.get("current") or {}
+        current_time_raw = current.get("time")
+        if current_time_raw:
+            current_epoch[i] = _epoch_seconds(current_time_raw)
+        for key, field in BATCH_OBSERVATION_FIELDS:
+            value = current.get(field, 0.0) if key == "precipitation" else current.get(field)
+            if value is not None:
+                current_values[key][i] = value
+
+        hourly = city_data.get("hourly") or {}
+        hourly_rows.append(hourly)
+        hourly_times = hourly.get("time") or []
+        if not hourly_times:
+            continue
+        hour_counts[i] = len(hourly_times)
+        first_epoch[i] = _epoch_seconds(hourly_times[0])
+        last_epoch = _epoch_seconds(hourly_times[-1])
+        if last_epoch - first_epoch[i] != (len(hourly_times) - 1) * _HOUR_SECONDS:
+            irregular[i] = {_epoch_seconds(raw): idx for idx, raw in enumerate(hourly_times)}
+
+    width = max(int(hour_counts.max()), 1)
+    hourly_values = {}
+    for key, field in BATCH_FORECAST_FIELDS:
+        matrix = np.full((n_cities, width), np.nan)
+        for i, hourly in enumerate(hourly_rows):
+            values = hourly.get(field) or []
+            if values:
+                row = np.asarray(values[:width], dtype=np.float64)
+                matrix[i, :len(row)] = row
+        hourly_values[key] = matrix
+
+    leads = np.asarray(ML_FORECAST_LEADS, dtype=np.int64)
+    anchor = np.floor(current_epoch / _HOUR_SECONDS) * _HOUR_SECONDS
+    target = anchor[:, None] + leads[None, :] * _HOUR_SECONDS
+    offsets = (target - first_epoch[:, None]) / _HOUR_SECONDS
+    for i, lookup in irregular.items():
+        offsets[i] = [lookup.get(int(value), np.nan) for value in target[i]]
+
+    valid = np.isfinite(offsets) & (offsets >= 0) & (offsets < hour_counts[:, None])
+    index = np.where(valid, offsets, 0).astype(np.int64)
+    forecast = {
+        key: np.take_along_axis(matrix, index, axis=1)
+        for key, matrix in hourly_values.items()
+    }
+    valid &= ~np.isnan(forecast["forecast_temp"])
+    rows, cols = np.nonzero(valid)
+
+    predictions = {
+        "city_id": city_ids[rows],
+        "predicted_at": anchor[rows].astype(np.int64),
+        "target_time": target[rows, cols].astype(np.int64),
+        "lead_hours": leads[cols],
+    }
+    predictions.update({key: values[rows, cols] for key, values in forecast.items()})
+
+    has_observation = ~np.isnan(current_epoch) & ~np.isnan(current_values["temp"])
+    observations = {
+        "city_id": city_ids[has_observation],
+        "observed_at": current_epoch[has_observation].astype(np.int64),
+    }
+    observations.update({key: values[has_observation] for key, values in current_values.items()})
+
+    return {"observations": observations, "predictions": predictions}
+
 
-    params = {
+def concat_batch_columns(parts: list[dict]) -> dict:
+    """Concatena le colonne di più batch in un'unica forma colonnare."""
+    merged = _empty_batch_columns()
+    for kind, columns in merged.items():
+        chunks = [part[kind] for part in parts if len(part[kind]["city_id"])]
+        if chunks:
+            merged[kind] = {key: np.concatenate([chunk[key] for chunk in chunks]) for key in columns}
+    return merged
+
+
+def columns_to_records(columns: dict) -> list[dict]:
+    """Ricostruisce i record dict (None al posto di NaN, datetime UTC) da una tabella colonnare."""
+    if not len(columns.get("city_id", ())):
+        return []
+
+    timestamp_cache: dict[int, datetime] = {}
+
+    def to_datetime(epoch: int) -> datetime:
+        value = timestamp_cache.get(epoch)
+        if value is None:
+            value = timestamp_cache[epoch] = datetime.fromtimestamp(epoch, tz=timezone.utc)
+        return value
+
+    converted = {}
+    for key, values in columns.items():
+        if key in _TIMESTAMP_COLUMNS:
+            converted[key] = [to_datetime(value) for value in values.tolist()]
+        elif values.dtype.kind == "f":
+            is_int = key in _INTEGER_COLUMNS
+            converted[key] = [
+                None if value != value else (int(value) if is_int else value)
+                for value in values.tolist()
+            ]
+        else:
+            converted[key] = values.tolist()
+
+    keys = list(converted)
+    return [dict(zip(keys, row)) for row in zip(*converted.values())]
+
+
+def _build_batch_results(cities: list[dict], payload: list[dict], *, records: bool = True) -> dict:
+    """Colonne del batch e, con `records=True`, anche i record dict per osservazioni e previsioni."""
+    columns = _extract_batch_columns(cities, payload)
+    if not records:
+        return {"columns": columns}
+    predictions = columns_to_records(columns["predictions"])
+    for record in predictions:
+        record["forecast_source"] = "open-meteo"
+    return {
+        "observations": columns_to_records(columns["observations"]),
+        "predictions": predictions,
+        "columns": columns,
+    }
+
+
+def _build_batch_params(cities: list[dict]) -> dict:
+    """
+    Campi del ciclo orario: quelli per il dataset ML più quelli del frontend pubblico,
+    così ogni comune ha anche uno snapshot servibile da /api/weather.
+    Tempi in epoch UTC; timezone Europe/Rome solo per aggregare i daily per giorno locale.
+    """
+    return {
         "latitude": ",".join(str(c["lat"]) for c in cities),
         "longitude": ",".join(str(c["lon"]) for c in cities),
-        "current": "temperature_2m,relative_humidity_2m,cloud_cover,wind_speed_10m,wind_direction_10m,precipitation,weather_code",
-        "hourly": "temperature_2m,relative_humidity_2m,cloud_cover,wind_speed_10m,wind_direction_10m,precipitation,weather_code",
+        "current": SINGLE_CITY_CURRENT_FIELDS,
+        "hourly": SINGLE_CITY_HOURLY_RICH_FIELDS,
+        "daily": SINGLE_CITY_DAILY_FIELDS,
         "wind_speed_unit": "kmh",
-        "timezone": "UTC",
-        "forecast_hours": max(ML_FORECAST_LEADS) + 1,
+        "timezone": "Europe/Rome",
+        "timeformat": "unixtime",
+        "forecast_days": PUBLIC_FORECAST_DAYS,
+        "forecast_hours": max(max(ML_FORECAST_LEADS) + 1, PUBLIC_HOURLY_FORECAST_HOURS + BATCH_SNAPSHOT_EXTRA_HOURS),
     }
 
-    for retry_index, delay in enumerate((0, *BATCH_RETRY_DELAYS), start=1):
+
+async def fetch_weather_batch(
+    cities: list[dict],
+    client: httpx.AsyncClient,
+    *,
+    retry_delays: tuple[float, ...] = BATCH_RETRY_DELAYS,
+    records: bool = True,
+) -> dict:
+    """
+    Scarica osservazioni correnti e previsioni orarie/giornaliere per un batch di città
+    e aggiorna gli snapshot pubblici per comune.
+    Con `records=False` ritorna solo la forma colonnare, senza ricostruire i record dict.
+    Con `retry_delays=()` un 429 viene propagato subito al chiamante; gli altri errori
+    upstream sollevano OpenMeteoBatchFailed invece di restituire un batch vuoto.
+    """
+    if not cities:
+        if not records:
+            return {"columns": _empty_batch_columns()}
+        return {"observations": [], "predictions": [], "columns": _empty_batch_columns()}
+
+    params = _build_batch_params(cities)
+
+    for retry_index, delay in enumerate((0, *retry_delays), start=1):
         if delay:
             await asyncio.sleep(delay)
         try:
             response = await client.get(OPEN_METEO_URL, params=params, timeout=TIMEOUT)
             response.raise_for_status()
             data = response.json()
+            _record_upstream("open-meteo")
             break
         except httpx.HTTPStatusError as exc:
+            _record_upstream("open-meteo", exc)
             if exc.response is not None and exc.response.status_code == 429:
                 _warn(
                     f"Errore Open-Meteo batch: rate limit 429 sul tentativo {retry_index} "
                     f"(batch di {len(cities)} città)"
                 )
-                if retry_index == len(BATCH_RETRY_DELAYS) + 1:
+                if retry_index == len(retry_delays) + 1:
                     raise OpenMeteoRateLimited("Open-Meteo rate limited the batch fetch") from exc
                 continue
             _warn(f"Errore Open-Meteo batch: {exc}")
-            return {"observations": [], "predictions": []}
+            raise OpenMeteoBatchFailed(str(exc)) from exc
         except Exception as exc:
+            _record_upstream("open-meteo", exc)
             _warn(f"Errore Open-Meteo batch: {exc}")
-            return {"observations": [], "predictions": []}
+            raise OpenMeteoBatchFailed(str(exc)) from exc
 
     payload = data if isinstance(data, list) else [data]
-    return _build_batch_results(cities, payload)
+    # In un thread: con il livello condiviso attivo gli snapshot vengono anche pubblicati lì
+    await asyncio.to_thread(forecast_snapshots.store_batch, cities, payload)
+    return _build_batch_results(cities, payload, records=records)
 
 
-async def fetch_all_cities_weather(cities: list[dict]) -> dict:
+async def fetch_all_cities_weather(
+    cities: list[dict],
+    *,
+    client: httpx.AsyncClient | None = None,
+    limiter: AdaptiveRateLimiter | None = None,
+    concurrency: int = MAX_CONCURRENCY,
+) -> dict:
     """
-    Scarica meteo per tutte le città in batch con pacing prudente per evitare 429.
+    Scarica meteo per tutte le città con più batch in volo, regolati da un token bucket AIMD.
+    I batch respinti con 429 o falliti per errori upstream tornano in coda fino a
+    BATCH_MAX_ATTEMPTS tentativi, poi contano in `failed_batches`.
+    Ritorna solo la forma colonnare (`columns`) e le statistiche del ciclo.
     """
-    all_observations: list[dict] = []
-    all_predictions: list[dict] = []
+    all_columns: list[dict] = []
     batches = [cities[i:i + BATCH_SIZE] for i in range(0, len(cities), BATCH_SIZE)]
+    limiter = limiter or AdaptiveRateLimiter()
+    stats = {
+        "batches": len(batches),
+        "completed_batches": 0,
+        "failed_batches": 0,
+        "requeued_batches": 0,
+        "paused_batches": 0,
+    }
 
-    print(f"[API] Scaricando meteo per {len(cities)} città in {len(batches)} batch...")
-    async with httpx.AsyncClient() as client:
-        for index, batch in enumerate(batches):
+    queue: asyncio.Queue = asyncio.Queue()
+    for batch in batches:
+        queue.put_nowait((batch, 1))
+
+    def retry_or_fail(batch: list[dict], attempt: int, reason: str):
+        if attempt >= BATCH_MAX_ATTEMPTS:
+            stats["failed_batches"] += 1
+            _warn(f"Batch di {len(batch)} città scartato dopo {attempt} tentativi ({reason})")
+        else:
+            stats["requeued_batches"] += 1
+            queue.put_nowait((batch, attempt + 1))
+
+    async def worker(http_client: httpx.AsyncClient):
+        while True:
+            batch, attempt = await queue.get()
             try:
-                result = await fetch_weather_batch(batch, client)
-            except OpenMeteoRateLimited:
-                _warn(
-                    f"Scheduler batch interrotto dopo {index} batch su {len(batches)} "
-                    f"per ridurre la pressione su Open-Meteo"
-                )
-                break
-
-            all_observations.extend(result["observations"])
-            all_predictions.extend(result["predictions"])
-
-            if index < len(batches) - 1:
-                await asyncio.sleep(BATCH_DELAY_SECONDS)
-
-    print(f"[OK] Scaricate {len(all_observations)} osservazioni e {len(all_predictions)} previsioni target-based")
-    return {"observations": all_observations, "predictions": all_predictions}
+                breaker = _breakers["open-meteo"]
+                if not breaker.allow():
+                    if breaker.state == "open":
+                        # Provider giù: il ciclo si ferma invece di consumare i tentativi
+                        stats["paused_batches"] += 1
+                    else:
+                        # Half-open con una prova già in volo: si riprova dopo l'esito
+                        await asyncio.sleep(BREAKER_PROBE_WAIT_SECONDS)
+                        queue.put_nowait((batch, attempt))
+                    continue
+                await limiter.acquire()
+                started = time.monotonic()
+                try:
+                    result = await fetch_weather_batch(batch, http_client, retry_delays=(), records=False)
+                except OpenMeteoRateLimited:
+                    limiter.record_rate_limited()
+                    retry_or_fail(batch, attempt, f"rate attuale {limiter.rate:.2f} batch/s")
+                    continue
+                except OpenMeteoBatchFailed as exc:
+                    # Niente record_success: un errore upstream non deve far salire il rate
+                    retry_or_fail(batch, attempt, str(exc))
+                    continue
+
+                limiter.record_success(time.monotonic() - started)
+                stats["completed_batches"] += 1
+                all_columns.append(result["columns"])
+            except Exception as exc:
+                # Un errore inatteso (snapshot, parsing) non deve fermare il worker e bloccare queue.join()
+                stats["failed_batches"] += 1
+                _warn(f"Batch di {len(batch)} città scartato per errore inatteso: {exc!r}")
+            finally:
+                queue.task_done()
+
+    print(
+        f"[API] Scaricando meteo per {len(cities)} città in {len(batches)} batch "
+        f"(concorrenza {concurrency})..."
+    )
+    started_at = time.monotonic()
+    async with AsyncExitStack() as stack:
+        http_client = client or await stack.enter_async_context(http_pool.borrow_client())
+        workers = [asyncio.create_task(worker(http_client)) for _ in range(max(1, concurrency))]
+        try:
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    stats["elapsed_seconds"] = round(time.monotonic() - started_at, 2)
+    stats["completion_ratio"] = round(stats["completed_batches"] / len(batches), 3) if batches else 1.0
+    stats["final_rate"] = round(limiter.rate, 3)
+    columns = concat_batch_columns(all_columns)
+    print(
+        f"[OK] Scaricate {len(columns['observations']['city_id'])} osservazioni e "
+        f"{len(columns['predictions']['city_id'])} previsioni target-based "
+        f"({stats['completed_batches']}/{stats['batches']} batch in {stats['elapsed_seconds']}s, "
+        f"riaccodati {stats['requeued_batches']}, scartati {stats['failed_batches']})"
+    )
+    return {"columns": columns, "stats": stats}
 
 
 def _build_single_city_params(lat: float, lon: float, hourly_fields: str) -> dict:
@@ -305,12 +882,14 @@ async def _fetch_open_meteo_payload(
         response.raise_for_status()
         data = response.json()
     except httpx.TimeoutException as exc:
+        _record_upstream("open-meteo", exc)
         _warn(
             "Open-Meteo single-city timeout "
             f"({attempt_name}) lat={params.get('latitude')} lon={params.get('longitude')}: {exc}"
         )
         return None
     except httpx.HTTPStatusError as exc:
+        _record_upstream("open-meteo", exc)
         _warn(
             "Open-Meteo single-city http_error "
             f"({attempt_name}) lat={params.get('latitude')} lon={params.get('longitude')} "
@@ -319,12 +898,14 @@ async def _fetch_open_meteo_payload(
         )
         return None
     except httpx.RequestError as exc:
+        _record_upstream("open-meteo", exc)
         _warn(
             "Open-Meteo single-city network_error "
             f"({attempt_name}) lat={params.get('latitude')} lon={params.get('longitude')}: {exc}"
         )
         return None
     except ValueError as exc:
+        _record_upstream("open-meteo", exc)
         _warn(
             "Open-Meteo single-city invalid_json "
             f"({attempt_name}) lat={params.get('latitude')} lon={params.get('longitude')} "
@@ -332,6 +913,7 @@ async def _fetch_open_meteo_payload(
         )
         return None
 
+    _record_upstream("open-meteo")
     return _validate_single_city_payload(data, params=params, attempt_name=attempt_name)
 
 
@@ -339,9 +921,10 @@ def _fetch_open_meteo_payload_via_urllib(*, params: dict, attempt_name: str) ->
     url = f"{OPEN_METEO_URL}?{urlencode(params)}"
     try:
         request = Request(url, headers={"User-Agent": METNO_USER_AGENT})
-        with urlopen(request, timeout=TIMEOUT) as response:
+        with urlopen(request, timeout=PUBLIC_STAGE_DEADLINES_SECONDS["compat-urllib"]) as response:
             body = response.read().decode("utf-8", errors="replace")
     except HTTPError as exc:
+        _record_upstream("open-meteo", exc)
         body = exc.read().decode("utf-8", errors="replace")
         _warn(
             "Open-Meteo single-city http_error "
@@ -350,18 +933,21 @@ def _fetch_open_meteo_payload_via_urllib(*, params: dict, attempt_name: str) ->
         )
         return None
     except URLError as exc:
+        _record_upstream("open-meteo", exc)
         _warn(
             "Open-Meteo single-city network_error "
             f"({attempt_name}) lat={params.get('latitude')} lon={params.get('longitude')}: {exc.reason}"
         )
         return None
     except TimeoutError as exc:
+        _record_upstream("open-meteo", exc)
         _warn(
             "Open-Meteo single-city timeout "
             f"({attempt_name}) lat={params.get('latitude')} lon={params.get('longitude')}: {exc}"
         )
         return None
 
+    _record_upstream("open-meteo")
     try:
         data = json.loads(body)
     except ValueError as exc:
@@ -524,14 +1110,22 @@ async def _fetch_metno_payload(lat: float, lon: float) -> Optional[dict]:
     headers = {"User-Agent": METNO_USER_AGENT}
     params = {"lat": lat, "lon": lon}
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(METNO_URL, params=params, headers=headers, timeout=TIMEOUT)
+        async with http_pool.borrow_client() as client:
+            response = await client.get(
+                METNO_URL,
+                params=params,
+                headers=headers,
+                timeout=PUBLIC_STAGE_DEADLINES_SECONDS["metno"],
+            )
             response.raise_for_status()
             data = response.json()
     except Exception as exc:
+        _record_upstream("met.no", exc)
         _warn(f"Fallback met.no fallito lat={lat} lon={lon}: {exc}")
         return None
 
+    _record_upstream("met.no")
+
     converted = _convert_metno_to_open_meteo_payload(data, lat=lat, lon=lon)
     if not converted:
         _warn(f"Fallback met.no ha restituito payload non convertibile lat={lat} lon={lon}")
@@ -541,50 +1135,283 @@ async def _fetch_metno_payload(lat: float, lon: float) -> Optional[dict]:
 async def fetch_single_city(lat: float, lon: float) -> Optional[dict]:
     """
     Scarica meteo per una singola città per il frontend pubblico.
+    Un payload scaduto da meno di PUBLIC_CACHE_STALE_SECONDS viene servito subito mentre
+    si aggiorna in background; si attende l'upstream solo se la cache non ha nulla.
+    Un solo fetch upstream per chiave: le richieste concorrenti ne attendono il risultato.
+    Se configurato, il livello condiviso viene consultato prima dell'upstream.
     """
-    cached = _get_cached_public_weather(lat, lon)
+    key = _cache_key(lat, lon)
+    cached = _public_weather_cache.lookup(key)
+    if cached is None:
+        cached = await _lookup_shared_public_weather(key)
     if cached is not None:
-        return cached
+        payload, age = cached
+        if age >= PUBLIC_CACHE_TTL_SECONDS:
+            _upstream_fetch_task(lat, lon, background=True)
+        return payload
+
+    # shield: se una richiesta viene annullata il fetch prosegue per gli altri in attesa
+    return await asyncio.shield(_upstream_fetch_task(lat, lon))
+
+
+def _upstream_fetch_task(lat: float, lon: float, *, background: bool = False) -> asyncio.Task:
+    key = _cache_key(lat, lon)
+    task = _inflight_fetches.get(key)
+    if task is not None and task.get_loop() is asyncio.get_running_loop():
+        if not background:
+            _single_flight_stats["coalesced"] += 1
+        return task
+
+    # Il fetch usa le coordinate della cella: il payload vale per tutte le località che vi cadono
+    task = asyncio.get_running_loop().create_task(_fetch_single_city_upstream(*key))
+    _inflight_fetches[key] = task
+    task.add_done_callback(lambda done: _release_inflight(key, done))
+    _single_flight_stats["background_refreshes" if background else "leaders"] += 1
+    return task
+
+
+def _release_inflight(key: tuple[float, float], task: asyncio.Task):
+    if _inflight_fetches.get(key) is task:
+        del _inflight_fetches[key]
+    if not task.cancelled() and task.exception() is not None:
+        _warn(f"Aggiornamento meteo pubblico fallito per {key}: {task.exception()}")
+
+
+def record_public_request(lat: float, lon: float):
+    """Registra una richiesta servita dalla cache live, per scegliere le città da pre-riscaldare."""
+    _public_request_frequency.record(_cache_key(lat, lon))
 
-    async with httpx.AsyncClient() as client:
-        attempts = (
-            ("rich", SINGLE_CITY_HOURLY_RICH_FIELDS),
-            ("compat", SINGLE_CITY_HOURLY_COMPAT_FIELDS),
-        )
 
-        for attempt_name, hourly_fields in attempts:
-            params = _build_single_city_params(lat, lon, hourly_fields)
-            data = await _fetch_open_meteo_payload(client, params=params, attempt_name=attempt_name)
-            if data is not None:
-                if attempt_name == "compat":
-                    logger.warning(
-                        "Open-Meteo single-city fallback_succeeded lat=%s lon=%s attempt=%s",
-                        lat,
-                        lon,
-                        attempt_name,
-                    )
-                _set_cached_public_weather(lat, lon, data)
-                return data
-
-    compat_params = _build_single_city_params(lat, lon, SINGLE_CITY_HOURLY_COMPAT_FIELDS)
-    data = await asyncio.to_thread(
-        _fetch_open_meteo_payload_via_urllib,
-        params=compat_params,
-        attempt_name="compat-urllib",
+def hot_keys_due_for_refresh(limit: int = PUBLIC_WARMUP_TOP_N) -> list[tuple[float, float]]:
+    """Chiavi tra le `limit` più richieste assenti dalla cache o vicine alla scadenza del TTL."""
+    due = []
+    for key, score in _public_request_frequency.top(limit):
+        if score < PUBLIC_WARMUP_MIN_SCORE:
+            break
+        if key in _inflight_fetches:
+            continue
+        age = _public_weather_cache.peek_age(key)
+        if age is None or age >= PUBLIC_CACHE_TTL_SECONDS - PUBLIC_WARMUP_LEAD_SECONDS:
+            due.append(key)
+    return due
+
+
+async def _fetch_public_weather_batch(keys: list[tuple[float, float]], client: httpx.AsyncClient) -> int:
+    """Una richiesta Open-Meteo multi-coordinata con i campi del single-city; ritorna i payload salvati."""
+    params = _build_single_city_params(
+        ",".join(str(lat) for lat, _ in keys),
+        ",".join(str(lon) for _, lon in keys),
+        SINGLE_CITY_HOURLY_RICH_FIELDS,
     )
-    if data is not None:
-        logger.warning("Open-Meteo single-city fallback_succeeded lat=%s lon=%s attempt=%s", lat, lon, "compat-urllib")
-        _set_cached_public_weather(lat, lon, data)
-        return data
+    try:
+        response = await client.get(
+            OPEN_METEO_URL,
+            params=params,
+            timeout=TIMEOUT,
+            headers={"User-Agent": METNO_USER_AGENT},
+        )
+        response.raise_for_status()
+        data = response.json()
+    except (httpx.HTTPError, ValueError) as exc:
+        _record_upstream("open-meteo", exc)
+        _warn(f"Pre-riscaldamento cache fallito per {len(keys)} città: {exc}")
+        return 0
+    _record_upstream("open-meteo")
+
+    payload = data if isinstance(data, list) else [data]
+    stored = 0
+    for (lat, lon), city_data in zip(keys, payload):
+        city_params = {"latitude": lat, "longitude": lon}
+        valid = _validate_single_city_payload(city_data, params=city_params, attempt_name="warmup")
+        if valid is not None:
+            await _store_public_weather(lat, lon, valid)
+            stored += 1
+    return stored
+
+
+async def warm_public_cache(limit: int = PUBLIC_WARMUP_TOP_N) -> dict:
+    """Aggiorna in batch le città più richieste prima che la loro voce in cache scada."""
+    keys = hot_keys_due_for_refresh(limit)
+    result = {"due": len(keys), "refreshed": 0, "batches": 0}
+    if not keys:
+        return result
+
+    async with http_pool.borrow_client() as client:
+        for start in range(0, len(keys), BATCH_SIZE):
+            if not _breakers["open-meteo"].allow():
+                break
+            chunk = keys[start:start + BATCH_SIZE]
+            result["refreshed"] += await _fetch_public_weather_batch(chunk, client)
+            result["batches"] += 1
 
-    data = await _fetch_metno_payload(lat, lon)
-    if data is not None:
+    _warmup_stats["runs"] += 1
+    _warmup_stats["batches"] += result["batches"]
+    _warmup_stats["refreshed"] += result["refreshed"]
+    _warmup_stats["failed"] += result["due"] - result["refreshed"]
+    return result
+
+
+def get_single_flight_stats() -> dict:
+    return {**_single_flight_stats, "inflight": len(_inflight_fetches)}
+
+
+def get_public_freshness(lat: float, lon: float) -> dict:
+    """Freschezza del payload appena servito per (lat, lon), per header e risposta di /api/weather."""
+    age = _public_weather_cache.peek_age(_cache_key(lat, lon)) or 0.0
+    return {
+        "status": "fresh" if age < PUBLIC_CACHE_TTL_SECONDS else "stale",
+        "age_seconds": int(age),
+        "max_age_seconds": PUBLIC_CACHE_TTL_SECONDS,
+        "stale_while_revalidate_seconds": PUBLIC_CACHE_STALE_SECONDS,
+    }
+
+
+async def _run_hedged(stages: list[tuple[str, Callable[[], Awaitable[Optional[dict]]]]]) -> Optional[tuple[str, dict]]:
+    """
+    Avvia le fonti in ordine: la successiva parte quando la precedente fallisce oppure,
+    in parallelo, dopo PUBLIC_HEDGE_DELAY_SECONDS senza risposta. Vince il primo payload
+    valido e le altre vengono annullate. Ogni fonte ha la sua deadline e l'intera
+    richiesta non supera PUBLIC_REQUEST_DEADLINE_SECONDS.
+    Il circuit breaker del provider viene interpellato quando una sua fonte sta per partire:
+    le fonti mai avviate non occupano la prova half-open, che vale per una sola fonte.
+    Ogni provider registra al più un errore per richiesta. Un provider avviato che a fine
+    richiesta non ha ancora un esito (fonti scadute, annullate o fallite senza registrarlo)
+    conta come errore, o come successo se ha dato il payload vincente: le fonti annullate non
+    registrano esiti da sole e un provider bloccato non aprirebbe mai il circuito.
+    """
+    if not stages:
+        return None
+    loop = asyncio.get_running_loop()
+    deadline_at = loop.time() + PUBLIC_REQUEST_DEADLINE_SECONDS
+    pending: dict[asyncio.Task, str] = {}
+    next_stage = 0
+    hedge_at = deadline_at
+    # provider -> True se ammesso come prova half-open (una sola fonte), False se a circuito chiuso
+    admitted: dict[str, bool] = {}
+
+    def admit(name: str) -> bool:
+        """Chiede il permesso al breaker solo quando la fonte parte davvero."""
+        provider = PUBLIC_STAGE_PROVIDERS[name]
+        if provider in admitted:
+            return not admitted[provider]
+        breaker = _breakers[provider]
+        probing = breaker.state == "half_open"
+        if not breaker.allow():
+            return False
+        admitted[provider] = probing
+        return True
+
+    def launch() -> bool:
+        nonlocal next_stage, hedge_at
+        while next_stage < len(stages):
+            name, factory = stages[next_stage]
+            next_stage += 1
+            if not admit(name):
+                continue
+            task = loop.create_task(asyncio.wait_for(factory(), PUBLIC_STAGE_DEADLINES_SECONDS[name]))
+            pending[task] = name
+            hedge_at = loop.time() + PUBLIC_HEDGE_DELAY_SECONDS
+            return True
+        return False
+
+    winner_provider = None
+    outcomes: set[str] = set()
+    outcomes_token = _hedged_outcomes.set(outcomes)
+    launch()
+    try:
+        while pending:
+            now = loop.time()
+            if now >= deadline_at:
+                _hedge_stats["deadline_exceeded"] += 1
+                _warn(
+                    f"Deadline meteo single-city superata ({PUBLIC_REQUEST_DEADLINE_SECONDS}s), "
+                    f"fonti in volo: {', '.join(pending.values())}"
+                )
+                return None
+            wake_at = min(hedge_at, deadline_at) if next_stage < len(stages) else deadline_at
+            done, _ = await asyncio.wait(
+                pending,
+                timeout=max(0.0, wake_at - now),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                if next_stage < len(stages) and loop.time() >= hedge_at:
+                    _hedge_stats["hedged_launches"] += 1
+                    launch()
+                continue
+
+            for task in done:
+                name = pending.pop(task)
+                try:
+                    payload = task.result()
+                except asyncio.TimeoutError as exc:
+                    _hedge_stats["stage_timeouts"] += 1
+                    _warn(f"Fonte meteo {name} oltre la deadline di {PUBLIC_STAGE_DEADLINES_SECONDS[name]}s")
+                    _record_upstream(PUBLIC_STAGE_PROVIDERS[name], exc)
+                    payload = None
+                except Exception as exc:
+                    _warn(f"Fonte meteo {name} fallita: {exc}")
+                    payload = None
+                if payload is not None:
+                    _hedge_stats["winners"][name] += 1
+                    winner_provider = PUBLIC_STAGE_PROVIDERS[name]
+                    return name, payload
+                if next_stage < len(stages):
+                    launch()
+        return None
+    finally:
+        for task, name in pending.items():
+            task.cancel()
+            if PUBLIC_STAGE_PROVIDERS[name] != winner_provider:
+                _hedge_stats["abandoned"] += 1
+        # Ogni provider ammesso chiude qui il suo esito, liberando anche l'eventuale prova half-open
+        for provider in admitted:
+            if provider in outcomes:
+                continue
+            if provider == winner_provider:
+                _record_upstream(provider)
+            else:
+                _record_upstream(provider, TimeoutError(f"nessuna risposta da {provider} entro la richiesta"))
+        _hedged_outcomes.reset(outcomes_token)
+
+
+async def _fetch_single_city_upstream(lat: float, lon: float) -> Optional[dict]:
+    """Fonti rich → compat → urllib → met.no in hedging; popola cache locale e condivisa in caso di successo."""
+    async with http_pool.borrow_client() as client:
+        rich_params = _build_single_city_params(lat, lon, SINGLE_CITY_HOURLY_RICH_FIELDS)
+        compat_params = _build_single_city_params(lat, lon, SINGLE_CITY_HOURLY_COMPAT_FIELDS)
+        # I circuit breaker vengono consultati da _run_hedged all'avvio di ogni fonte:
+        # con il circuito Open-Meteo aperto si va direttamente a met.no
+        stages = [
+            ("rich", lambda: _fetch_open_meteo_payload(client, params=rich_params, attempt_name="rich")),
+            ("compat", lambda: _fetch_open_meteo_payload(client, params=compat_params, attempt_name="compat")),
+            (
+                "compat-urllib",
+                lambda: asyncio.to_thread(
+                    _fetch_open_meteo_payload_via_urllib,
+                    params=compat_params,
+                    attempt_name="compat-urllib",
+                ),
+            ),
+            ("metno", lambda: _fetch_metno_payload(lat, lon)),
+        ]
+        winner = await _run_hedged(stages)
+
+    if winner is None:
+        logger.warning("Open-Meteo single-city fetch failed after fallback lat=%s lon=%s", lat, lon)
+        return None
+
+    name, data = winner
+    if name in {"compat", "compat-urllib"}:
+        logger.warning("Open-Meteo single-city fallback_succeeded lat=%s lon=%s attempt=%s", lat, lon, name)
+    elif name == "metno":
         _warn(f"Single-city weather served via met.no fallback lat={lat} lon={lon}")
-        _set_cached_public_weather(lat, lon, data)
-        return data
+    await _store_public_weather(lat, lon, data)
+    return data
 
-    logger.warning("Open-Meteo single-city fetch failed after fallback lat=%s lon=%s", lat, lon)
-    return None
+
+def get_hedge_stats() -> dict:
+    return {**_hedge_stats, "winners": dict(_hedge_stats["winners"])}
 
 
 WMO_CODES = {